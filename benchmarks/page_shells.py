@@ -0,0 +1,74 @@
+"""
+Compares rendering a page that extends `base.html` as a normal template
+with rendering it through the base template's shell (see `shells.py`).
+
+Run with:
+
+    uv run python benchmarks/page_shells.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+import jinja2
+
+APP_DIR = Path(__file__).parent.parent / "postcode_lookup"
+sys.path.insert(0, str(APP_DIR))
+
+from shells import get_shell, render_bytes  # noqa: E402
+
+NUMBER = 500
+
+PAGE = """{% extends request.base_template %}
+{% block page_title %}Elections in {{ postcode }}{% endblock page_title %}
+{% block content %}<p>There are no upcoming elections in {{ postcode }}</p>
+{% endblock content %}
+{% block related_content %}{% endblock related_content %}
+"""
+
+
+class FakeURL:
+    netloc = "localhost"
+    path = "/"
+
+
+class FakeRequest(dict):
+    url = FakeURL()
+
+    def url_for(self, name, **path_params):
+        return "/"
+
+
+def main():
+    env = jinja2.Environment(
+        loader=jinja2.ChoiceLoader(
+            [
+                jinja2.DictLoader({"page.html": PAGE}),
+                jinja2.FileSystemLoader(APP_DIR / "templates"),
+            ]
+        ),
+        extensions=["jinja2.ext.i18n"],
+        undefined=jinja2.ChainableUndefined,
+    )
+    env.install_null_translations()
+    page = env.get_template("page.html")
+
+    for base in ("base.html", "base_cy.html"):
+        request = FakeRequest(base_template=base)
+        context = {"request": request, "postcode": "SW1A 1AA"}
+        normal = timeit.timeit(
+            lambda: page.render(context).encode(), number=NUMBER
+        )
+        request["base_template"] = get_shell(env, base)
+        shell = timeit.timeit(
+            lambda: render_bytes(page, context), number=NUMBER
+        )
+        print(
+            f"{base:<14} template {normal / NUMBER * 1e6:7.1f}us"
+            f"   shell {shell / NUMBER * 1e6:7.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compares the per-call cost of postcode validation before and after moving to
+`postcodes.PostcodeValidator`.
+
+Run with:
+
+    uv run python benchmarks/postcode_validation.py
+"""
+
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "postcode_lookup"))
+
+from postcodes import postcode_validator  # noqa: E402
+
+POSTCODES = ["SW1A 1AA", "sw1a1aa", "GIR 0AA", "E1 6AN", "FooBar", "M1 1AE"]
+
+
+def legacy_valid_postcode(postcode: str):
+    """
+    The previous implementation from `dc_api_client.valid_postcode`,
+    including the normalisation done in `LiveAPIBackend.get_postcode`
+    """
+    postcode = postcode[:10].upper().replace(" ", "")
+    postcode = str(postcode)[:10]
+    if not postcode:
+        return False
+    outcode_pattern = "[A-PR-UWYZ]([0-9]{1,2}|([A-HIK-Y][0-9](|[0-9]|[ABEHMNPRVWXY]))|[0-9][A-HJKSTUW])"
+    incode_pattern = "[0-9][ABD-HJLNP-UW-Z]{2}"
+    postcode_regex = re.compile(
+        r"^(GIR 0AA|{} {})$".format(outcode_pattern, incode_pattern)
+    )
+    space_regex = re.compile(r" *(%s)$" % incode_pattern)
+
+    postcode = postcode.upper().strip()
+
+    postcode = space_regex.sub(r" \1", postcode)
+    if not postcode_regex.search(postcode):
+        return False
+    return True
+
+
+def bench(label, fn, number=20_000):
+    seconds = timeit.timeit(fn, number=number)
+    per_call = seconds / (number * len(POSTCODES)) * 1_000_000
+    print(f"{label:<40} {per_call:.3f}µs per postcode")
+
+
+if __name__ == "__main__":
+    bench(
+        "legacy valid_postcode",
+        lambda: [legacy_valid_postcode(p) for p in POSTCODES],
+    )
+    bench(
+        "PostcodeValidator.validate",
+        lambda: [postcode_validator.validate(p) for p in POSTCODES],
+    )
+    bench(
+        "PostcodeValidator.validate_many",
+        lambda: list(postcode_validator.validate_many(POSTCODES)),
+    )
@@ -0,0 +1,49 @@
+"""
+Compares the cost of turning a sandbox response into the model used for
+rendering, before and after `SandboxAPIBackend` started returning a
+`models.ValidatedResponse`.
+
+Previously the response was parsed into a `RootModel`, dumped back to a
+dict, then parsed again into a `RootModelPilots` by `results_context`.
+
+Run with:
+
+    uv run python benchmarks/sandbox_parsing.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "postcode_lookup"))
+
+from mock_responses import example_responses  # noqa: E402
+from models import RootModelPilots, ValidatedResponse  # noqa: E402
+from response_builder.v1.models.base import RootModel  # noqa: E402
+
+RESPONSES = [
+    example["response"].build().dict() for example in example_responses.values()
+]
+
+
+def legacy_parse(response: dict):
+    api_json = RootModel.parse_obj(response).dict()
+    return RootModelPilots.from_api_response(api_json)
+
+
+def validated_parse(response: dict):
+    return ValidatedResponse.from_api_response(response).model
+
+
+def bench(label, fn, number=200):
+    seconds = timeit.timeit(fn, number=number)
+    per_call = seconds / (number * len(RESPONSES)) * 1_000
+    print(f"{label:<40} {per_call:.3f}ms per response")
+
+
+if __name__ == "__main__":
+    bench(
+        "RootModel round trip + RootModelPilots",
+        lambda: [legacy_parse(r) for r in RESPONSES],
+    )
+    bench("ValidatedResponse", lambda: [validated_parse(r) for r in RESPONSES])
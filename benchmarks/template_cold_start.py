@@ -0,0 +1,68 @@
+"""
+Measures the cold start cost of the Jinja templates, with and without the
+bytecode cache built by `utils.precompile_templates`.
+
+Each run is a fresh interpreter, timing the import of `utils` and then
+the first load of every English template (including creating the
+environment), as the first requests to a new Lambda container would.
+
+Run with:
+
+    uv run python benchmarks/template_cold_start.py
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+APP_DIR = Path(__file__).parent.parent / "postcode_lookup"
+RUNS = 5
+
+CHILD = """
+import time
+start = time.perf_counter()
+import utils
+imported = time.perf_counter()
+utils.load_all_templates("en")
+loaded = time.perf_counter()
+print(imported - start, loaded - imported)
+"""
+
+
+def run(cache_dir: str):
+    env = {**os.environ, "JINJA_BYTECODE_CACHE_DIR": cache_dir}
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        cwd=APP_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return [float(seconds) for seconds in output.split()]
+
+
+def bench(label: str, cache_dir: str):
+    results = [run(cache_dir) for _ in range(RUNS)]
+    imported = statistics.median(r[0] for r in results) * 1000
+    loaded = statistics.median(r[1] for r in results) * 1000
+    print(f"{label:<28} import {imported:7.1f}ms   first load {loaded:7.1f}ms")
+
+
+if __name__ == "__main__":
+    bench("no bytecode cache", "")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import utils; utils.precompile_templates()",
+            ],
+            cwd=APP_DIR,
+            env={**os.environ, "JINJA_BYTECODE_CACHE_DIR": cache_dir},
+            check=True,
+        )
+        bench("precompiled bytecode cache", cache_dir)
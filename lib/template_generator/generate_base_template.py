@@ -1,6 +1,6 @@
 import hashlib
 import re
-import shutil
+import sys
 from pathlib import Path
 from typing import List
 from urllib.parse import urljoin
@@ -8,6 +8,12 @@ from urllib.parse import urljoin
 from bs4 import BeautifulSoup, Tag
 from rnet import BlockingClient, Impersonate
 
+project_path = Path() / "postcode_lookup"
+sys.path.insert(0, str(project_path))
+
+from assets import prune_stale_assets, write_manifest  # noqa: E402
+from shells import NotShellable, write_shell  # noqa: E402
+
 client = BlockingClient(impersonate=Impersonate.Firefox136)
 
 
@@ -129,6 +135,7 @@ def add_local_font_css(soup):
         len(head.contents),
         BeautifulSoup(
             """
+            {% block extra_head %}
             {% if request.url.netloc != "www.electoralcommission.org.uk" %}
             <style>
             @font-face{
@@ -158,6 +165,7 @@ def add_local_font_css(soup):
             </style>
             {% endif %}
             {% include 'includes/extra_header.html' %}
+            {% endblock extra_head %}
             """,
             "html.parser",
         ),
@@ -272,10 +280,9 @@ def add_head_meta_blocks(soup: BeautifulSoup):
     return soup
 
 
-project_path = Path() / "postcode_lookup"
 static_path = project_path / "static"
-shutil.rmtree(static_path.absolute() / "css", ignore_errors=True)
-shutil.rmtree(static_path.absolute() / "js", ignore_errors=True)
+# Hashed assets by template, for the manifest
+manifest_assets = {}
 
 for template, config in TEMPLATES.items():
     template_path = project_path / "templates" / template
@@ -289,11 +296,30 @@ for template, config in TEMPLATES.items():
     soup = BeautifulSoup(html_text, "html.parser")
     soup.body["id"] = "dc"
     assets = download_assets(soup, static_path, config["source_url"])
+    manifest_assets[template] = {
+        f"{file_type}/{file_name}.{file_type}": f"{file_type}/{hashed_name}"
+        for file_type, files in assets.items()
+        for file_name, hashed_name in files.items()
+    }
     soup = rewrite_urls(soup, config["source_url"])
     soup = rewrite_asset_urls(soup, assets, static_path)
     soup = remove_unwanted_content(soup)
     soup = add_local_font_css(soup)
     soup = add_head_meta_blocks(soup)
 
+    html = soup.prettify()
     with template_path.open("w") as f:
-        f.write(soup.prettify())
+        f.write(html)
+
+    # Anything dynamic in the template has to be inside a block for it to
+    # have a shell. Without one, pages render it as a normal template.
+    try:
+        write_shell(template, html)
+    except NotShellable as e:
+        print(f"Not writing a shell for {template}: {e}")
+
+# Hashed assets in the manifest are cached for a year. Ones older than the
+# previous run's can't be needed by any page still in a cache, so are pruned.
+write_manifest(manifest_assets, static_path)
+for path in prune_stale_assets(static_path):
+    print(f"Pruned {path}")
@@ -4,6 +4,9 @@ from pathlib import Path
 import endpoints.election_information
 import endpoints.electoral_services_team
 import endpoints.utils
+from assets import StaticAssets
+from compression import CompressionMiddleware
+from dc_api_client import built_mock_responses
 from mangum import Mangum
 from starlette.applications import Starlette
 from starlette.middleware import Middleware
@@ -12,10 +15,23 @@ from starlette.responses import RedirectResponse
 from starlette.routing import Mount, Route
 from starlette.staticfiles import StaticFiles
 from starlette_babel import LocaleMiddleware, get_translator
-from utils import ForwardedForMiddleware, i18nMiddleware
+from utils import ForwardedForMiddleware, i18nMiddleware, warm_templates
 
 environment = os.environ.get("DC_ENVIRONMENT", "local")
 
+# Each locale's templates are set up on first use, unless listed here (e.g.
+# "en,cy"). Listed locales are set up while the Lambda initialises, which
+# with provisioned concurrency happens before any requests arrive.
+if warm_locales := os.environ.get("WARM_TEMPLATE_LOCALES"):
+    warm_templates(
+        [locale.strip() for locale in warm_locales.split(",")], load=True
+    )
+
+# Likewise the mock backend's example responses are built on first use,
+# unless WARM_MOCK_RESPONSES is set
+if os.environ.get("WARM_MOCK_RESPONSES") == "1":
+    built_mock_responses.build()
+
 if sentry_dsn := os.environ.get("SENTRY_DSN"):
     import sentry_sdk
     from sentry_sdk.integrations.aws_lambda import AwsLambdaIntegration
@@ -43,6 +59,11 @@ util_routes = [
     Route("/", endpoint=endpoints.utils.redirect_root_to_postcode_form),
     Route("/sections/{section}/", endpoint=endpoints.utils.section_tester),
     Route("/failover", endpoint=endpoints.utils.failover, name="failover"),
+    Route(
+        "/api-client-stats",
+        endpoint=endpoints.utils.api_client_stats_view,
+        name="api_client_stats",
+    ),
     Route(
         "/design-system",
         endpoint=endpoints.utils.design_system_view,
@@ -55,7 +76,7 @@ util_routes = [
     ),
     Mount(
         "/static/",
-        app=StaticFiles(directory=Path(__file__).parent / "static"),
+        app=StaticAssets(directory=Path(__file__).parent / "static"),
         name="static",
     ),
 ]
@@ -138,6 +159,38 @@ election_information_routes = [
         endpoint=endpoints.election_information.mock_postcode_view,
         name="mock_postcode_cy",
     ),
+    # Snapshot, EN
+    Route(
+        "/snapshot/i-am-a/voter/your-election-information",
+        endpoint=endpoints.election_information.snapshot_postcode_form,
+        name="snapshot_postcode_form_en",
+    ),
+    Route(
+        "/snapshot/polling-stations/address/{postcode}/{uprn}",
+        endpoint=endpoints.election_information.snapshot_uprn_view,
+        name="snapshot_uprn_en",
+    ),
+    Route(
+        "/snapshot/polling-stations",
+        endpoint=endpoints.election_information.snapshot_postcode_view,
+        name="snapshot_postcode_en",
+    ),
+    # Snapshot, CY
+    Route(
+        "/cy/snapshot/i-am-a/voter/your-election-information",
+        endpoint=endpoints.election_information.snapshot_postcode_form,
+        name="snapshot_postcode_form_cy",
+    ),
+    Route(
+        "/cy/snapshot/polling-stations/address/{postcode}/{uprn}",
+        endpoint=endpoints.election_information.snapshot_uprn_view,
+        name="snapshot_uprn_cy",
+    ),
+    Route(
+        "/cy/snapshot/polling-stations",
+        endpoint=endpoints.election_information.snapshot_postcode_view,
+        name="snapshot_postcode_cy",
+    ),
 ]
 
 electoral_services_team_routes = [
@@ -189,6 +242,31 @@ electoral_services_team_routes = [
         endpoint=endpoints.electoral_services_team.live_uprn_view,
         name="electoral_services_live_uprn_cy",
     ),
+    # Bulk
+    Route(
+        "/voting-and-elections/get-help-with-my-vote/bulk",
+        endpoint=endpoints.electoral_services_team.live_bulk_view,
+        methods=["POST"],
+        name="electoral_services_live_bulk",
+    ),
+    Route(
+        "/sandbox/voting-and-elections/get-help-with-my-vote/bulk",
+        endpoint=endpoints.electoral_services_team.sandbox_bulk_view,
+        methods=["POST"],
+        name="electoral_services_sandbox_bulk",
+    ),
+    Route(
+        "/mock/voting-and-elections/get-help-with-my-vote/bulk",
+        endpoint=endpoints.electoral_services_team.mock_bulk_view,
+        methods=["POST"],
+        name="electoral_services_mock_bulk",
+    ),
+    Route(
+        "/snapshot/voting-and-elections/get-help-with-my-vote/bulk",
+        endpoint=endpoints.electoral_services_team.snapshot_bulk_view,
+        methods=["POST"],
+        name="electoral_services_snapshot_bulk",
+    ),
     # Sandbox, EN
     Route(
         "/sandbox/voting-and-elections/get-help-with-my-vote/postcode/{postcode}",
@@ -222,6 +300,38 @@ electoral_services_team_routes = [
         endpoint=endpoints.electoral_services_team.mock_postcode_view,
         name="electoral_services_mock_postcode_cy",
     ),
+    # Snapshot, EN
+    Route(
+        "/snapshot/voting-and-elections/get-help-with-my-vote",
+        endpoint=endpoints.electoral_services_team.snapshot_postcode_form,
+        name="electoral_services_snapshot_postcode_form_en",
+    ),
+    Route(
+        "/snapshot/voting-and-elections/get-help-with-my-vote/postcode/{postcode}",
+        endpoint=endpoints.electoral_services_team.snapshot_postcode_view,
+        name="electoral_services_snapshot_postcode_en",
+    ),
+    Route(
+        "/snapshot/voting-and-elections/get-help-with-my-vote/address/{uprn}",
+        endpoint=endpoints.electoral_services_team.snapshot_uprn_view,
+        name="electoral_services_snapshot_uprn_en",
+    ),
+    # Snapshot, CY
+    Route(
+        "/cy/snapshot/pleidleisio-ac-etholiadau/cael-help-gyda-fy-mhleidlais",
+        endpoint=endpoints.electoral_services_team.snapshot_postcode_form,
+        name="electoral_services_snapshot_postcode_form_cy",
+    ),
+    Route(
+        "/cy/snapshot/pleidleisio-ac-etholiadau/cael-help-gyda-fy-mhleidlais/postcode/{postcode}",
+        endpoint=endpoints.electoral_services_team.snapshot_postcode_view,
+        name="electoral_services_snapshot_postcode_cy",
+    ),
+    Route(
+        "/cy/snapshot/pleidleisio-ac-etholiadau/cael-help-gyda-fy-mhleidlais/address/{uprn}",
+        endpoint=endpoints.electoral_services_team.snapshot_uprn_view,
+        name="electoral_services_snapshot_uprn_cy",
+    ),
 ]
 
 routes = (
@@ -240,6 +350,7 @@ app = Starlette(
     debug=(environment != "production"),
     routes=routes,
     middleware=[
+        Middleware(CompressionMiddleware),
         Middleware(i18nMiddleware),
         Middleware(
             LocaleMiddleware,
@@ -251,4 +362,6 @@ app = Starlette(
     ],
 )
 
+# Lambda handler. Mangum buffers whole responses, so `STREAM_RESPONSES`
+# only helps when running under uvicorn (see the README).
 handler = Mangum(app)
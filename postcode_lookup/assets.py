@@ -0,0 +1,127 @@
+"""
+Caching for static assets.
+
+`lib/template_generator/generate_base_template.py` names the CSS and JS it
+downloads after a hash of their content, and lists them in `manifest.json`
+in the static directory. Listed files never change, so `StaticAssets`
+sends them with a year long, immutable `Cache-Control`. Everything else
+(unhashed files, and hashed files left from the previous build) gets a
+short one.
+
+The manifest also remembers the previous build's files, so pages cached
+before a deploy can still load them. Older hashed files are pruned.
+"""
+
+import functools
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from compression import ENCODINGS, PrecompressedStaticFiles
+from starlette.responses import Response
+from starlette.types import Scope
+
+STATIC_DIR = Path(__file__).parent / "static"
+MANIFEST_NAME = "manifest.json"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", 5 * 60))
+
+# e.g. "all.228eb7b84a4f17afaae0bf7b6f038e98.css", as named by the template
+# generator
+HASHED_NAME_RE = re.compile(r"^[^.]+\.[0-9a-f]{32}\.[a-z0-9]+$")
+
+
+def write_manifest(
+    assets: Dict[str, Dict[str, str]], directory: Path = STATIC_DIR
+) -> dict:
+    """
+    Write the manifest for a build, where `assets` maps each base template
+    to its assets' names and hashed paths, e.g.
+    `{"base.html": {"css/all.css": "css/all.228eb7b8....css"}}`.
+
+    The current manifest's files that aren't in `assets` are kept as the
+    previous build's.
+    """
+    current = set()
+    for template_assets in assets.values():
+        current.update(template_assets.values())
+    previous = hashed_files(read_manifest(directory)) - current
+    manifest = {"assets": assets, "previous": sorted(previous)}
+    with (directory / MANIFEST_NAME).open("w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.write("\n")
+    return manifest
+
+
+def read_manifest(directory: Path = STATIC_DIR) -> Optional[dict]:
+    try:
+        with (directory / MANIFEST_NAME).open() as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def hashed_files(manifest: Optional[dict]) -> Set[str]:
+    """
+    Paths (relative to the static directory) of the hashed files the
+    current build uses
+    """
+    if not manifest:
+        return set()
+    return {
+        path
+        for template_assets in manifest["assets"].values()
+        for path in template_assets.values()
+    }
+
+
+def prune_stale_assets(directory: Path = STATIC_DIR) -> List[Path]:
+    """
+    Delete hashed files (and their compressed copies) that neither this
+    build nor the previous one uses, returning the paths deleted.
+
+    Nothing is deleted without a manifest.
+    """
+    manifest = read_manifest(directory)
+    if not manifest:
+        return []
+    keep = hashed_files(manifest) | set(manifest["previous"])
+    pruned = []
+    for path in sorted(directory.rglob("*")):
+        name = path.name
+        for suffix in ENCODINGS.values():
+            name = name.removesuffix(suffix)
+        relative = str(path.relative_to(directory).with_name(name))
+        if (
+            path.is_file()
+            and HASHED_NAME_RE.match(name)
+            and relative not in keep
+        ):
+            path.unlink()
+            pruned.append(path)
+    return pruned
+
+
+@functools.lru_cache(maxsize=None)
+def immutable_files(directory: Path = STATIC_DIR) -> Set[str]:
+    return hashed_files(read_manifest(directory))
+
+
+class StaticAssets(PrecompressedStaticFiles):
+    """
+    Static files, with caching headers from the manifest (see the module
+    docstring)
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 206, 304):
+            if path in immutable_files(Path(self.directory)):
+                cache_control = IMMUTABLE_CACHE_CONTROL
+            else:
+                cache_control = f"public, max-age={STATIC_MAX_AGE}"
+            response.headers["Cache-Control"] = cache_control
+        return response
@@ -0,0 +1,570 @@
+"""
+Cache tiers for aggregator responses.
+
+Each Lambda container has its own memory, so the in-process
+`ResponseCache` (L1) is backed by an optional shared store (L2) that all
+containers can read from. Shared stores hold entries as zlib compressed
+JSON with a version prefix, so an upgrade of `dc-response-builder` (or of
+the entry format) invalidates everything stored by an older deploy.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from importlib.metadata import PackageNotFoundError, version
+from typing import Dict, Hashable, Optional
+from urllib.parse import unquote, urlparse
+
+from response_cache import CachedResponse, ResponseCache
+
+logger = logging.getLogger(__name__)
+
+try:
+    RESPONSE_BUILDER_VERSION = version("dc-response-builder")
+except PackageNotFoundError:
+    RESPONSE_BUILDER_VERSION = "unknown"
+
+ENTRY_FORMAT_VERSION = 3
+ENTRY_PREFIX = f"v{ENTRY_FORMAT_VERSION}:{RESPONSE_BUILDER_VERSION}\n".encode()
+KEY_NAMESPACE = "ec-postcode-lookup"
+
+
+class CacheBackendError(Exception):
+    pass
+
+
+def encode_entry(entry: CachedResponse) -> bytes:
+    """
+    Serialise an entry for a shared store.
+
+    Expiry times are stored as wall clock times, as monotonic clocks aren't
+    comparable between machines.
+    """
+    offset = time.time() - time.monotonic()
+    payload = json.dumps(
+        {
+            "data": entry.data,
+            "size": entry.size,
+            "fresh_until": entry.fresh_until + offset,
+            "stale_until": entry.stale_until + offset,
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+            "projection": entry.projection,
+        },
+        separators=(",", ":"),
+    ).encode()
+    return ENTRY_PREFIX + zlib.compress(payload)
+
+
+def decode_entry(value: bytes) -> Optional[CachedResponse]:
+    """
+    Deserialise an entry written by `encode_entry`.
+
+    Returns `None` for entries written by a different version, or that have
+    expired.
+    """
+    if not value.startswith(ENTRY_PREFIX):
+        return None
+    payload = json.loads(zlib.decompress(value[len(ENTRY_PREFIX) :]))
+    offset = time.time() - time.monotonic()
+    entry = CachedResponse(
+        data=payload["data"],
+        size=payload["size"],
+        fresh_until=payload["fresh_until"] - offset,
+        stale_until=payload["stale_until"] - offset,
+        etag=payload["etag"],
+        last_modified=payload["last_modified"],
+        projection=(
+            tuple(payload["projection"])
+            if payload["projection"] is not None
+            else None
+        ),
+    )
+    if not entry.is_usable():
+        return None
+    return entry
+
+
+def entry_ttl(entry: CachedResponse) -> int:
+    """
+    How long a shared store should keep `entry`, in whole seconds
+    """
+    return max(1, math.ceil(entry.stale_until - time.monotonic()))
+
+
+def key_to_str(key: Hashable) -> str:
+    if isinstance(key, tuple):
+        key = "|".join(str(part) for part in key)
+    return f"{KEY_NAMESPACE}:{key}"
+
+
+class CacheBackend(ABC):
+    """
+    A store for `CachedResponse` entries
+    """
+
+    @abstractmethod
+    async def get(self, key: Hashable) -> Optional[CachedResponse]: ...
+
+    @abstractmethod
+    async def set(self, key: Hashable, entry: CachedResponse): ...
+
+    @abstractmethod
+    async def delete(self, key: Hashable): ...
+
+    async def close(self):
+        return None
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """
+    The per-process tier, wrapping a `ResponseCache`.
+
+    Entries are kept decoded, so hits don't pay for decompressing or
+    parsing.
+    """
+
+    def __init__(self, cache: ResponseCache):
+        self.cache = cache
+
+    async def get(self, key):
+        return self.cache.get(key)
+
+    async def set(self, key, entry):
+        self.cache.put(key, entry)
+
+    async def delete(self, key):
+        self.cache.delete(key)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Stores entries in a local SQLite database.
+
+    Useful for sharing a cache between uvicorn workers on one machine, or
+    for keeping one in Lambda's `/tmp` between container restarts. Queries
+    run in a worker thread so they don't block the event loop.
+
+    Expired rows are purged when the database is opened, and then at most
+    every `purge_interval` seconds as entries are written, so the file
+    doesn't grow without bound.
+    """
+
+    purge_interval = 10 * 60
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires REAL NOT NULL
+            )
+            """
+        )
+        self._purge_expired()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchone()
+
+    def _purge_expired(self):
+        self._last_purge = time.monotonic()
+        self._execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+
+    async def get(self, key):
+        row = await asyncio.to_thread(
+            self._execute,
+            "SELECT value FROM cache WHERE key = ? AND expires > ?",
+            (key_to_str(key), time.time()),
+        )
+        if not row:
+            return None
+        return decode_entry(row[0])
+
+    async def set(self, key, entry):
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (
+                key_to_str(key),
+                encode_entry(entry),
+                time.time() + entry_ttl(entry),
+            ),
+        )
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            await self.purge_expired()
+
+    async def delete(self, key):
+        await asyncio.to_thread(
+            self._execute, "DELETE FROM cache WHERE key = ?", (key_to_str(key),)
+        )
+
+    async def purge_expired(self):
+        await asyncio.to_thread(self._purge_expired)
+
+    async def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class ServerCacheBackend(CacheBackend):
+    """
+    A base for stores on a cache server, reached over TCP.
+
+    Each event loop gets a small pool of connections, each used for one
+    command at a time. Every command has a short timeout, which includes
+    waiting for a free connection, so a slow cache never makes a lookup
+    slower than going to the aggregator.
+    """
+
+    def __init__(
+        self, host: str, port: int, timeout: float, max_connections: int
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._loop = None
+        self._slots: asyncio.Semaphore = None
+        self._idle: list = []
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        await self._setup(reader, writer)
+        return reader, writer
+
+    async def _setup(self, reader, writer):
+        """
+        Prepare a new connection for use, e.g. by authenticating
+        """
+
+    async def run(self, fn, *args):
+        """
+        Call `fn(reader, writer, *args)` with a connection from the pool
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_connections)
+            self._idle = []
+        async with asyncio.timeout(self.timeout), self._slots:
+            connection = self._idle.pop() if self._idle else None
+            try:
+                if connection is None or connection[1].is_closing():
+                    connection = await self._connect()
+                result = await fn(*connection, *args)
+            except BaseException:
+                # The connection may be part way through a reply, so it
+                # can't be trusted for the next command
+                if connection is not None:
+                    connection[1].close()
+                raise
+            self._idle.append(connection)
+            return result
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+class RedisCacheBackend(ServerCacheBackend):
+    """
+    Stores entries in Redis (or anything that speaks the Redis protocol,
+    e.g. ElastiCache or Valkey).
+
+    This is a deliberately minimal client, supporting only the commands we
+    need.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 6379,
+        db: int = 0,
+        password: str = None,
+        timeout: float = 0.25,
+        max_connections: int = 4,
+    ):
+        super().__init__(host, port, timeout, max_connections)
+        self.db = db
+        self.password = password
+
+    async def _setup(self, reader, writer):
+        if self.password:
+            await self._send(reader, writer, "AUTH", self.password)
+        if self.db:
+            await self._send(reader, writer, "SELECT", self.db)
+
+    async def _send(self, reader, writer, *args):
+        command = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            command.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        writer.write(b"".join(command))
+        await writer.drain()
+        return await self._read_reply(reader)
+
+    async def _read_reply(self, reader):
+        line = await reader.readline()
+        if not line:
+            raise CacheBackendError("connection closed")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode()
+        if prefix == b"-":
+            raise CacheBackendError(rest.decode())
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = await reader.readexactly(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            return [await self._read_reply(reader) for _ in range(int(rest))]
+        raise CacheBackendError(f"unexpected reply {line!r}")
+
+    async def command(self, *args):
+        return await self.run(self._send, *args)
+
+    async def get(self, key):
+        value = await self.command("GET", key_to_str(key))
+        if value is None:
+            return None
+        return decode_entry(value)
+
+    async def set(self, key, entry):
+        await self.command(
+            "SET", key_to_str(key), encode_entry(entry), "EX", entry_ttl(entry)
+        )
+
+    async def delete(self, key):
+        await self.command("DEL", key_to_str(key))
+
+
+class MemcachedCacheBackend(ServerCacheBackend):
+    """
+    Stores entries in Memcached (e.g. ElastiCache for Memcached), using the
+    text protocol.
+
+    Memcached keys can't contain spaces and are limited to 250 bytes, so
+    keys are hashed.
+    """
+
+    # Memcached reads longer expiry times as Unix timestamps
+    MAX_TTL = 30 * 24 * 60 * 60
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 11211,
+        timeout: float = 0.25,
+        max_connections: int = 4,
+    ):
+        super().__init__(host, port, timeout, max_connections)
+
+    @staticmethod
+    def key(key: Hashable) -> bytes:
+        digest = hashlib.sha256(key_to_str(key).encode()).hexdigest()
+        return f"{KEY_NAMESPACE}:{digest}".encode()
+
+    async def _reply(self, reader, writer, command: bytes) -> bytes:
+        writer.write(command)
+        await writer.drain()
+        line = await reader.readline()
+        if not line:
+            raise CacheBackendError("connection closed")
+        if line.startswith((b"ERROR", b"CLIENT_ERROR", b"SERVER_ERROR")):
+            raise CacheBackendError(line.decode().strip())
+        return line
+
+    async def _get(self, reader, writer, key):
+        line = await self._reply(reader, writer, b"get %s\r\n" % key)
+        value = None
+        while line != b"END\r\n":
+            parts = line.split()
+            if parts[0] != b"VALUE":
+                raise CacheBackendError(f"unexpected reply {line!r}")
+            value = (await reader.readexactly(int(parts[3]) + 2))[:-2]
+            line = await reader.readline()
+        return value
+
+    async def _set(self, reader, writer, key, value, ttl):
+        line = await self._reply(
+            reader,
+            writer,
+            b"set %s 0 %d %d\r\n%s\r\n" % (key, ttl, len(value), value),
+        )
+        if line != b"STORED\r\n":
+            raise CacheBackendError(f"unexpected reply {line!r}")
+
+    async def _delete(self, reader, writer, key):
+        line = await self._reply(reader, writer, b"delete %s\r\n" % key)
+        if line not in (b"DELETED\r\n", b"NOT_FOUND\r\n"):
+            raise CacheBackendError(f"unexpected reply {line!r}")
+
+    async def get(self, key):
+        value = await self.run(self._get, self.key(key))
+        if value is None:
+            return None
+        return decode_entry(value)
+
+    async def set(self, key, entry):
+        await self.run(
+            self._set,
+            self.key(key),
+            encode_entry(entry),
+            min(entry_ttl(entry), self.MAX_TTL),
+        )
+
+    async def delete(self, key):
+        await self.run(self._delete, self.key(key))
+
+
+class TieredCache(CacheBackend):
+    """
+    Reads from the in-process tier first, then the shared tier, promoting
+    shared hits into the in-process tier. Writes go to both.
+
+    Writes to the shared tier run in the background, so they don't hold up
+    the response. On Lambda a write still pending when the response is
+    sent finishes during the container's next invocation, or is lost if the
+    container is recycled; either way the cost is a shared cache miss.
+
+    Errors from the shared tier are logged and treated as a miss: the cache
+    is an optimisation and must never take the site down.
+    """
+
+    def __init__(self, l1: CacheBackend, l2: CacheBackend = None):
+        self.l1 = l1
+        self.l2 = l2
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.l2_errors = 0
+        self._writes: Dict[Hashable, asyncio.Task] = {}
+
+    async def _l2(self, method, *args):
+        try:
+            return await getattr(self.l2, method)(*args)
+        except (
+            OSError,
+            EOFError,
+            TimeoutError,
+            ValueError,
+            zlib.error,
+            sqlite3.Error,
+            CacheBackendError,
+        ):
+            self.l2_errors += 1
+            logger.warning("Shared cache %s failed", method, exc_info=True)
+            return None
+
+    async def get(self, key):
+        entry = await self.l1.get(key)
+        if entry is not None or self.l2 is None:
+            return entry
+        entry = await self._l2("get", key)
+        if entry is None:
+            self.l2_misses += 1
+            return None
+        self.l2_hits += 1
+        await self.l1.set(key, entry)
+        return entry
+
+    async def set(self, key, entry):
+        await self.l1.set(key, entry)
+        if self.l2 is not None:
+            task = asyncio.create_task(self._l2("set", key, entry))
+            self._writes[key] = task
+            task.add_done_callback(lambda task: self._write_done(key, task))
+
+    def _write_done(self, key, task: asyncio.Task):
+        if self._writes.get(key) is task:
+            del self._writes[key]
+
+    async def delete(self, key):
+        await self.l1.delete(key)
+        if self.l2 is not None:
+            # Don't let a pending write put the entry back afterwards
+            await self.flush(key)
+            await self._l2("delete", key)
+
+    async def flush(self, *keys):
+        """
+        Wait for pending writes to the shared tier, for `keys` or for
+        everything
+        """
+        loop = asyncio.get_running_loop()
+        pending = [
+            task
+            for key, task in list(self._writes.items())
+            if task.get_loop() is loop and (not keys or key in keys)
+        ]
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def close(self):
+        if self.l2 is not None:
+            await self.flush()
+            await self.l2.close()
+
+    @property
+    def stats(self) -> dict:
+        stats = {}
+        if isinstance(self.l1, InMemoryCacheBackend):
+            stats.update(self.l1.cache.stats)
+        if self.l2 is not None:
+            stats.update(
+                {
+                    "shared_backend": type(self.l2).__name__,
+                    "shared_hits": self.l2_hits,
+                    "shared_misses": self.l2_misses,
+                    "shared_errors": self.l2_errors,
+                }
+            )
+        return stats
+
+
+def cache_backend_from_url(url: str) -> Optional[CacheBackend]:
+    """
+    Build a shared cache backend from a URL, e.g.:
+
+    * `sqlite:///tmp/aggregator-cache.db`
+    * `redis://:password@cache.example.com:6379/0`
+    * `memcached://cache.example.com:11211`
+    * `memory://` (a separate in-process store, for testing)
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        return SQLiteCacheBackend(parsed.path)
+    if parsed.scheme == "redis":
+        return RedisCacheBackend(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(parsed.path.lstrip("/") or 0),
+            password=unquote(parsed.password) if parsed.password else None,
+        )
+    if parsed.scheme == "memcached":
+        return MemcachedCacheBackend(
+            host=parsed.hostname or "localhost", port=parsed.port or 11211
+        )
+    if parsed.scheme == "memory":
+        return InMemoryCacheBackend(ResponseCache())
+    raise ValueError(f"Unknown cache backend: {url}")
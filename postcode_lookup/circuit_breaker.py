@@ -0,0 +1,155 @@
+import logging
+import time
+from collections import deque
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class BreakerState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream service while it's failing or slow.
+
+    While CLOSED, calls are allowed and their outcomes recorded over a
+    rolling `window` of seconds. Once at least `min_calls` have been made
+    in the window, the breaker trips to OPEN if the proportion of failed
+    calls reaches `error_rate_threshold`, or the proportion of calls slower
+    than `slow_call_seconds` reaches `slow_call_rate_threshold`.
+
+    While OPEN, calls are rejected without being made. After `open_seconds`
+    the breaker goes HALF_OPEN and lets `half_open_calls` probe calls
+    through: if they all succeed (and aren't slow) it closes again,
+    otherwise it re-opens.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: float = 30,
+        min_calls: int = 10,
+        error_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 3,
+        slow_call_rate_threshold: float = 0.8,
+        open_seconds: float = 15,
+        half_open_calls: int = 3,
+    ):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self.state = BreakerState.CLOSED
+        self.opened_at = None
+        self.trips = 0
+        self.rejected = 0
+        # (time, failed, slow) for each call in the window
+        self._calls = deque()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+    def allow(self) -> bool:
+        """
+        Should a call be made now?
+
+        Callers that get `True` must report the outcome with
+        `record_success` or `record_failure`.
+        """
+        if self.state == BreakerState.OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self._transition(BreakerState.HALF_OPEN)
+
+        if self.state == BreakerState.HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_calls:
+                self.rejected += 1
+                return False
+            self._probes_in_flight += 1
+        return True
+
+    def record_success(self, duration: float):
+        slow = duration >= self.slow_call_seconds
+        if self.state == BreakerState.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if slow:
+                self._trip()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._transition(BreakerState.CLOSED)
+            return
+        self._record(failed=False, slow=slow)
+
+    def record_failure(self, duration: float):
+        if self.state == BreakerState.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            self._trip()
+            return
+        self._record(failed=True, slow=duration >= self.slow_call_seconds)
+
+    def release(self):
+        """
+        Report that an allowed call was abandoned (e.g. cancelled) before we
+        found out how it went
+        """
+        if self.state == BreakerState.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def _record(self, failed: bool, slow: bool):
+        now = time.monotonic()
+        self._calls.append((now, failed, slow))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+        if self.state != BreakerState.CLOSED:
+            return
+        total = len(self._calls)
+        if total < self.min_calls:
+            return
+        failures = sum(1 for call in self._calls if call[1])
+        slow_calls = sum(1 for call in self._calls if call[2])
+        if (
+            failures / total >= self.error_rate_threshold
+            or slow_calls / total >= self.slow_call_rate_threshold
+        ):
+            self._trip()
+
+    def _trip(self):
+        self.trips += 1
+        self.opened_at = time.monotonic()
+        self._transition(BreakerState.OPEN)
+
+    def _transition(self, state: BreakerState):
+        if state == self.state:
+            return
+        logger.warning(
+            "Circuit breaker %s: %s -> %s",
+            self.name,
+            self.state.value,
+            state.value,
+        )
+        self.state = state
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == BreakerState.CLOSED:
+            self._calls.clear()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "state": self.state.value,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "calls_in_window": len(self._calls),
+            "failures_in_window": sum(1 for call in self._calls if call[1]),
+        }
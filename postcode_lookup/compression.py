@@ -0,0 +1,269 @@
+"""
+Compressing responses.
+
+HTML and JSON responses are compressed as they're sent, by
+`CompressionMiddleware`. Static files don't change between deploys, so they
+are compressed once, when the app is built (see `precompress`), and
+`PrecompressedStaticFiles` sends the compressed copies.
+
+Brotli is used when the client accepts it, and gzip otherwise. `brotli`
+is a dependency, but without it (e.g. in an out of date environment) we
+fall back to gzip.
+"""
+
+import gzip
+import importlib.util
+import os
+import stat
+import zlib
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+if importlib.util.find_spec("brotli") is not None:
+    import brotli
+else:
+    brotli = None
+
+# Responses smaller than this aren't worth compressing
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+# Lambda gives us a fraction of a vCPU, and higher levels cost a lot more
+# CPU for a few percent smaller pages
+GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 5))
+BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 4))
+
+COMPRESSIBLE_TYPES = ("text/html", "application/json")
+
+# Content codings, in order of preference, and the suffixes of the
+# precompressed files for them
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> set:
+    """
+    The content codings an `Accept-Encoding` header allows
+    """
+    encodings = set()
+    for part in (accept_encoding or "").split(","):
+        coding, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if coding.strip() and quality > 0:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+def preferred_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    The content coding to compress a response with, or `None` to send it
+    as it is
+    """
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """
+    The ETag of `etag`'s representation with a content coding. Each
+    encoding of a page is a different representation, so needs a
+    different strong ETag.
+    """
+    if encoding == "identity":
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+class Compressor:
+    """
+    Compresses a body a chunk at a time, flushing after each chunk so a
+    streamed page still arrives as it renders
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            # wbits of 16 + 15 gives a gzip header and trailer
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        if self.encoding == "br":
+            compressed = self._brotli.process(data)
+            if finish:
+                return compressed + self._brotli.finish()
+            return compressed + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(
+            zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH
+        )
+
+
+def is_compressible(status: int, headers: Headers) -> bool:
+    if status in (204, 304) or "content-encoding" in headers:
+        # e.g. pages from the page cache, which are compressed already
+        return False
+    if "no-transform" in headers.get("cache-control", "").lower():
+        return False
+    content_type = headers.get("content-type", "").split(";")[0].strip()
+    return content_type in COMPRESSIBLE_TYPES
+
+
+class CompressionMiddleware:
+    """
+    Compresses HTML and JSON responses of at least `minimum_size` bytes,
+    with the best encoding the client accepts.
+
+    Streamed responses are compressed as they're sent. ETags are changed to
+    `encoded_etag`s, as the compressed body is a different representation.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = preferred_encoding(
+            Headers(scope=scope).get("accept-encoding")
+        )
+        start: Optional[Message] = None
+        compressor: Optional[Compressor] = None
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # Hold the headers back until we know if the body will be
+                # compressed
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                if start is not None:
+                    await send(start)
+                    start = None
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                if is_compressible(start["status"], headers):
+                    headers.add_vary_header("Accept-Encoding")
+                    if encoding and (
+                        more_body or len(body) >= self.minimum_size
+                    ):
+                        compressor = Compressor(encoding)
+                        headers["Content-Encoding"] = encoding
+                        if etag := headers.get("etag"):
+                            headers["ETag"] = encoded_etag(etag, encoding)
+                        if "content-length" in headers:
+                            del headers["Content-Length"]
+                        body = compressor.compress(body, finish=not more_body)
+                        if not more_body:
+                            headers["Content-Length"] = str(len(body))
+                await send(start)
+                start = None
+            elif compressor is not None:
+                body = compressor.compress(body, finish=not more_body)
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    `StaticFiles` that sends the `.br` or `.gz` copy of a file written by
+    `precompress`, if there's one the client accepts that's up to date
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        if not isinstance(response, FileResponse):
+            return response
+        response.headers.add_vary_header("Accept-Encoding")
+        accepted = accepted_encodings(
+            Headers(scope=scope).get("accept-encoding")
+        )
+        for encoding, suffix in ENCODINGS.items():
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(
+                self.lookup_path, path + suffix
+            )
+            if (
+                stat_result is None
+                or not stat.S_ISREG(stat_result.st_mode)
+                or stat_result.st_mtime < os.stat(response.path).st_mtime
+            ):
+                continue
+            encoded = self.file_response(full_path, stat_result, scope)
+            # A 304 for the compressed copy has nothing to change
+            if isinstance(encoded, FileResponse):
+                encoded.headers["Content-Type"] = response.media_type
+                encoded.headers["Content-Encoding"] = encoding
+                encoded.headers.add_vary_header("Accept-Encoding")
+            return encoded
+        return response
+
+
+STATIC_DIR = Path(__file__).parent / "static"
+PRECOMPRESSIBLE_SUFFIXES = (".css", ".js", ".svg", ".json", ".map", ".txt")
+
+
+def precompressed_copies(
+    path: Path, data: bytes
+) -> Iterator[Tuple[Path, bytes]]:
+    yield (
+        path.with_name(path.name + ENCODINGS["gzip"]),
+        gzip.compress(data, compresslevel=9, mtime=0),
+    )
+    if brotli is not None:
+        yield (
+            path.with_name(path.name + ENCODINGS["br"]),
+            brotli.compress(data, quality=11),
+        )
+
+
+def precompress(
+    directory: Path = STATIC_DIR, minimum_size: int = COMPRESSION_MIN_SIZE
+) -> int:
+    """
+    Write a compressed copy next to each static file that's worth
+    compressing, at the highest levels, as it only happens once.
+
+    Run by the build (see the Makefile), returning the number of copies
+    written.
+    """
+    written = 0
+    for path in sorted(directory.rglob("*")):
+        if (
+            path.suffix not in PRECOMPRESSIBLE_SUFFIXES
+            or not path.is_file()
+            or path.stat().st_size < minimum_size
+        ):
+            continue
+        data = path.read_bytes()
+        for copy_path, compressed in precompressed_copies(path, data):
+            if len(compressed) >= len(data):
+                continue
+            copy_path.write_bytes(compressed)
+            written += 1
+    return written
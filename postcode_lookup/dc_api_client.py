@@ -1,13 +1,30 @@
-import re
+import asyncio
+import functools
+import importlib.util
+import os
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from copy import deepcopy
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Optional
 from urllib.parse import urljoin
 
 import httpx
+from cache_backends import (
+    InMemoryCacheBackend,
+    TieredCache,
+    cache_backend_from_url,
+)
+from circuit_breaker import CircuitBreaker
+from hedging import RequestHedger
 from mock_responses import example_responses
+from models import ValidatedResponse
+from postcodes import postcode_validator
+from prefetch import Prefetcher, prefetching
 from response_builder.v1.builders.base import RootBuilder
-from response_builder.v1.models.base import RootModel
 from response_builder.v1.sandbox import SANDBOX_BASE_URL, SANDBOX_POSTCODES
+from response_cache import CachedResponse, ResponseCache, freshness_lifetime
+from snapshot import SnapshotReader, address_key, postcode_key
 from starlette.requests import Request
 
 
@@ -33,31 +50,346 @@ class ApiError(Exception):
         self.status_code = status_code
 
 
-def valid_postcode(postcode: str):
-    postcode = str(postcode)[:10]
-    if not postcode:
-        return False
-    outcode_pattern = "[A-PR-UWYZ]([0-9]{1,2}|([A-HIK-Y][0-9](|[0-9]|[ABEHMNPRVWXY]))|[0-9][A-HJKSTUW])"
-    incode_pattern = "[0-9][ABD-HJLNP-UW-Z]{2}"
-    postcode_regex = re.compile(
-        r"^(GIR 0AA|{} {})$".format(outcode_pattern, incode_pattern)
-    )
-    space_regex = re.compile(r" *(%s)$" % incode_pattern)
+# Connection pool and timeout settings for the shared aggregator client.
+# These can be tuned per environment without a code change.
+HTTP_CLIENT_LIMITS = httpx.Limits(
+    max_connections=int(os.environ.get("API_MAX_CONNECTIONS", 50)),
+    max_keepalive_connections=int(
+        os.environ.get("API_MAX_KEEPALIVE_CONNECTIONS", 20)
+    ),
+    keepalive_expiry=float(os.environ.get("API_KEEPALIVE_EXPIRY", 120)),
+)
+HTTP_CLIENT_TIMEOUT = httpx.Timeout(
+    connect=float(os.environ.get("API_CONNECT_TIMEOUT", 2)),
+    read=float(os.environ.get("API_READ_TIMEOUT", 8)),
+    write=5,
+    pool=2,
+)
+# HTTP/2 needs `h2`, from `httpx[http2]` in the dependencies. Without it
+# (e.g. in an out of date environment) we fall back to HTTP/1.1
+HTTP_CLIENT_HTTP2 = (
+    os.environ.get("API_HTTP2", "1") == "1"
+    and importlib.util.find_spec("h2") is not None
+)
+
+# The most time we'll spend waiting for the aggregator on one request. On
+# Lambda this is further limited by the time left before the function times
+# out, less API_DEADLINE_RESERVE seconds to render and return a page.
+API_REQUEST_BUDGET = float(os.environ.get("API_REQUEST_BUDGET", 10))
+API_DEADLINE_RESERVE = float(os.environ.get("API_DEADLINE_RESERVE", 2))
+
+_http_client: httpx.AsyncClient = None
+_http_client_loop: asyncio.AbstractEventLoop = None
+_sync_http_client: httpx.Client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the process wide `httpx.AsyncClient` used to talk to the
+    aggregator API.
+
+    The client is created on first use and then kept for the lifetime of the
+    process, so warm Lambda invocations and requests handled by the same
+    uvicorn worker reuse open keep-alive connections rather than paying for
+    a new TCP and TLS handshake on every lookup.
+
+    Connections are bound to the event loop they were opened on, so a new
+    client is made if we're ever called from a different loop.
+    """
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if (
+        _http_client is None
+        or _http_client.is_closed
+        or _http_client_loop is not loop
+    ):
+        _http_client = httpx.AsyncClient(
+            limits=HTTP_CLIENT_LIMITS,
+            timeout=HTTP_CLIENT_TIMEOUT,
+            http2=HTTP_CLIENT_HTTP2,
+        )
+        _http_client_loop = loop
+    return _http_client
+
+
+def get_sync_http_client() -> httpx.Client:
+    """
+    Return the process wide `httpx.Client` used by the synchronous lookups,
+    e.g. `get_postcode`.
+
+    It has the same limits and timeouts as `get_http_client`, and is kept
+    for the lifetime of the process for the same reason.
+    """
+    global _sync_http_client
+    if _sync_http_client is None or _sync_http_client.is_closed:
+        _sync_http_client = httpx.Client(
+            limits=HTTP_CLIENT_LIMITS,
+            timeout=HTTP_CLIENT_TIMEOUT,
+            http2=HTTP_CLIENT_HTTP2,
+        )
+    return _sync_http_client
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into a single call.
+
+    The first caller for a key starts the work as a task. Anyone else asking
+    for the same key while it's running awaits that task, and gets its
+    result or exception, rather than starting their own.
+
+    The work runs in its own task so that a cancelled caller (e.g. a client
+    disconnecting) doesn't cancel it for everyone else waiting on it. Its
+    result still fills the cache. Callers passing `foreground=False` (e.g.
+    prefetches) don't get that: when one is cancelled and no foreground
+    caller is waiting on the work, the work is cancelled too.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        # Foreground callers waiting on each task
+        self._foreground_waiters: Dict[asyncio.Task, int] = {}
+        self.calls = 0
+        self.collapsed = 0
+        self.cancelled = 0
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable],
+        foreground: bool = True,
+    ):
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.collapsed += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            self._foreground_waiters[task] = 0
+            task.add_done_callback(functools.partial(self._done, key))
+        if foreground:
+            self._foreground_waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if (
+                not foreground
+                and not task.done()
+                and not self._foreground_waiters.get(task)
+            ):
+                self.cancelled += 1
+                task.cancel()
+            raise
+        finally:
+            if foreground and task in self._foreground_waiters:
+                self._foreground_waiters[task] -= 1
+
+    def _done(self, key, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        self._foreground_waiters.pop(task, None)
+        if not task.cancelled():
+            # Mark the exception as retrieved, callers will have seen it
+            task.exception()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "cancelled": self.cancelled,
+            "in_flight": len(self._in_flight),
+        }
+
+
+class NegativeResultCache:
+    """
+    Remembers which requests the aggregator told us were invalid.
+
+    Invalid postcodes and unknown UPRNs are mostly bots and mistyped URLs
+    asking for the same keys over and over. Keeping them here, rather than
+    in the response cache, means they're kept for a shorter time and can't
+    push real responses out of the cache.
+    """
+
+    def __init__(self, max_entries: int = 5000, ttl: float = 30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple] = OrderedDict()
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, key: Hashable, exception: Exception):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, type(exception))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def check(self, key: Hashable):
+        """
+        Raise the remembered exception for `key`, if there is one
+        """
+        if key not in self._entries:
+            return
+        expires, exception_class = self._entries[key]
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return
+        self.hits += 1
+        raise exception_class()
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+
+    @property
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits}
+
+
+# Shared by every endpoint, so the HTML and JSON views of the same postcode
+# reuse a single upstream response.
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("API_CACHE_MAX_ENTRIES", 2000)),
+    max_bytes=int(os.environ.get("API_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    ttl=float(os.environ.get("API_CACHE_TTL", 60)),
+    stale_ttl=float(os.environ.get("API_CACHE_STALE_TTL", 300)),
+)
+
+# The in-process cache, backed by an optional store shared between all
+# instances of the app, e.g. `redis://...` or `sqlite:///tmp/cache.db`
+api_cache = TieredCache(
+    l1=InMemoryCacheBackend(response_cache),
+    l2=cache_backend_from_url(os.environ.get("API_CACHE_URL")),
+)
+
+negative_cache = NegativeResultCache(
+    max_entries=int(os.environ.get("API_NEGATIVE_CACHE_MAX_ENTRIES", 5000)),
+    ttl=float(os.environ.get("API_NEGATIVE_CACHE_TTL", 30)),
+)
+
+# One per upstream host, created on first use
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(base_url: str) -> CircuitBreaker:
+    if base_url not in circuit_breakers:
+        circuit_breakers[base_url] = CircuitBreaker(
+            name=base_url,
+            window=float(os.environ.get("API_BREAKER_WINDOW", 30)),
+            min_calls=int(os.environ.get("API_BREAKER_MIN_CALLS", 10)),
+            error_rate_threshold=float(
+                os.environ.get("API_BREAKER_ERROR_RATE", 0.5)
+            ),
+            slow_call_seconds=float(
+                os.environ.get("API_BREAKER_SLOW_CALL_SECONDS", 3)
+            ),
+            slow_call_rate_threshold=float(
+                os.environ.get("API_BREAKER_SLOW_CALL_RATE", 0.8)
+            ),
+            open_seconds=float(os.environ.get("API_BREAKER_OPEN_SECONDS", 15)),
+        )
+    return circuit_breakers[base_url]
+
+
+# Optionally send a second request when the first is slower than usual.
+# Off by default, as it adds (a capped amount of) load to the aggregator.
+API_HEDGING = os.environ.get("API_HEDGING", "0") == "1"
+hedgers: Dict[str, RequestHedger] = {}
+
+
+def get_hedger(base_url: str) -> RequestHedger:
+    if base_url not in hedgers:
+        hedgers[base_url] = RequestHedger(
+            percentile=float(os.environ.get("API_HEDGE_PERCENTILE", 95)),
+            min_delay=float(os.environ.get("API_HEDGE_MIN_DELAY", 0.05)),
+            max_delay=float(os.environ.get("API_HEDGE_MAX_DELAY", 2)),
+            max_extra_load=float(
+                os.environ.get("API_HEDGE_MAX_EXTRA_LOAD", 0.05)
+            ),
+        )
+    return hedgers[base_url]
+
+
+# Only one upstream fetch per (backend, endpoint, params) at a time
+upstream_requests = SingleFlight()
+
+# Upstream Cache-Control/Expires headers set the TTL of cached responses,
+# up to this many seconds. API_CACHE_TTL is used when there aren't any.
+API_CACHE_MAX_TTL = float(os.environ.get("API_CACHE_MAX_TTL", 3600))
+
+# Speculatively fetch UPRNs behind address pickers. Only on long running
+# servers: Lambda freezes the execution environment once a response is
+# sent (whether through Mangum or the Lambda Web Adapter), so background
+# work stalls there.
+API_PREFETCH = os.environ.get("API_PREFETCH", "0") == "1"
+ON_LAMBDA = "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+prefetcher = Prefetcher(
+    max_per_request=int(os.environ.get("API_PREFETCH_MAX_PER_REQUEST", 10)),
+    max_concurrent=int(os.environ.get("API_PREFETCH_MAX_CONCURRENT", 4)),
+    busy_threshold=int(os.environ.get("API_PREFETCH_BUSY_THRESHOLD", 8)),
+)
+
+# Hold references to background refreshes so they aren't garbage collected
+# before they finish
+_background_tasks = set()
+
+
+def _background_refresh_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled():
+        # A failed refresh leaves the stale entry in place until it expires
+        task.exception()
+
+
+def projected_key(key: tuple, fields: tuple) -> tuple:
+    """
+    The cache key for a response to `key` projected to `fields`
+    """
+    return (*key, ("fields", *fields))
 
-    postcode = postcode.upper().strip()
 
-    postcode = space_regex.sub(r" \1", postcode)
-    if not postcode_regex.search(postcode):
-        return False
-    return True
+def api_client_stats() -> dict:
+    """
+    Counters from the caches and circuit breakers, for monitoring
+    """
+    return {
+        "cache": api_cache.stats,
+        "negative_cache": negative_cache.stats,
+        "coalescing": upstream_requests.stats,
+        "circuit_breakers": {
+            name: breaker.stats for name, breaker in circuit_breakers.items()
+        },
+        "hedging": {name: hedger.stats for name, hedger in hedgers.items()},
+        "prefetch": prefetcher.stats,
+        "mock_responses": built_mock_responses.stats,
+    }
+
+
+def valid_postcode(postcode: str):
+    return postcode_validator.is_valid(postcode)
 
 
 class BaseAPIClient(ABC):
     URL_PREFIX = None
-
-    def __init__(self, api_key: str, request: Request):
+    # The query parameter asking the aggregator for only some of the top
+    # level fields of a response, if it supports one
+    PROJECTION_PARAM = None
+    # The query parameters a results page depends on. Any others are
+    # dropped from its canonical URL
+    PAGE_QUERY_PARAMS = ("postcode-search",)
+
+    def __init__(
+        self, api_key: str, request: Request, cache_responses: bool = True
+    ):
         self.api_key = api_key
         self.request = request
+        # Whether responses fetched for this client are added to the shared
+        # response cache. Cached responses are used either way.
+        self.cache_responses = cache_responses
         self.api_version = "v1"
         assert self.URL_PREFIX is not None, "URL_PREFIX must be set on backend"
 
@@ -76,7 +408,7 @@ class BaseAPIClient(ABC):
             "include_2026_pilots": "1",
         }
 
-    def _get(self, endpoint, params=None):
+    def _build_request(self, endpoint, params=None):
         if not params:
             params = {}
 
@@ -85,30 +417,261 @@ class BaseAPIClient(ABC):
 
         params.update(self.default_params)
         url = urljoin(self.get_base_url, endpoint)
-        req = httpx.get(url, params=params)
+        return endpoint, url, params
+
+    def _check_response(self, endpoint, req: httpx.Response):
         if endpoint.startswith("postcode/") and req.status_code == 400:
             raise InvalidPostcodeException()
         if endpoint.startswith("address/") and req.status_code == 404:
             raise InvalidUPRNException()
         req.raise_for_status()
+
+    def _get(self, endpoint, params=None):
+        endpoint, url, params = self._build_request(endpoint, params)
+        req = get_sync_http_client().get(url, params=params)
+        self._check_response(endpoint, req)
+        return req
+
+    @property
+    def time_budget(self) -> float:
+        """
+        How many seconds this request can spend waiting for the aggregator
+        """
+        budget = API_REQUEST_BUDGET
+        scope = getattr(self.request, "scope", {})
+        if lambda_context := scope.get("aws.context"):
+            remaining = lambda_context.get_remaining_time_in_millis() / 1000
+            budget = min(budget, remaining - API_DEADLINE_RESERVE)
+        return budget
+
+    async def _aget(self, endpoint, params=None, headers=None):
+        endpoint, url, params = self._build_request(endpoint, params)
+
+        breaker = get_circuit_breaker(self.BASE_URL)
+        budget = self.time_budget
+        if budget <= 0:
+            raise ApiError("no time left to call the API", status_code=504)
+        if not breaker.allow():
+            raise ApiError("API unavailable", status_code=503)
+
+        start = time.monotonic()
+        try:
+            async with asyncio.timeout(budget):
+                http_client = get_http_client()
+                if API_HEDGING:
+                    req = await get_hedger(self.BASE_URL).run(
+                        lambda: http_client.get(
+                            url, params=params, headers=headers
+                        )
+                    )
+                else:
+                    req = await http_client.get(
+                        url, params=params, headers=headers
+                    )
+        except TimeoutError:
+            breaker.record_failure(time.monotonic() - start)
+            raise httpx.TimeoutException(f"No response in {budget:.2f}s")
+        except httpx.HTTPError:
+            breaker.record_failure(time.monotonic() - start)
+            raise
+        except BaseException:
+            # e.g. cancelled: we don't know how the call would have gone
+            breaker.release()
+            raise
+
+        if req.status_code >= 500:
+            breaker.record_failure(time.monotonic() - start)
+        else:
+            breaker.record_success(time.monotonic() - start)
+        if req.status_code == 304 and headers:
+            # The answer to a conditional request: our copy is current
+            return req
+        self._check_response(endpoint, req)
         return req
 
+    async def _aget_json(self, endpoint, params=None, fields=None) -> dict:
+        """
+        Return the decoded JSON for `endpoint`, using the shared response
+        cache (and adding to it, if `cache_responses` is set).
+
+        If `fields` is given, the caller only needs those top level fields,
+        so the aggregator is asked for just them (if `PROJECTION_PARAM` is
+        set). The response may still include other fields, e.g. if it came
+        from a cached full response.
+
+        Requests the aggregator recently rejected raise straight away. Stale
+        entries are returned straight away and revalidated in the
+        background. Concurrent misses for the same request share a single
+        upstream fetch. The returned dict is shared with other requests and
+        must not be modified.
+        """
+        key = (self.URL_PREFIX, endpoint)
+        if params:
+            key += (tuple(sorted(params.items())),)
+        if prefetching.get():
+            return await self._aget_json_cached(key, endpoint, params, fields)
+        prefetcher.mark_used(key)
+        with prefetcher.foreground():
+            return await self._aget_json_cached(key, endpoint, params, fields)
+
+    async def _aget_json_cached(self, key, endpoint, params, fields) -> dict:
+        negative_cache.check(key)
+        fields = tuple(sorted(fields)) if fields else None
+        if not self.PROJECTION_PARAM:
+            fields = None
+        entry = await api_cache.get(key)
+        if entry is None and fields:
+            entry = await api_cache.get(projected_key(key, fields))
+        if entry is not None and entry.covers(fields):
+            if not entry.is_fresh():
+                self._refresh_in_background(key, endpoint, params, entry)
+            return entry.data
+        return await upstream_requests.do(
+            (key, fields),
+            lambda: self._fetch_into_cache(
+                key, endpoint, params, fields=fields
+            ),
+            foreground=not prefetching.get(),
+        )
+
+    async def _fetch_into_cache(
+        self,
+        key,
+        endpoint,
+        params=None,
+        stale_entry: CachedResponse = None,
+        fields=None,
+    ) -> dict:
+        """
+        Fetch `endpoint` (projected to `fields`, if given) and store it in
+        the cache, if `cache_responses` is set or it replaces a stale entry.
+        Projected responses are stored under their own key, so they never
+        replace a full response.
+
+        If we have a stale copy with validators, make the request
+        conditional: a 304 means the stale copy is still current, so it's
+        kept for another TTL without downloading or decoding the body again.
+        """
+        if prefetching.get():
+            prefetcher.track(key)
+        headers = stale_entry.conditional_headers if stale_entry else {}
+        request_params = dict(params or {})
+        if fields:
+            request_params[self.PROJECTION_PARAM] = ",".join(fields)
+        try:
+            req = await self._aget(
+                endpoint, params=request_params, headers=headers
+            )
+        except (InvalidPostcodeException, InvalidUPRNException) as e:
+            negative_cache.add(key, e)
+            await api_cache.delete(key)
+            if fields:
+                await api_cache.delete(projected_key(key, fields))
+            raise
+
+        ttl = freshness_lifetime(req.headers)
+        if ttl is None:
+            ttl = response_cache.ttl
+        ttl = min(ttl, API_CACHE_MAX_TTL)
+
+        if req.status_code == 304 and stale_entry:
+            data = stale_entry.data
+            entry = response_cache.make_entry(
+                data,
+                size=stale_entry.size,
+                ttl=ttl,
+                etag=req.headers.get("etag", stale_entry.etag),
+                last_modified=req.headers.get(
+                    "last-modified", stale_entry.last_modified
+                ),
+                projection=stale_entry.projection,
+            )
+        else:
+            data = req.json()
+            if fields and not set(data) <= set(fields):
+                # The aggregator ignored the projection, so we have the
+                # full response
+                fields = None
+            entry = response_cache.make_entry(
+                data,
+                size=len(req.content),
+                ttl=ttl,
+                etag=req.headers.get("etag"),
+                last_modified=req.headers.get("last-modified"),
+                projection=fields,
+            )
+        if ttl > 0 and (self.cache_responses or stale_entry):
+            await api_cache.set(
+                projected_key(key, fields) if fields else key, entry
+            )
+        return data
+
+    def _refresh_in_background(self, key, endpoint, params, stale_entry):
+        fields = stale_entry.projection
+        task = asyncio.create_task(
+            upstream_requests.do(
+                (key, fields),
+                lambda: self._fetch_into_cache(
+                    key, endpoint, params, stale_entry, fields=fields
+                ),
+            )
+        )
+        _background_tasks.add(task)
+        task.add_done_callback(_background_refresh_done)
+
+    @classmethod
+    def canonical_postcode(cls, postcode: str) -> Optional[str]:
+        """
+        The form of `postcode` results pages are served at, or `None` if
+        it isn't valid
+        """
+        if parsed_postcode := postcode_validator.validate(postcode):
+            return parsed_postcode.compact
+        return None
+
     @abstractmethod
     def get_postcode(self, postcode: str) -> dict: ...
 
     @abstractmethod
     def get_uprn(self, uprn: str) -> dict: ...
 
+    def prefetch_uprns(self, uprns: Iterable[str]):
+        """
+        If `API_PREFETCH` is on, warm the response cache for `uprns` in the
+        background, e.g. for the addresses in an address picker.
+
+        This only happens on a long running server, e.g. uvicorn. On Lambda
+        the prefetches would stall, as the process is frozen once the
+        response is sent, and then hold up the next invocation's API calls.
+        """
+        if not API_PREFETCH or ON_LAMBDA:
+            return
+        client = type(self)(api_key=self.api_key, request=None)
+        prefetcher.schedule(
+            functools.partial(client.aget_uprn, uprn) for uprn in uprns
+        )
+
+    # `fields` lists the top level fields the caller needs, so backends can
+    # fetch less. They may return more.
+
+    @abstractmethod
+    async def aget_postcode(self, postcode: str, fields=None) -> dict: ...
+
+    @abstractmethod
+    async def aget_uprn(self, uprn: str, fields=None) -> dict: ...
+
 
 class LiveAPIBackend(BaseAPIClient):
     BASE_URL = "https://developers.democracyclub.org.uk"
     URL_PREFIX = "live"
+    PROJECTION_PARAM = os.environ.get("API_PROJECTION_PARAM") or None
 
     def get_postcode(self, postcode: str) -> dict:
-        postcode = postcode[:10].upper().replace(" ", "")
-        if valid_postcode(postcode):
+        if parsed_postcode := postcode_validator.validate(postcode):
             try:
-                return self._get(endpoint=f"postcode/{postcode}/").json()
+                return self._get(
+                    endpoint=f"postcode/{parsed_postcode.compact}/"
+                ).json()
             except httpx.HTTPError:
                 raise ApiError
         raise InvalidPostcodeException()
@@ -119,8 +682,32 @@ class LiveAPIBackend(BaseAPIClient):
         except httpx.HTTPError:
             raise ApiError
 
+    async def aget_postcode(self, postcode: str, fields=None) -> dict:
+        if parsed_postcode := postcode_validator.validate(postcode):
+            try:
+                return await self._aget_json(
+                    endpoint=f"postcode/{parsed_postcode.compact}/",
+                    fields=fields,
+                )
+            except httpx.HTTPError:
+                raise ApiError
+        raise InvalidPostcodeException()
+
+    async def aget_uprn(self, uprn: str, fields=None) -> dict:
+        try:
+            return await self._aget_json(
+                endpoint=f"address/{uprn}/", fields=fields
+            )
+        except httpx.HTTPError:
+            raise ApiError
+
 
 class SandboxAPIBackend(BaseAPIClient):
+    """
+    Responses from the sandbox are validated here, and returned as a
+    `ValidatedResponse` so they aren't parsed a second time when rendering.
+    """
+
     POSTCODES = SANDBOX_POSTCODES
     BASE_URL = SANDBOX_BASE_URL
     URL_PREFIX = "sandbox"
@@ -130,20 +717,160 @@ class SandboxAPIBackend(BaseAPIClient):
             raise InvalidPostcodeException()
 
         response_dict = self._get(endpoint=f"sandbox/postcode/{postcode}/")
-        return RootModel.parse_obj(response_dict.json()).dict()
+        return ValidatedResponse.from_api_response(response_dict.json())
 
     def get_uprn(self, uprn: str) -> dict:
         response_dict = self._get(endpoint=f"sandbox/address/{uprn}/")
-        return RootModel.parse_obj(response_dict.json()).dict()
+        return ValidatedResponse.from_api_response(response_dict.json())
+
+    async def aget_postcode(self, postcode: str, fields=None) -> dict:
+        if postcode not in self.POSTCODES:
+            raise InvalidPostcodeException()
+
+        response_dict = await self._aget_json(
+            endpoint=f"sandbox/postcode/{postcode}/"
+        )
+        return ValidatedResponse.from_api_response(response_dict)
+
+    async def aget_uprn(self, uprn: str, fields=None) -> dict:
+        response_dict = await self._aget_json(
+            endpoint=f"sandbox/address/{uprn}/"
+        )
+        return ValidatedResponse.from_api_response(response_dict)
+
+
+@functools.lru_cache(maxsize=None)
+def get_snapshot(path: str) -> SnapshotReader:
+    """
+    One reader per snapshot file, per process
+    """
+    return SnapshotReader(path)
+
+
+class SnapshotAPIBackend(BaseAPIClient):
+    """
+    Serves responses recorded from the live API by `snapshot.record`, from
+    the snapshot file at `SNAPSHOT_PATH`.
+
+    Postcodes and UPRNs that aren't in the snapshot are treated as invalid.
+    """
+
+    URL_PREFIX = "snapshot"
+
+    @property
+    def snapshot(self) -> SnapshotReader:
+        path = os.environ.get("SNAPSHOT_PATH")
+        if not path:
+            raise ApiError("SNAPSHOT_PATH isn't set", status_code=503)
+        return get_snapshot(path)
+
+    def get_postcode(self, postcode: str) -> dict:
+        parsed_postcode = postcode_validator.validate(postcode)
+        if not parsed_postcode:
+            raise InvalidPostcodeException()
+        response = self.snapshot.get(postcode_key(parsed_postcode.compact))
+        if response is None:
+            raise InvalidPostcodeException()
+        return response
+
+    def get_uprn(self, uprn: str) -> dict:
+        response = self.snapshot.get(address_key(uprn))
+        if response is None:
+            raise InvalidUPRNException()
+        return response
+
+    async def aget_postcode(self, postcode: str, fields=None) -> dict:
+        return self.get_postcode(postcode)
+
+    async def aget_uprn(self, uprn: str, fields=None) -> dict:
+        return self.get_uprn(uprn)
+
+    def prefetch_uprns(self, uprns):
+        # Responses are read from a local file, so there's nothing to warm
+        return None
+
+
+class MockResponses:
+    """
+    Built responses for `mock_responses.example_responses`.
+
+    Every example is built once, by `build` (see `WARM_MOCK_RESPONSES` in
+    app.py) or else the first time one is asked for. Responses rebased with
+    a `baseline_date` are built on demand and memoised in an LRU of
+    `max_rebased` entries, keyed by (postcode, baseline_date).
+
+    Returned dicts are shared between requests, so callers must treat them
+    as read only.
+    """
+
+    def __init__(self, examples: dict, max_rebased: int = 256):
+        self.examples = examples
+        self._built = None
+        self._rebased = functools.lru_cache(maxsize=max_rebased)(
+            self._build_rebased
+        )
+
+    def _build_all(self) -> Dict[str, dict]:
+        return {
+            postcode: example["response"].build().dict()
+            for postcode, example in self.examples.items()
+        }
+
+    def _build_rebased(self, postcode: str, baseline_date: str) -> dict:
+        builder: RootBuilder = self.examples[postcode]["response"]
+        # set_date_baseline changes the builder in place, so work on a copy
+        # to leave the shared example alone
+        builder = deepcopy(builder).set_date_baseline(baseline_date)
+        return builder.build().dict()
+
+    def build(self):
+        """
+        Build every example now, if they haven't been already
+        """
+        if self._built is None:
+            self._built = self._build_all()
+
+    def get(self, postcode: str, baseline_date: str = None) -> dict:
+        if baseline_date:
+            return self._rebased(postcode, baseline_date)
+        self.build()
+        return self._built[postcode]
+
+    def clear(self):
+        self._built = None
+        self._rebased.cache_clear()
+
+    @property
+    def stats(self) -> dict:
+        info = self._rebased.cache_info()
+        return {
+            "built": self._built is not None,
+            "rebased_entries": info.currsize,
+            "rebased_hits": info.hits,
+            "rebased_misses": info.misses,
+        }
+
+
+built_mock_responses = MockResponses(
+    example_responses,
+    max_rebased=int(os.environ.get("MOCK_RESPONSES_MAX_REBASED", 256)),
+)
 
 
 class MockAPIBackend(BaseAPIClient):
+    PAGE_QUERY_PARAMS = ("postcode-search", "baseline_date")
+
+    @classmethod
+    def canonical_postcode(cls, postcode: str) -> Optional[str]:
+        # Examples are keyed by the spaced form
+        if parsed_postcode := postcode_validator.validate(postcode):
+            return parsed_postcode.canonical
+        return None
+
     def get_mock_response(self, postcode):
-        builder: RootBuilder = example_responses[postcode]["response"]
-        if baseline_date := self.request.query_params.get("baseline_date"):
-            builder = deepcopy(builder)
-            builder = builder.set_date_baseline(baseline_date)
-        return builder.build().dict()
+        return built_mock_responses.get(
+            postcode, self.request.query_params.get("baseline_date")
+        )
 
     def get_uprn(self, uprn: str) -> dict:
         return self.get_mock_response(uprn)
@@ -151,5 +878,15 @@ class MockAPIBackend(BaseAPIClient):
     def get_postcode(self, postcode: str) -> dict:
         return self.get_mock_response(postcode)
 
+    async def aget_uprn(self, uprn: str, fields=None) -> dict:
+        return self.get_mock_response(uprn)
+
+    async def aget_postcode(self, postcode: str, fields=None) -> dict:
+        return self.get_mock_response(postcode)
+
+    def prefetch_uprns(self, uprns):
+        # Responses are built in memory, so there's nothing to warm
+        return None
+
     POSTCODES = example_responses
     URL_PREFIX = "mock"
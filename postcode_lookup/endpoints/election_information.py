@@ -1,6 +1,8 @@
 import functools
 import json
 import os
+from typing import Optional
+from urllib.parse import urlencode
 
 from dc_api_client import (
     ApiError,
@@ -10,12 +12,20 @@ from dc_api_client import (
     LiveAPIBackend,
     MockAPIBackend,
     SandboxAPIBackend,
+    SnapshotAPIBackend,
 )
+from page_cache import not_modified, page_cache
 from starlette.requests import Request
 from starlette.responses import RedirectResponse, Response
 from starlette_babel.translator import gettext as _
 from template_sorter import TemplateSorter
-from utils import get_loader, results_context
+from utils import (
+    cache_headers,
+    end_of_day,
+    get_loader,
+    page_response,
+    results_context,
+)
 
 
 async def base_postcode_form(request: Request, backend: BaseAPIClient = None):
@@ -35,6 +45,40 @@ async def base_postcode_form(request: Request, backend: BaseAPIClient = None):
     )
 
 
+def canonical_redirect(
+    request: Request, backend: BaseAPIClient, postcode: str
+) -> Optional[RedirectResponse]:
+    """
+    A redirect to the canonical URL for a results page, if `request` isn't
+    for it.
+
+    The CDN caches pages by their full query string, so "sw1a1aa",
+    "SW1A 1AA" and "SW1A1AA&utm_source=..." would otherwise each be a
+    separate cache entry (and a separate render here). The canonical URL
+    has the postcode in the backend's canonical form, and only the query
+    parameters the page depends on, in a fixed order.
+
+    Invalid postcodes aren't redirected, so they're handled as before.
+    """
+    canonical_postcode = backend.canonical_postcode(postcode)
+    if canonical_postcode is None:
+        return None
+    params = {"postcode-search": canonical_postcode}
+    for name in backend.PAGE_QUERY_PARAMS:
+        if name not in params and (value := request.query_params.get(name)):
+            params[name] = value
+    query = urlencode(params)
+    if request.url.query == query:
+        return None
+    # Which URL a postcode is canonically at doesn't change, so the
+    # redirect can be cached like a page that never changes
+    return RedirectResponse(
+        str(request.url.replace(query=query)),
+        status_code=301,
+        headers=cache_headers(None),
+    )
+
+
 live_postcode_form = functools.partial(
     base_postcode_form, backend=LiveAPIBackend
 )
@@ -44,6 +88,9 @@ sandbox_postcode_form = functools.partial(
 mock_postcode_form = functools.partial(
     base_postcode_form, backend=MockAPIBackend
 )
+snapshot_postcode_form = functools.partial(
+    base_postcode_form, backend=SnapshotAPIBackend
+)
 
 
 async def base_postcode_endpoint(
@@ -52,11 +99,12 @@ async def base_postcode_endpoint(
     """
     Endpoint that handles postcode queries.
 
-    There are three options for this endpoint:
+    There are four options for this endpoint:
 
     1. The postcode is invalid. In this case, redirect back to the postcode form
-    2. The postcode is valid and there is an address picker. In this case, show the address picker
-    3. The postcode is valid and there isn't an address picker. In this case show the postcode page.
+    2. The postcode is valid, but the URL isn't canonical. In this case, redirect to the canonical URL
+    3. The postcode is valid and there is an address picker. In this case, show the address picker
+    4. The postcode is valid and there isn't an address picker. In this case show the postcode page.
 
     Supports "plugable" backends for swapping in the sandbox and mock backends.
 
@@ -80,11 +128,15 @@ async def base_postcode_endpoint(
     if postcode == "FA2LL":
         assert False
 
+    if redirect := canonical_redirect(request, backend, postcode):
+        return redirect
+
+    client = backend(
+        api_key=os.environ.get("API_KEY", "ec-postcode-testing"),
+        request=request,
+    )
     try:
-        api_response = backend(
-            api_key=os.environ.get("API_KEY", "ec-postcode-testing"),
-            request=request,
-        ).get_postcode(postcode)
+        api_response = await client.aget_postcode(postcode)
     except (InvalidPostcodeException, ApiError) as e:
         query_param = (
             "api-error" if isinstance(e, ApiError) else "invalid-postcode"
@@ -97,6 +149,21 @@ async def base_postcode_endpoint(
             ).include_query_params(**{query_param: 1})
         )
 
+    cache_key = page_cache.key(request, api_response, backend.URL_PREFIX)
+    etag = page_cache.etag(cache_key)
+    page = page_cache.get(cache_key)
+    # Without the page we don't know when it next changes, but it won't be
+    # before tomorrow, when the ETag changes anyway
+    if response := not_modified(
+        request,
+        etag,
+        cache_headers(page.changes_at if page else end_of_day()),
+    ):
+        return response
+    if page:
+        client.prefetch_uprns(page.prefetch_uprns)
+        return page.response(request, cache_headers(page.changes_at))
+
     context = results_context(
         api_response, request, postcode, backend.URL_PREFIX
     )
@@ -104,12 +171,29 @@ async def base_postcode_endpoint(
     template_sorter = TemplateSorter(context["api_response"])
     context["template_sorter"] = template_sorter
     template_name = template_sorter.main_template_name
+    prefetch_uprns = ()
     if context["api_response"].address_picker:
         template_name = "address_picker.html"
+        # The user's next request is likely to be for one of these
+        prefetch_uprns = tuple(
+            address.slug for address in context["api_response"].addresses
+        )
 
-    return get_loader(request).TemplateResponse(
-        request, template_name, context=context
+    changes_at = template_sorter.next_change
+    response = page_cache.store(
+        cache_key,
+        page_response(
+            request,
+            template_name,
+            context,
+            {**cache_headers(changes_at), "ETag": etag},
+        ),
+        template_name,
+        prefetch_uprns,
+        changes_at,
     )
+    client.prefetch_uprns(prefetch_uprns)
+    return response
 
 
 # Use functools.partial to create a view function per backend
@@ -122,6 +206,9 @@ sandbox_postcode_view = functools.partial(
 mock_postcode_view = functools.partial(
     base_postcode_endpoint, backend=MockAPIBackend
 )
+snapshot_postcode_view = functools.partial(
+    base_postcode_endpoint, backend=SnapshotAPIBackend
+)
 
 
 async def base_uprn_endpoint(request: Request, backend=None):
@@ -137,10 +224,10 @@ async def base_uprn_endpoint(request: Request, backend=None):
     uprn = request.path_params["uprn"]
     postcode = request.path_params["postcode"]
     try:
-        api_response = backend(
+        api_response = await backend(
             api_key=os.environ.get("API_KEY", "ec-postcode-testing"),
             request=request,
-        ).get_uprn(uprn)
+        ).aget_uprn(uprn)
     except (InvalidUPRNException, ApiError) as e:
         query_param = "api-error" if isinstance(e, ApiError) else "invalid-uprn"
         return RedirectResponse(
@@ -150,6 +237,19 @@ async def base_uprn_endpoint(request: Request, backend=None):
                 + request.scope["current_language"]
             ).include_query_params(**{query_param: 1})
         )
+
+    cache_key = page_cache.key(request, api_response, backend.URL_PREFIX)
+    etag = page_cache.etag(cache_key)
+    page = page_cache.get(cache_key)
+    if response := not_modified(
+        request,
+        etag,
+        cache_headers(page.changes_at if page else end_of_day()),
+    ):
+        return response
+    if page:
+        return page.response(request, cache_headers(page.changes_at))
+
     context = results_context(
         api_response, request, postcode, backend.URL_PREFIX
     )
@@ -159,8 +259,17 @@ async def base_uprn_endpoint(request: Request, backend=None):
     template_name = template_sorter.main_template_name
     if context["api_response"].address_picker:
         template_name = "address_picker.html"
-    return get_loader(request).TemplateResponse(
-        request, template_name, context=context
+    changes_at = template_sorter.next_change
+    return page_cache.store(
+        cache_key,
+        page_response(
+            request,
+            template_name,
+            context,
+            {**cache_headers(changes_at), "ETag": etag},
+        ),
+        template_name,
+        changes_at=changes_at,
     )
 
 
@@ -168,3 +277,6 @@ live_uprn_view = functools.partial(base_uprn_endpoint, backend=LiveAPIBackend)
 sandbox_uprn_view = functools.partial(
     base_uprn_endpoint, backend=SandboxAPIBackend
 )
+snapshot_uprn_view = functools.partial(
+    base_uprn_endpoint, backend=SnapshotAPIBackend
+)
@@ -1,6 +1,12 @@
+import asyncio
+import codecs
+import csv
 import functools
+import io
 import json
+import logging
 import os
+from typing import AsyncIterator
 from urllib.parse import quote
 
 from dc_api_client import (
@@ -11,37 +17,67 @@ from dc_api_client import (
     LiveAPIBackend,
     MockAPIBackend,
     SandboxAPIBackend,
+    SnapshotAPIBackend,
 )
+from page_cache import not_modified, page_cache
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile
 from starlette.requests import Request
-from starlette.responses import JSONResponse, RedirectResponse, Response
+from starlette.responses import (
+    JSONResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from starlette_babel.translator import gettext as _
-from utils import get_loader, results_context
+from utils import (
+    cache_headers,
+    get_loader,
+    page_response,
+    results_context,
+)
+
+logger = logging.getLogger(__name__)
+
+# The only fields of an API response these pages use. Backends are asked
+# for just these, but may return the full response.
+ELECTORAL_SERVICES_FIELDS = (
+    "address_picker",
+    "addresses",
+    "electoral_services",
+    "registration",
+    "postcode_location",
+)
 
 
 def preprocess_api_response(data, request, url_prefix):
+    # `data` can be shared with other requests via the response cache,
+    # so build a new dict rather than modifying it
+
+    # strip fields we don't need
+    processed = {
+        k: v for k, v in data.items() if k in ELECTORAL_SERVICES_FIELDS
+    }
+
     # only show address picker if the postcode is split between more than one council
-    if data["electoral_services"]:
-        data["addresses"] = []
-        data["address_picker"] = False
+    if processed["electoral_services"]:
+        processed["addresses"] = []
+        processed["address_picker"] = False
 
     # re-write address picker URLs
-    for address in data["addresses"]:
-        address["url"] = str(
-            request.url_for(
-                url_prefix + "_uprn_" + request.scope["current_language"],
-                uprn=quote(address["slug"], safe=""),
-            )
-        )
-
-    # strip fields we don't need
-    fields = [
-        "address_picker",
-        "addresses",
-        "electoral_services",
-        "registration",
-        "postcode_location",
+    processed["addresses"] = [
+        {
+            **address,
+            "url": str(
+                request.url_for(
+                    url_prefix + "_uprn_" + request.scope["current_language"],
+                    uprn=quote(address["slug"], safe=""),
+                )
+            ),
+        }
+        for address in processed["addresses"]
     ]
-    return {k: v for k, v in data.items() if k in fields}
+    return processed
 
 
 async def base_postcode_form(request: Request, backend: BaseAPIClient = None):
@@ -91,27 +127,42 @@ sandbox_postcode_form = functools.partial(
 mock_postcode_form = functools.partial(
     base_postcode_form, backend=MockAPIBackend
 )
+snapshot_postcode_form = functools.partial(
+    base_postcode_form, backend=SnapshotAPIBackend
+)
+
+
+def json_response(
+    request: Request, api_response: dict, url_prefix: str
+) -> Response:
+    """
+    The JSON view of `api_response`, or a 304 if the client already has it
+    """
+    etag = page_cache.etag(page_cache.key(request, api_response, url_prefix))
+    if response := not_modified(request, etag):
+        return response
+    api_response = preprocess_api_response(api_response, request, url_prefix)
+    return JSONResponse(api_response, headers={"ETag": etag})
 
 
-def base_postcode_json(
+async def base_postcode_json(
     request: Request, backend: BaseAPIClient, postcode: str, url_prefix: str
 ):
     if not postcode:
         return JSONResponse({"error": "invalid postcode"}, status_code=400)
 
     try:
-        api_response = backend(
+        api_response = await backend(
             api_key=os.environ.get("API_KEY", "ec-postcode-testing"),
             request=request,
-        ).get_postcode(postcode)
+        ).aget_postcode(postcode, fields=ELECTORAL_SERVICES_FIELDS)
     except (InvalidPostcodeException, ApiError) as e:
         return JSONResponse({"error": str(e)}, status_code=e.status_code)
 
-    api_response = preprocess_api_response(api_response, request, url_prefix)
-    return JSONResponse(api_response)
+    return json_response(request, api_response, url_prefix)
 
 
-def base_postcode_html(
+async def base_postcode_html(
     request: Request, backend: BaseAPIClient, postcode: str, url_prefix: str
 ):
     if not postcode:
@@ -123,11 +174,14 @@ def base_postcode_html(
             )
         )
 
+    client = backend(
+        api_key=os.environ.get("API_KEY", "ec-postcode-testing"),
+        request=request,
+    )
     try:
-        api_response = backend(
-            api_key=os.environ.get("API_KEY", "ec-postcode-testing"),
-            request=request,
-        ).get_postcode(postcode)
+        api_response = await client.aget_postcode(
+            postcode, fields=ELECTORAL_SERVICES_FIELDS
+        )
     except (InvalidPostcodeException, ApiError) as e:
         query_param = (
             "api-error" if isinstance(e, ApiError) else "invalid-postcode"
@@ -140,17 +194,42 @@ def base_postcode_html(
             ).include_query_params(**{query_param: 1})
         )
 
+    cache_key = page_cache.key(request, api_response, url_prefix)
+    etag = page_cache.etag(cache_key)
+    if response := not_modified(request, etag, cache_headers(None)):
+        return response
+    if page := page_cache.get(cache_key):
+        client.prefetch_uprns(page.prefetch_uprns)
+        return page.response(request, cache_headers(None))
+
     api_response = preprocess_api_response(api_response, request, url_prefix)
 
     context = results_context(api_response, request, postcode, url_prefix)
 
     template_name = "electoral_services_team_results.html"
+    prefetch_uprns = ()
     if context["api_response"].address_picker:
         template_name = "address_picker_nopostcode.html"
+        # The user's next request is likely to be for one of these
+        prefetch_uprns = tuple(
+            address["slug"] for address in api_response["addresses"]
+        )
 
-    return get_loader(request).TemplateResponse(
-        request, template_name, context=context
+    # Contact details don't depend on the date, so are cached for as long
+    # as the data is trusted to be fresh
+    response = page_cache.store(
+        cache_key,
+        page_response(
+            request,
+            template_name,
+            context,
+            {**cache_headers(None), "ETag": etag},
+        ),
+        template_name,
+        prefetch_uprns,
     )
+    client.prefetch_uprns(prefetch_uprns)
+    return response
 
 
 async def base_postcode_endpoint(
@@ -169,9 +248,9 @@ async def base_postcode_endpoint(
         assert False
 
     if format_ == "json":
-        return base_postcode_json(request, backend, postcode, url_prefix)
+        return await base_postcode_json(request, backend, postcode, url_prefix)
 
-    return base_postcode_html(request, backend, postcode, url_prefix)
+    return await base_postcode_html(request, backend, postcode, url_prefix)
 
 
 live_postcode_view = functools.partial(
@@ -183,37 +262,39 @@ sandbox_postcode_view = functools.partial(
 mock_postcode_view = functools.partial(
     base_postcode_endpoint, backend=MockAPIBackend
 )
+snapshot_postcode_view = functools.partial(
+    base_postcode_endpoint, backend=SnapshotAPIBackend
+)
 
 
-def base_uprn_json(
+async def base_uprn_json(
     request: Request,
     backend: BaseAPIClient,
     uprn: str,
     url_prefix: str,
 ):
     try:
-        api_response = backend(
+        api_response = await backend(
             api_key=os.environ.get("API_KEY", "ec-postcode-testing"),
             request=request,
-        ).get_uprn(uprn)
+        ).aget_uprn(uprn, fields=ELECTORAL_SERVICES_FIELDS)
     except (InvalidUPRNException, ApiError) as e:
         return JSONResponse({"error": str(e)}, status_code=e.status_code)
 
-    api_response = preprocess_api_response(api_response, request, url_prefix)
-    return JSONResponse(api_response)
+    return json_response(request, api_response, url_prefix)
 
 
-def base_uprn_html(
+async def base_uprn_html(
     request: Request,
     backend: BaseAPIClient,
     uprn: str,
     url_prefix: str,
 ):
     try:
-        api_response = backend(
+        api_response = await backend(
             api_key=os.environ.get("API_KEY", "ec-postcode-testing"),
             request=request,
-        ).get_uprn(uprn)
+        ).aget_uprn(uprn, fields=ELECTORAL_SERVICES_FIELDS)
     except (InvalidUPRNException, ApiError) as e:
         query_param = "api-error" if isinstance(e, ApiError) else "invalid-uprn"
         return RedirectResponse(
@@ -224,6 +305,13 @@ def base_uprn_html(
             ).include_query_params(**{query_param: 1})
         )
 
+    cache_key = page_cache.key(request, api_response, url_prefix)
+    etag = page_cache.etag(cache_key)
+    if response := not_modified(request, etag, cache_headers(None)):
+        return response
+    if page := page_cache.get(cache_key):
+        return page.response(request, cache_headers(None))
+
     api_response = preprocess_api_response(api_response, request, url_prefix)
 
     context = results_context(api_response, request, "", url_prefix)
@@ -232,8 +320,15 @@ def base_uprn_html(
     if context["api_response"].address_picker:
         template_name = "address_picker_nopostcode.html"
 
-    return get_loader(request).TemplateResponse(
-        request, template_name, context=context
+    return page_cache.store(
+        cache_key,
+        page_response(
+            request,
+            template_name,
+            context,
+            {**cache_headers(None), "ETag": etag},
+        ),
+        template_name,
     )
 
 
@@ -246,11 +341,395 @@ async def base_uprn_endpoint(request: Request, backend: BaseAPIClient = None):
     format_ = request.query_params.get("format", "html")
 
     if format_ == "json":
-        return base_uprn_json(request, backend, uprn, url_prefix)
-    return base_uprn_html(request, backend, uprn, url_prefix)
+        return await base_uprn_json(request, backend, uprn, url_prefix)
+    return await base_uprn_html(request, backend, uprn, url_prefix)
 
 
 live_uprn_view = functools.partial(base_uprn_endpoint, backend=LiveAPIBackend)
 sandbox_uprn_view = functools.partial(
     base_uprn_endpoint, backend=SandboxAPIBackend
 )
+snapshot_uprn_view = functools.partial(
+    base_uprn_endpoint, backend=SnapshotAPIBackend
+)
+
+
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", 10))
+
+CONTACT_FIELDS = ["name", "email", "phone", "website", "address", "postcode"]
+BULK_CSV_HEADER = [
+    "postcode",
+    "status_code",
+    "error",
+    "address_picker",
+    *(f"electoral_services_{field}" for field in CONTACT_FIELDS),
+    *(f"registration_{field}" for field in CONTACT_FIELDS),
+]
+
+
+# Longest line (or JSON list item) a bulk upload can have, so a malformed
+# upload can't make us buffer all of it
+BULK_MAX_ITEM_LENGTH = 1024
+# Size of the chunks uploaded files are read in
+BULK_READ_SIZE = 64 * 1024
+
+
+class InvalidBulkInput(ValueError):
+    pass
+
+
+async def body_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Decode `chunks` of UTF-8 (with or without a BOM), a line at a time
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        *lines, buffer = (buffer + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            yield line
+        if len(buffer) > BULK_MAX_ITEM_LENGTH:
+            raise InvalidBulkInput("line too long")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def csv_postcodes(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Postcodes from the first column of a CSV, read as it arrives. A header
+    row is skipped. Rows can't span lines.
+    """
+    first_row = True
+    async for line in body_lines(chunks):
+        row = next(csv.reader([line]), None)
+        if not row or not row[0].strip():
+            continue
+        postcode = row[0].strip()
+        if first_row and postcode.lower() == "postcode":
+            continue
+        first_row = False
+        yield postcode
+
+
+async def json_postcodes(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Postcodes from a JSON list, or `{"postcodes": [...]}`, parsed as it
+    arrives rather than once it's all been read
+    """
+    chunks = aiter(chunks)
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    more = True
+
+    async def read():
+        nonlocal buffer, more
+        try:
+            buffer += utf8.decode(await anext(chunks))
+        except StopAsyncIteration:
+            buffer += utf8.decode(b"", final=True)
+            more = False
+
+    async def peek() -> str:
+        # The next character that isn't whitespace, or "" at the end
+        nonlocal buffer
+        while True:
+            buffer = buffer.lstrip()
+            if buffer or not more:
+                return buffer[:1]
+            await read()
+
+    async def expect(char: str, error: str):
+        nonlocal buffer
+        if await peek() != char:
+            raise InvalidBulkInput(error)
+        buffer = buffer[1:]
+
+    async def value():
+        nonlocal buffer
+        while True:
+            await peek()
+            try:
+                decoded, end = decoder.raw_decode(buffer)
+            except ValueError:
+                if not more or len(buffer) > BULK_MAX_ITEM_LENGTH:
+                    raise InvalidBulkInput("invalid JSON") from None
+                await read()
+                continue
+            if end == len(buffer) and more:
+                # e.g. a number, which might carry on in the next chunk
+                await read()
+                continue
+            buffer = buffer[end:]
+            return decoded
+
+    expected = "expected a list of postcodes"
+    wrapped = await peek() == "{"
+    if wrapped:
+        await expect("{", expected)
+        if await peek() != '"' or await value() != "postcodes":
+            raise InvalidBulkInput(expected)
+        await expect(":", expected)
+    await expect("[", expected)
+    if await peek() == "]":
+        buffer = buffer[1:]
+    else:
+        while True:
+            yield str(await value())
+            if await peek() != ",":
+                break
+            buffer = buffer[1:]
+        await expect("]", "invalid JSON")
+    if wrapped:
+        await expect("}", "invalid JSON")
+    if await peek():
+        raise InvalidBulkInput("invalid JSON")
+
+
+async def bulk_lookup(
+    postcodes: AsyncIterator[str],
+    request: Request,
+    backend: BaseAPIClient,
+    url_prefix: str,
+) -> AsyncIterator[dict]:
+    """
+    Look up each postcode, with at most `BULK_CONCURRENCY` lookups in flight,
+    yielding a result for each as it completes (so not in input order).
+
+    The next postcode is read (e.g. from the request body) while lookups
+    are in flight, but only one ahead, so only the lookups in flight (and
+    their results, until they're sent) are held in memory, however many
+    postcodes there are. Invalid input stops the reading, with an error
+    row.
+
+    Responses aren't added to the shared response cache, so a large upload
+    doesn't push out the ones results pages use.
+    """
+    client = backend(
+        api_key=os.environ.get("API_KEY", "ec-postcode-testing"),
+        request=request,
+        cache_responses=False,
+    )
+
+    async def lookup(postcode):
+        try:
+            api_response = await client.aget_postcode(
+                postcode, fields=ELECTORAL_SERVICES_FIELDS
+            )
+        except (InvalidPostcodeException, ApiError) as e:
+            return {
+                "postcode": postcode,
+                "status_code": e.status_code,
+                "error": str(e),
+            }
+        except Exception:
+            # One bad lookup mustn't cut the whole response short
+            logger.exception("Bulk lookup failed for %r", postcode)
+            return {
+                "postcode": postcode,
+                "status_code": 500,
+                "error": "lookup failed",
+            }
+        return {
+            "postcode": postcode,
+            "status_code": 200,
+            **preprocess_api_response(api_response, request, url_prefix),
+        }
+
+    postcodes = aiter(postcodes)
+    pending = set()
+    next_postcode = asyncio.ensure_future(anext(postcodes, None))
+    try:
+        while next_postcode or pending:
+            waiting = set(pending)
+            if next_postcode and len(pending) < BULK_CONCURRENCY:
+                waiting.add(next_postcode)
+            done, _ = await asyncio.wait(
+                waiting, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task is not next_postcode:
+                    pending.discard(task)
+                    yield task.result()
+                    continue
+                try:
+                    postcode = task.result()
+                except InvalidBulkInput as e:
+                    yield {"postcode": "", "status_code": 400, "error": str(e)}
+                    postcode = None
+                if postcode is None:
+                    next_postcode = None
+                else:
+                    pending.add(asyncio.ensure_future(lookup(postcode)))
+                    next_postcode = asyncio.ensure_future(
+                        anext(postcodes, None)
+                    )
+    finally:
+        # e.g. the client disconnected
+        for task in pending:
+            task.cancel()
+        if next_postcode:
+            next_postcode.cancel()
+
+
+def bulk_csv_row(result: dict) -> list:
+    row = [
+        result["postcode"],
+        result["status_code"],
+        result.get("error", ""),
+        result.get("address_picker", ""),
+    ]
+    for section in ("electoral_services", "registration"):
+        contact = result.get(section) or {}
+        for field in CONTACT_FIELDS:
+            value = contact.get(field)
+            row.append("" if value is None else value)
+    return row
+
+
+async def ndjson_lines(results: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for result in results:
+        yield json.dumps(result, separators=(",", ":")) + "\n"
+
+
+async def csv_lines(results: AsyncIterator[dict]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(BULK_CSV_HEADER)
+    async for result in results:
+        writer.writerow(bulk_csv_row(result))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Flush the header if there weren't any results
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+class BulkLookupResponse(StreamingResponse):
+    """
+    A `StreamingResponse` whose content reads the request body as it goes.
+
+    `StreamingResponse` listens for the client disconnecting by reading the
+    request, which would take the body from under the content, so that
+    waits until `body_read` is set.
+    """
+
+    def __init__(self, content, body_read: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_read = body_read
+
+    async def listen_for_disconnect(self, receive):
+        await self.body_read.wait()
+        await super().listen_for_disconnect(receive)
+
+
+async def request_chunks(
+    request: Request, body_read: asyncio.Event
+) -> AsyncIterator[bytes]:
+    try:
+        async for chunk in request.stream():
+            yield chunk
+    finally:
+        body_read.set()
+
+
+async def upload_chunks(upload: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await upload.read(BULK_READ_SIZE):
+        yield chunk
+
+
+async def prepend(first: str, rest: AsyncIterator[str]) -> AsyncIterator[str]:
+    if first is None:
+        return
+    yield first
+    async for item in rest:
+        yield item
+
+
+async def base_bulk_endpoint(request: Request, backend: BaseAPIClient = None):
+    """
+    Look up contact details for many postcodes in one request.
+
+    Postcodes are sent as a JSON list (or `{"postcodes": [...]}`), as a CSV
+    with postcodes in the first column (`Content-Type: text/csv`), or as a
+    CSV file uploaded in a `multipart/form-data` form.
+
+    The body is read as the lookups go, and results are streamed back as
+    they're ready, as newline delimited JSON, or CSV with `?format=csv`.
+    """
+    if not backend:
+        raise ValueError("Must specify a backend")
+
+    url_prefix = f"electoral_services_{backend.URL_PREFIX}"
+    format_ = request.query_params.get("format", "ndjson")
+    if format_ not in ("ndjson", "csv"):
+        return JSONResponse(
+            {"error": "format must be ndjson or csv"}, status_code=400
+        )
+
+    body_read = asyncio.Event()
+    background = None
+    content_type = request.headers.get("content-type", "")
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type == "application/json":
+        postcodes = json_postcodes(request_chunks(request, body_read))
+    elif content_type in ("text/csv", "text/plain"):
+        postcodes = csv_postcodes(request_chunks(request, body_read))
+    elif content_type == "multipart/form-data":
+        # Starlette spools uploaded files to disk past 1MB, so the upload
+        # can be read up front without holding it in memory
+        form = await request.form(max_files=1)
+        body_read.set()
+        background = BackgroundTask(form.close)
+        uploads = [
+            value for value in form.values() if isinstance(value, UploadFile)
+        ]
+        if not uploads:
+            await form.close()
+            return JSONResponse({"error": "upload a CSV file"}, status_code=400)
+        postcodes = csv_postcodes(upload_chunks(uploads[0]))
+    else:
+        return JSONResponse(
+            {
+                "error": "send application/json, text/csv or "
+                "multipart/form-data"
+            },
+            status_code=415,
+        )
+
+    # Read up to the first postcode, so a body that's wrong from the start
+    # gets a 400 rather than an error at the end of the results
+    try:
+        first = await anext(postcodes, None)
+    except InvalidBulkInput as e:
+        if background:
+            await background()
+        return JSONResponse({"error": str(e)}, status_code=400)
+    postcodes = prepend(first, postcodes)
+
+    results = bulk_lookup(postcodes, request, backend, url_prefix)
+    if format_ == "csv":
+        return BulkLookupResponse(
+            csv_lines(results),
+            body_read,
+            media_type="text/csv; charset=utf-8",
+            background=background,
+        )
+    return BulkLookupResponse(
+        ndjson_lines(results),
+        body_read,
+        media_type="application/x-ndjson",
+        background=background,
+    )
+
+
+live_bulk_view = functools.partial(base_bulk_endpoint, backend=LiveAPIBackend)
+sandbox_bulk_view = functools.partial(
+    base_bulk_endpoint, backend=SandboxAPIBackend
+)
+mock_bulk_view = functools.partial(base_bulk_endpoint, backend=MockAPIBackend)
+snapshot_bulk_view = functools.partial(
+    base_bulk_endpoint, backend=SnapshotAPIBackend
+)
@@ -1,7 +1,11 @@
 import datetime
+import hmac
+import os
 
+from dc_api_client import api_client_stats
 from markupsafe import Markup
 from mock_responses import example_responses
+from page_cache import page_cache
 from response_builder.v1.builders.ballots import StockLocalBallotBuilder
 from response_builder.v1.generated_responses.candidates import all_candidates
 from response_builder.v1.models.base import (
@@ -9,7 +13,7 @@ from response_builder.v1.models.base import (
 )
 from response_builder.v1.sandbox import SANDBOX_POSTCODES
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import JSONResponse, Response
 from utils import get_ballot_stages, get_loader
 
 
@@ -44,6 +48,36 @@ def failover(request: Request):
     return Response(status_code=400)
 
 
+# Shared secret for reading the stats outside debug mode, sent in the
+# X-Stats-Token header
+API_CLIENT_STATS_TOKEN = os.environ.get("API_CLIENT_STATS_TOKEN", "")
+
+
+def can_see_api_client_stats(request: Request) -> bool:
+    if request.app.debug:
+        return True
+    token = request.headers.get("X-Stats-Token", "")
+    return bool(API_CLIENT_STATS_TOKEN) and hmac.compare_digest(
+        token.encode(), API_CLIENT_STATS_TOKEN.encode()
+    )
+
+
+async def api_client_stats_view(request: Request):
+    """
+    Cache, request coalescing and circuit breaker counters for this process.
+
+    Outside debug mode (i.e. in production) the request must carry
+    `API_CLIENT_STATS_TOKEN` in an `X-Stats-Token` header. Without it, or
+    if no token is set, this 404s.
+    """
+    if not can_see_api_client_stats(request):
+        return Response(status_code=404)
+    return JSONResponse(
+        {**api_client_stats(), "page_cache": page_cache.stats},
+        headers={"Cache-Control": "no-store"},
+    )
+
+
 async def section_tester(request: Request):
     template_name = "section_tester.html"
 
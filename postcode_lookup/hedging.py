@@ -0,0 +1,132 @@
+import asyncio
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+
+class LatencyTracker:
+    """
+    Keeps the most recent `size` latencies and reports percentiles of them
+    """
+
+    def __init__(self, size: int = 500):
+        self.size = size
+        self._samples = deque()
+        self._sorted = []
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        if len(self._samples) == self.size:
+            oldest = self._samples.popleft()
+            del self._sorted[bisect_left(self._sorted, oldest)]
+        self._samples.append(seconds)
+        insort(self._sorted, seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if not self._sorted:
+            return None
+        index = round(percentile / 100 * (len(self._sorted) - 1))
+        return self._sorted[index]
+
+
+class RequestHedger:
+    """
+    Sends a second, identical request if the first is taking longer than
+    usual, and uses whichever response arrives first.
+
+    "Longer than usual" is the `percentile` of recent latencies, clamped to
+    between `min_delay` and `max_delay` seconds. Nothing is hedged until
+    `min_samples` latencies have been seen.
+
+    Hedges are paid for from a token bucket that gains `max_extra_load`
+    tokens per request (up to `burst`), so hedging can never add more than
+    that proportion of extra requests upstream.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        min_delay: float = 0.05,
+        max_delay: float = 2,
+        min_samples: int = 20,
+        max_extra_load: float = 0.05,
+        burst: float = 10,
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.max_extra_load = max_extra_load
+        self.burst = burst
+        self.latencies = LatencyTracker()
+        self._tokens = 0.0
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        self.skipped_for_budget = 0
+
+    @property
+    def delay(self) -> Optional[float]:
+        if len(self.latencies) < self.min_samples:
+            return None
+        delay = self.latencies.percentile(self.percentile)
+        return min(max(delay, self.min_delay), self.max_delay)
+
+    def _take_token(self) -> bool:
+        if self._tokens < 1:
+            self.skipped_for_budget += 1
+            return False
+        self._tokens -= 1
+        return True
+
+    async def _timed(self, fn: Callable[[], Awaitable]):
+        start = time.monotonic()
+        result = await fn()
+        self.latencies.record(time.monotonic() - start)
+        return result
+
+    async def run(self, fn: Callable[[], Awaitable]):
+        self.requests += 1
+        self._tokens = min(self.burst, self._tokens + self.max_extra_load)
+
+        first = asyncio.ensure_future(self._timed(fn))
+        delay = self.delay
+        pending = {first}
+        try:
+            if delay is not None:
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if done:
+                    return first.result()
+                if self._take_token():
+                    self.fired += 1
+                    pending.add(asyncio.ensure_future(self._timed(fn)))
+
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                # Prefer a successful response; if one failed, wait for the
+                # other
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.won += 1
+                        return task.result()
+                if not pending:
+                    return done.pop().result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "fired": self.fired,
+            "won": self.won,
+            "skipped_for_budget": self.skipped_for_budget,
+            "delay": self.delay,
+        }
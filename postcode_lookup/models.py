@@ -0,0 +1,29 @@
+from typing import Any, List
+
+from response_builder.v1.models.base import Date, RootModel
+
+
+class DatePilots(Date):
+    alternative_voting_stations: Any
+
+
+class RootModelPilots(RootModel):
+    dates: List[DatePilots] = []
+
+
+class ValidatedResponse(dict):
+    """
+    An API response that a backend has already parsed and validated.
+
+    It behaves as the raw response dict, and carries the parsed `model` so
+    that `results_context` can use it rather than parsing the whole response
+    again.
+    """
+
+    def __init__(self, data: dict, model: RootModelPilots):
+        super().__init__(data)
+        self.model = model
+
+    @classmethod
+    def from_api_response(cls, data: dict) -> "ValidatedResponse":
+        return cls(data, RootModelPilots.from_api_response(data))
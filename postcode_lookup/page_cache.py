@@ -0,0 +1,273 @@
+"""
+A cache of rendered result pages.
+
+A result page depends only on the aggregator response, the page's URL
+(which gives the locale, backend and any query parameters) and the date, so
+pages are cached by a fingerprint of the response along with those. A hit
+skips `results_context`, `TemplateSorter` and rendering, and is sent
+straight from memory, already compressed if the client accepts it.
+
+The same inputs, with a version of the templates and translations, give
+each page a strong `ETag`, which is known before rendering, so a matching
+`If-None-Match` is answered with a 304 without rendering anything.
+"""
+
+import datetime as dt
+import functools
+import gzip
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+from compression import accepted_encodings, brotli, encoded_etag
+from response_cache import ResponseCache
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+
+@dataclass(frozen=True)
+class RenderedPage:
+    """
+    A rendered page, and the encodings of it we can send
+    """
+
+    template_name: str
+    # Content-Encoding (or "identity") to body
+    bodies: Dict[str, bytes]
+    # UPRNs to prefetch when the page is sent, e.g. for an address picker
+    prefetch_uprns: Tuple[str, ...] = ()
+    # When the page may next change, for its caching headers
+    changes_at: Optional[dt.datetime] = None
+    etag: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+    def response(self, request: Request, headers: dict = None) -> Response:
+        accepted = accepted_encodings(request.headers.get("accept-encoding"))
+        headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.bodies:
+                headers["Content-Encoding"] = encoding
+                break
+        else:
+            encoding = "identity"
+        if self.etag:
+            headers["ETag"] = encoded_etag(self.etag, encoding)
+        return Response(
+            self.bodies[encoding], media_type="text/html", headers=headers
+        )
+
+
+# Files that change how pages render, other than the code
+RENDER_INPUT_DIRS = (
+    Path(__file__).parent / "templates",
+    Path(__file__).parent / "locale",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def render_inputs_version(directories: Tuple[Path, ...] = RENDER_INPUT_DIRS):
+    """
+    A checksum of the templates and translations, so ETags change when they
+    do. `ETAG_VERSION` is mixed in too, to change every ETag on a deploy.
+    """
+    checksum = hashlib.blake2b(
+        os.environ.get("ETAG_VERSION", "").encode(), digest_size=16
+    )
+    for directory in directories:
+        for path in sorted(directory.rglob("*")):
+            if path.is_file():
+                checksum.update(str(path.relative_to(directory)).encode())
+                checksum.update(path.read_bytes())
+    return checksum.hexdigest()
+
+
+def matching_etag(request: Request, etag: str) -> Optional[str]:
+    """
+    The entity tag in the request's `If-None-Match` that matches `etag` (in
+    any encoding), if there is one
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == "*":
+        return etag
+    for tag in if_none_match.split(","):
+        # If-None-Match uses the weak comparison
+        tag = tag.strip().removeprefix("W/")
+        if tag == etag or any(
+            tag == encoded_etag(etag, encoding) for encoding in ("br", "gzip")
+        ):
+            return tag
+    return None
+
+
+def not_modified(
+    request: Request, etag: str, headers: dict = None
+) -> Optional[Response]:
+    """
+    A 304 response, if the client already has the page with `etag`
+    """
+    tag = matching_etag(request, etag)
+    if tag is None:
+        return None
+    return Response(
+        status_code=304,
+        headers={**(headers or {}), "ETag": tag, "Vary": "Accept-Encoding"},
+    )
+
+
+def compressed_bodies(body: bytes) -> Dict[str, bytes]:
+    bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=6)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(body, quality=5)
+    return bodies
+
+
+def _fingerprint(data: dict) -> str:
+    encoded = json.dumps(
+        data, sort_keys=True, separators=(",", ":"), default=str
+    ).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class PageCache:
+    """
+    Rendered pages, in an LRU bounded by their total size (counting every
+    encoding).
+
+    Responses from the API cache are shared dicts, so fingerprints of the
+    last `max_fingerprints` responses are remembered by identity, rather
+    than serialising the same response for every request.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_entries: int = 5000,
+        ttl: float = 24 * 60 * 60,
+        max_fingerprints: int = 256,
+    ):
+        self.enabled = max_bytes > 0
+        self.pages = ResponseCache(
+            max_entries=max_entries, max_bytes=max_bytes, ttl=ttl, stale_ttl=0
+        )
+        self.max_fingerprints = max_fingerprints
+        self._fingerprints: OrderedDict[int, Tuple[dict, str]] = OrderedDict()
+
+    def fingerprint(self, data: dict) -> str:
+        remembered = self._fingerprints.get(id(data))
+        if remembered is not None and remembered[0] is data:
+            self._fingerprints.move_to_end(id(data))
+            return remembered[1]
+        fingerprint = _fingerprint(data)
+        self._fingerprints[id(data)] = (data, fingerprint)
+        while len(self._fingerprints) > self.max_fingerprints:
+            self._fingerprints.popitem(last=False)
+        return fingerprint
+
+    def key(
+        self, request: Request, api_response: dict, url_prefix: str
+    ) -> Hashable:
+        return (
+            self.fingerprint(api_response),
+            request.scope.get("current_language"),
+            url_prefix,
+            str(dt.date.today()),
+            str(request.url),
+        )
+
+    def etag(self, key: Hashable) -> str:
+        """
+        A strong ETag for the page cached (or that would be cached) at `key`
+        """
+        digest = hashlib.blake2b(
+            repr((render_inputs_version(), key)).encode(), digest_size=16
+        ).hexdigest()
+        return f'"{digest}"'
+
+    def get(self, key: Hashable) -> Optional[RenderedPage]:
+        if not self.enabled:
+            return None
+        entry = self.pages.get(key)
+        return entry.data if entry is not None else None
+
+    def put(
+        self,
+        key: Hashable,
+        body: bytes,
+        template_name: str,
+        prefetch_uprns: Iterable[str] = (),
+        changes_at: Optional[dt.datetime] = None,
+    ) -> RenderedPage:
+        page = RenderedPage(
+            template_name=template_name,
+            bodies=compressed_bodies(body),
+            prefetch_uprns=tuple(prefetch_uprns),
+            changes_at=changes_at,
+            etag=self.etag(key),
+        )
+        if self.enabled:
+            self.pages.put(key, self.pages.make_entry(page, size=page.size))
+        return page
+
+    def store(
+        self,
+        key: Hashable,
+        response: Response,
+        template_name: str,
+        prefetch_uprns: Iterable[str] = (),
+        changes_at: Optional[dt.datetime] = None,
+    ) -> Response:
+        """
+        Cache the page `response` renders, returning the response to send.
+
+        Streamed pages are cached once they've been sent in full.
+        """
+        if not self.enabled or response.status_code != 200:
+            return response
+        prefetch_uprns = tuple(prefetch_uprns)
+        if not isinstance(response, StreamingResponse):
+            self.put(
+                key, response.body, template_name, prefetch_uprns, changes_at
+            )
+            return response
+
+        body_iterator = response.body_iterator
+
+        async def caching_iterator():
+            chunks = []
+            async for chunk in body_iterator:
+                chunks.append(chunk)
+                yield chunk
+            self.put(
+                key,
+                b"".join(chunks),
+                template_name,
+                prefetch_uprns,
+                changes_at,
+            )
+
+        response.body_iterator = caching_iterator()
+        return response
+
+    def clear(self):
+        self.pages.clear()
+        self._fingerprints.clear()
+
+    @property
+    def stats(self) -> dict:
+        return {**self.pages.stats, "enabled": self.enabled}
+
+
+# Set to 0 to turn off the page cache
+page_cache = PageCache(
+    max_bytes=int(os.environ.get("PAGE_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+    max_entries=int(os.environ.get("PAGE_CACHE_MAX_ENTRIES", 5000)),
+)
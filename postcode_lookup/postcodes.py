@@ -0,0 +1,61 @@
+import re
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+OUTCODE_PATTERN = "[A-PR-UWYZ]([0-9]{1,2}|([A-HIK-Y][0-9](|[0-9]|[ABEHMNPRVWXY]))|[0-9][A-HJKSTUW])"
+INCODE_PATTERN = "[0-9][ABD-HJLNP-UW-Z]{2}"
+
+
+class Postcode(NamedTuple):
+    canonical: str  # e.g. "SW1A 1AA"
+    compact: str  # e.g. "SW1A1AA"
+
+    def __str__(self):
+        return self.canonical
+
+
+class PostcodeValidator:
+    """
+    Validates and normalises UK postcodes.
+
+    The pattern is compiled once, and each call makes a single pass over the
+    input, returning both the canonical and compact forms of the postcode,
+    or `None` if it isn't valid.
+
+    Spaces anywhere in the input are ignored, and only the first 10
+    characters are considered.
+    """
+
+    postcode_regex = re.compile(
+        rf"(?:(GIR)(0AA)|(?P<outcode>{OUTCODE_PATTERN})(?P<incode>{INCODE_PATTERN}))"
+    )
+
+    def validate(self, postcode) -> Optional[Postcode]:
+        if not isinstance(postcode, str):
+            postcode = str(postcode)
+        compact = postcode[:10].replace(" ", "").strip().upper()
+        match = self.postcode_regex.fullmatch(compact)
+        if not match:
+            return None
+        outcode, incode = (
+            (match["outcode"], match["incode"])
+            if match["outcode"]
+            else match.group(1, 2)
+        )
+        return Postcode(canonical=f"{outcode} {incode}", compact=compact)
+
+    def is_valid(self, postcode) -> bool:
+        return self.validate(postcode) is not None
+
+    def validate_many(
+        self, postcodes: Iterable
+    ) -> Iterator[Optional[Postcode]]:
+        """
+        Validate postcodes in bulk, yielding a `Postcode` (or `None`) for
+        each input, in order
+        """
+        validate = self.validate
+        for postcode in postcodes:
+            yield validate(postcode)
+
+
+postcode_validator = PostcodeValidator()
@@ -0,0 +1,148 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Hashable, Iterable
+
+# True while running a prefetch, so the code it calls can tell it apart
+# from work a user is waiting for
+prefetching: ContextVar[bool] = ContextVar("prefetching", default=False)
+
+
+class Prefetcher:
+    """
+    Runs speculative background work, e.g. fetching responses a user is
+    likely to ask for next.
+
+    Each `schedule` call starts at most `max_per_request` prefetches, and at
+    most `max_concurrent` run at once across the process. Prefetching stops
+    (and queued or running prefetches are cancelled) while `busy_threshold`
+    or more requests that users are waiting for are in flight.
+
+    Callers `track` the keys prefetches fetch, and `mark_used` keys that
+    users then ask for, so we can tell how many prefetches were worth it.
+    """
+
+    def __init__(
+        self,
+        max_per_request: int = 10,
+        max_concurrent: int = 4,
+        busy_threshold: int = 8,
+        max_tracked: int = 5000,
+    ):
+        self.max_per_request = max_per_request
+        self.max_concurrent = max_concurrent
+        self.busy_threshold = busy_threshold
+        self.max_tracked = max_tracked
+        self.foreground_in_flight = 0
+        self._tasks = set()
+        self._loop = None
+        self._semaphore: asyncio.Semaphore = None
+        self._tracked: OrderedDict[Hashable, None] = OrderedDict()
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.skipped_busy = 0
+        self.skipped_limit = 0
+        self.used = 0
+        self.unused = 0
+
+    @property
+    def busy(self) -> bool:
+        return self.foreground_in_flight >= self.busy_threshold
+
+    @contextmanager
+    def foreground(self):
+        """
+        Wrap work a user is waiting for, so prefetching backs off when
+        there's a lot of it
+        """
+        self.foreground_in_flight += 1
+        if self.busy:
+            self.cancel_all()
+        try:
+            yield
+        finally:
+            self.foreground_in_flight -= 1
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def schedule(self, fns: Iterable[Callable[[], Awaitable]]) -> int:
+        """
+        Start prefetching with each of `fns`, returning how many were
+        started
+        """
+        fns = list(fns)
+        if self.busy:
+            self.skipped_busy += len(fns)
+            return 0
+        if len(fns) > self.max_per_request:
+            self.skipped_limit += len(fns) - self.max_per_request
+            fns = fns[: self.max_per_request]
+        for fn in fns:
+            task = asyncio.create_task(self._run(fn))
+            self._tasks.add(task)
+            task.add_done_callback(self._done)
+        self.scheduled += len(fns)
+        return len(fns)
+
+    async def _run(self, fn: Callable[[], Awaitable]):
+        async with self._get_semaphore():
+            if self.busy:
+                self.skipped_busy += 1
+                return
+            prefetching.set(True)
+            try:
+                await fn()
+            except Exception:
+                # A failed prefetch just means the user's request won't be
+                # any faster
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            self.cancelled += 1
+
+    def cancel_all(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def track(self, key: Hashable):
+        self._tracked[key] = None
+        self._tracked.move_to_end(key)
+        while len(self._tracked) > self.max_tracked:
+            self._tracked.popitem(last=False)
+            self.unused += 1
+
+    def mark_used(self, key: Hashable):
+        if key in self._tracked:
+            del self._tracked[key]
+            self.used += 1
+
+    def clear(self):
+        self.cancel_all()
+        self._tracked.clear()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "skipped_busy": self.skipped_busy,
+            "skipped_limit": self.skipped_limit,
+            "in_flight": len(self._tasks),
+            "used": self.used,
+            "unused": self.unused,
+            "awaiting_use": len(self._tracked),
+        }
@@ -0,0 +1,212 @@
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Hashable, Iterable, Mapping, Optional, Tuple
+
+MAX_AGE_RE = re.compile(r"(?:^|,)\s*(s-maxage|max-age)\s*=\s*\"?(\d+)")
+
+
+@dataclass
+class CachedResponse:
+    """
+    A decoded aggregator response held in the cache.
+
+    `data` is shared between every request that hits this entry, so callers
+    must treat it as read only.
+
+    `projection` is the top level fields `data` was limited to, or `None` if
+    it's the full response.
+    """
+
+    data: dict
+    size: int
+    fresh_until: float
+    stale_until: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    projection: Optional[Tuple[str, ...]] = None
+
+    def is_fresh(self, now: float = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        return now < self.fresh_until
+
+    def is_usable(self, now: float = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        return now < self.stale_until
+
+    def covers(self, fields: Optional[Iterable[str]]) -> bool:
+        """
+        Can this entry serve a request for `fields` (`None` meaning the
+        full response)?
+        """
+        if self.projection is None:
+            return True
+        if fields is None:
+            return False
+        return set(fields) <= set(self.projection)
+
+    @property
+    def conditional_headers(self) -> dict:
+        """
+        Headers to ask upstream for a 304 if this entry is still current
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def freshness_lifetime(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    How many seconds a response may be cached for, according to its
+    `Cache-Control` (preferring `s-maxage`, as we're a shared cache) or
+    `Expires` headers, less its `Age`.
+
+    Returns `None` if the headers don't say.
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    directives = dict(MAX_AGE_RE.findall(cache_control))
+    max_age = directives.get("s-maxage", directives.get("max-age"))
+    if max_age is not None:
+        age = headers.get("age", "0")
+        age = int(age) if age.isdigit() else 0
+        return max(0, int(max_age) - age)
+
+    if expires := headers.get("expires"):
+        try:
+            expires_at = parsedate_to_datetime(expires)
+            date = (
+                parsedate_to_datetime(headers["date"])
+                if "date" in headers
+                else datetime.now(timezone.utc)
+            )
+            return max(0, (expires_at - date).total_seconds())
+        except (TypeError, ValueError):
+            # An invalid Expires means "already expired"
+            return 0
+    return None
+
+
+class ResponseCache:
+    """
+    Bounded, in-process TTL/LRU cache of aggregator responses.
+
+    Entries are fresh for `ttl` seconds, then may be served stale for a
+    further `stale_ttl` seconds while the caller refreshes them in the
+    background. The least recently used entries are evicted once either
+    `max_entries` or `max_bytes` (measured as the size of the response body)
+    is exceeded.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        max_bytes: int = 50 * 1024 * 1024,
+        ttl: float = 60,
+        stale_ttl: float = 300,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None or not entry.is_usable(now):
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        if entry.is_fresh(now):
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+        return entry
+
+    def make_entry(
+        self, data: dict, size: int, ttl: float = None, **attributes
+    ) -> CachedResponse:
+        if ttl is None:
+            ttl = self.ttl
+        now = time.monotonic()
+        return CachedResponse(
+            data=data,
+            size=size,
+            fresh_until=now + ttl,
+            stale_until=now + ttl + self.stale_ttl,
+            **attributes,
+        )
+
+    def set(
+        self, key: Hashable, data: dict, size: int, ttl: float = None
+    ) -> CachedResponse:
+        entry = self.make_entry(data, size, ttl)
+        self.put(key, entry)
+        return entry
+
+    def put(self, key: Hashable, entry: CachedResponse):
+        if key in self._entries:
+            self._remove(key)
+        if entry.size > self.max_bytes:
+            # Never let a single huge response flush the whole cache
+            return
+        self._entries[key] = entry
+        self.current_bytes += entry.size
+        self._evict()
+
+    def delete(self, key: Hashable):
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+        self.hits = self.stale_hits = self.misses = self.evictions = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.size
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or self.current_bytes > self.max_bytes
+        ):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
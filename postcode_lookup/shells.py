@@ -0,0 +1,330 @@
+"""
+Page "shells": base templates split into static byte segments and blocks.
+
+`base.html` and `base_cy.html` are mostly static Electoral Commission
+chrome, with a handful of blocks that pages fill in. Rendering a page
+through a shell yields the static parts as ready encoded `bytes`, and only
+renders the blocks, so most of each response is never handled as text.
+
+`lib/template_generator/generate_base_template.py` writes a shell for each
+base template it generates. If a shell is missing, or was made from
+different template source, it's worked out from the template when first
+needed instead.
+"""
+
+import hashlib
+import json
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Union
+from weakref import WeakKeyDictionary
+
+import jinja2
+from jinja2 import nodes
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, StreamingResponse
+from starlette.templating import Jinja2Templates, _TemplateResponse
+
+TEMPLATES_DIR = Path(__file__).parent / "templates"
+SHELLS_DIR = TEMPLATES_DIR / "shells"
+
+# A static segment, or the name of a block
+Segment = Union[bytes, str]
+
+
+class NotShellable(ValueError):
+    """
+    The template has dynamic content outside of blocks
+    """
+
+
+def source_checksum(source: str) -> str:
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def split_template(source: str) -> List[Segment]:
+    """
+    Split base template source into its top level static content and
+    blocks
+    """
+    segments: List[Segment] = []
+    for node in jinja2.Environment().parse(source).body:
+        if isinstance(node, nodes.Block):
+            segments.append(node.name)
+        elif isinstance(node, nodes.Output) and all(
+            isinstance(child, nodes.TemplateData) for child in node.nodes
+        ):
+            data = "".join(child.data for child in node.nodes).encode()
+            if segments and isinstance(segments[-1], bytes):
+                segments[-1] += data
+            else:
+                segments.append(data)
+        else:
+            raise NotShellable(
+                f"line {node.lineno}: {type(node).__name__} outside a block"
+            )
+    return segments
+
+
+def write_shell(name: str, source: str, directory: Path = SHELLS_DIR):
+    directory.mkdir(parents=True, exist_ok=True)
+    segments = [
+        {"static": segment.decode()}
+        if isinstance(segment, bytes)
+        else {"block": segment}
+        for segment in split_template(source)
+    ]
+    with (directory / f"{name}.json").open("w") as f:
+        json.dump(
+            {"source_checksum": source_checksum(source), "segments": segments},
+            f,
+            indent=1,
+        )
+
+
+BASE_TEMPLATES = ("base.html", "base_cy.html")
+
+
+def write_shells(names=BASE_TEMPLATES, directory: Path = SHELLS_DIR):
+    for name in names:
+        source = (TEMPLATES_DIR / name).read_text()
+        write_shell(name, source, directory=directory)
+
+
+def read_shell(
+    name: str, source: str, directory: Path = SHELLS_DIR
+) -> Optional[List[Segment]]:
+    """
+    The segments written for `name` by `write_shell`, or `None` if there
+    aren't any for this version of its source
+    """
+    try:
+        with (directory / f"{name}.json").open() as f:
+            shell = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if shell.get("source_checksum") != source_checksum(source):
+        return None
+    return [
+        segment["static"].encode() if "static" in segment else segment["block"]
+        for segment in shell["segments"]
+    ]
+
+
+def shell_template(
+    base: jinja2.Template, segments: List[Segment]
+) -> jinja2.Template:
+    """
+    A copy of `base` that renders its static content as `bytes`.
+
+    Templates can `{% extends %}` it like any other, but it has to be
+    rendered with `render_bytes`.
+    """
+    missing_blocks = {
+        segment for segment in segments if isinstance(segment, str)
+    } - set(base.blocks)
+    if missing_blocks:
+        raise NotShellable(f"blocks not in template: {missing_blocks}")
+
+    def root_render_func(context):
+        for segment in segments:
+            if isinstance(segment, bytes):
+                yield segment
+            else:
+                yield from context.blocks[segment][0](context)
+
+    # `Template.__new__` compiles source, so copy the attributes instead
+    shell = object.__new__(type(base))
+    shell.__dict__.update(base.__dict__)
+    shell.root_render_func = root_render_func
+    return shell
+
+
+# Shells (or `None`, for templates that can't have one) by environment,
+# then base template name
+_shells: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def get_shell(env: jinja2.Environment, name: str) -> Optional[jinja2.Template]:
+    """
+    The shell template for base template `name` in `env`, or `None` if it
+    can't have one
+    """
+    shells = _shells.setdefault(env, {})
+    if name not in shells:
+        base = env.get_template(name)
+        source = env.loader.get_source(env, name)[0]
+        segments = read_shell(name, source)
+        try:
+            if segments is None:
+                segments = split_template(source)
+            shells[name] = shell_template(base, segments)
+        except NotShellable:
+            shells[name] = None
+    return shells[name]
+
+
+def _encoded(chunks: Iterable[Union[bytes, str]]) -> Iterator[bytes]:
+    for chunk in chunks:
+        yield chunk if isinstance(chunk, bytes) else chunk.encode()
+
+
+def render_bytes(template: jinja2.Template, context: dict) -> bytes:
+    """
+    Render `template`, which may extend a shell, to UTF-8
+    """
+    try:
+        return b"".join(
+            _encoded(template.root_render_func(template.new_context(context)))
+        )
+    except Exception:
+        template.environment.handle_exception()
+
+
+# Streamed pages are sent in chunks of at least this many bytes
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def generate_bytes(
+    template: jinja2.Template,
+    context: dict,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Render `template`, which may extend a shell, to UTF-8 as it goes
+    """
+    buffer = bytearray()
+    try:
+        for chunk in _encoded(
+            template.root_render_func(template.new_context(context))
+        ):
+            buffer += chunk
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+    except Exception:
+        template.environment.handle_exception()
+    if buffer:
+        yield bytes(buffer)
+
+
+@contextmanager
+def using_shell(request: Request, shell: Optional[jinja2.Template]):
+    """
+    `{% extends request.base_template %}` takes a template as well as a
+    name, so point it at `shell` while a page renders
+    """
+    if shell is None:
+        yield
+        return
+    base_template = request.scope["base_template"]
+    request.scope["base_template"] = shell
+    try:
+        yield
+    finally:
+        request.scope["base_template"] = base_template
+
+
+class ShellTemplateResponse(_TemplateResponse):
+    def __init__(self, template, context, content: bytes, **kwargs):
+        # Skip `_TemplateResponse.__init__`, which would render the
+        # template again
+        self.template = template
+        self.context = context
+        HTMLResponse.__init__(self, content, **kwargs)
+
+
+class ShellTemplates(Jinja2Templates):
+    """
+    `Jinja2Templates` that render pages extending the request's base
+    template (`request.base_template`, set by `i18nMiddleware`) through
+    its shell
+    """
+
+    def get_request_shell(self, request: Request) -> Optional[jinja2.Template]:
+        base_template = request.scope.get("base_template")
+        if not isinstance(base_template, str):
+            return None
+        return get_shell(self.env, base_template)
+
+    def make_context(self, request: Request, context: dict = None) -> dict:
+        context = context or {}
+        context.setdefault("request", request)
+        for context_processor in self.context_processors:
+            context.update(context_processor(request))
+        return context
+
+    def TemplateResponse(
+        self,
+        request: Request,
+        name: str,
+        context: dict = None,
+        status_code: int = 200,
+        headers=None,
+        media_type: str = None,
+        background=None,
+    ):
+        shell = self.get_request_shell(request)
+        if shell is None:
+            return super().TemplateResponse(
+                request,
+                name,
+                context,
+                status_code=status_code,
+                headers=headers,
+                media_type=media_type,
+                background=background,
+            )
+
+        context = self.make_context(request, context)
+        template = self.get_template(name)
+        with using_shell(request, shell):
+            content = render_bytes(template, context)
+        return ShellTemplateResponse(
+            template,
+            context,
+            content,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            background=background,
+        )
+
+    def StreamingTemplateResponse(
+        self,
+        request: Request,
+        name: str,
+        context: dict = None,
+        status_code: int = 200,
+        headers=None,
+        background=None,
+    ) -> StreamingResponse:
+        """
+        Like `TemplateResponse`, but sends the page as it renders, so the
+        browser can start on the head and header while the rest of the
+        page is rendered.
+
+        The first chunk is rendered before this returns, so an error there
+        is still a 500. The status and headers are sent with it, so an
+        error later on cuts the page short instead.
+        """
+        context = self.make_context(request, context)
+        template = self.get_template(name)
+        shell = self.get_request_shell(request)
+        with using_shell(request, shell):
+            chunks = generate_bytes(template, context)
+            first = next(chunks, b"")
+
+        async def body():
+            yield first
+            with using_shell(request, shell):
+                for chunk in chunks:
+                    yield chunk
+
+        return StreamingResponse(
+            body(),
+            status_code=status_code,
+            headers=headers,
+            media_type="text/html",
+            background=background,
+        )
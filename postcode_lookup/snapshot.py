@@ -0,0 +1,358 @@
+"""
+Recorded snapshots of aggregator responses, for offline replay and load
+testing with `SnapshotAPIBackend`.
+
+A snapshot is a single file holding any number of responses, keyed by
+endpoint (e.g. `postcode/SW1A1AA` or `address/100023336956`). It's made up
+of:
+
+* A header: `MAGIC`, then the number of index slots and of records.
+* An open addressing hash index of `(hash, offset)` slots, kept at most
+  half full, so a lookup usually touches one or two slots.
+* The records: the key, then the zlib compressed JSON response, each
+  prefixed with its length.
+
+Readers `mmap` the file, so lookups don't need the whole snapshot in
+memory, and the OS shares its pages between processes.
+
+Record a snapshot from the live API with:
+
+    uv run python postcode_lookup/snapshot.py postcodes.txt snapshot.bin
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from collections import deque
+from copy import deepcopy
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+MAGIC = b"DCSNAP01"
+HEADER = struct.Struct("<8sQQ")
+SLOT = struct.Struct("<QQ")
+KEY_LENGTH = struct.Struct("<H")
+VALUE_LENGTH = struct.Struct("<I")
+
+
+def key_hash(key: bytes) -> int:
+    # 0 marks an empty slot, so never use it as a hash
+    return (
+        int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+        or 1
+    )
+
+
+def postcode_key(postcode: str) -> str:
+    return f"postcode/{postcode}"
+
+
+def address_key(uprn: str) -> str:
+    return f"address/{uprn}"
+
+
+class SnapshotFormatError(Exception):
+    pass
+
+
+class SnapshotWriter:
+    """
+    Writes a snapshot file.
+
+    Responses are written to a temporary file as they're added, so only the
+    keys and offsets are held in memory. The index is written when the
+    writer is closed. Adding the same key twice keeps the last response.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._data = tempfile.TemporaryFile(dir=self.path.parent)
+        self._offsets: Dict[bytes, int] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._data.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def add(self, key: str, response: dict):
+        key = key.encode()
+        value = zlib.compress(
+            json.dumps(response, separators=(",", ":")).encode()
+        )
+        self._offsets[key] = self._data.tell()
+        self._data.write(KEY_LENGTH.pack(len(key)))
+        self._data.write(key)
+        self._data.write(VALUE_LENGTH.pack(len(value)))
+        self._data.write(value)
+
+    def _build_index(self) -> Tuple[int, bytearray]:
+        slot_count = max(8, len(self._offsets) * 2)
+        index = bytearray(slot_count * SLOT.size)
+        data_start = HEADER.size + len(index)
+        for key, offset in self._offsets.items():
+            hash_ = key_hash(key)
+            slot = hash_ % slot_count
+            while SLOT.unpack_from(index, slot * SLOT.size)[0]:
+                slot = (slot + 1) % slot_count
+            SLOT.pack_into(index, slot * SLOT.size, hash_, data_start + offset)
+        return slot_count, index
+
+    def close(self):
+        slot_count, index = self._build_index()
+        # Write to a temporary file and rename it into place, so readers
+        # never see a partial snapshot
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, slot_count, len(self._offsets)))
+            f.write(index)
+            self._data.seek(0)
+            shutil.copyfileobj(self._data, f)
+        self._data.close()
+        os.replace(tmp_path, self.path)
+
+
+class SnapshotReader:
+    """
+    Looks up responses in a snapshot file written by `SnapshotWriter`
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            # Check before mapping, as an empty file can't be mapped
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise SnapshotFormatError(f"{path} is too short")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slot_count, self.record_count = HEADER.unpack_from(
+            self._mmap
+        )
+        if magic != MAGIC:
+            raise SnapshotFormatError(f"{path} isn't a snapshot")
+
+    def __len__(self):
+        return self.record_count
+
+    def __contains__(self, key: str):
+        return self._find(key.encode()) is not None
+
+    def _find(self, key: bytes) -> Optional[int]:
+        """
+        The offset of the response for `key`, or `None`
+        """
+        hash_ = key_hash(key)
+        slot = hash_ % self.slot_count
+        for _ in range(self.slot_count):
+            slot_hash, offset = SLOT.unpack_from(
+                self._mmap, HEADER.size + slot * SLOT.size
+            )
+            if not slot_hash:
+                return None
+            if slot_hash == hash_:
+                (key_length,) = KEY_LENGTH.unpack_from(self._mmap, offset)
+                offset += KEY_LENGTH.size
+                if self._mmap[offset : offset + key_length] == key:
+                    return offset + key_length
+            slot = (slot + 1) % self.slot_count
+        return None
+
+    def get(self, key: str) -> Optional[dict]:
+        offset = self._find(key.encode())
+        if offset is None:
+            return None
+        (value_length,) = VALUE_LENGTH.unpack_from(self._mmap, offset)
+        offset += VALUE_LENGTH.size
+        return json.loads(
+            zlib.decompress(self._mmap[offset : offset + value_length])
+        )
+
+    def close(self):
+        self._mmap.close()
+
+
+def pseudonymous_uprn(uprn: str, salt: str) -> str:
+    digest = hashlib.blake2b(f"{salt}:{uprn}".encode(), digest_size=5)
+    return str(int.from_bytes(digest.digest(), "little")).zfill(12)
+
+
+def anonymise_response(response: dict, salt: str) -> dict:
+    """
+    Remove details of individual properties from a response.
+
+    Addresses are replaced with placeholders and UPRNs with stable
+    pseudonyms, in both slugs and URLs (so address picker links still
+    resolve within the snapshot), and the postcode location is rounded to
+    about 1km. The shape of the response, and everything about elections
+    and councils, is left as it is.
+    """
+    response = deepcopy(response)
+    for number, address in enumerate(response.get("addresses") or [], 1):
+        if "address" in address:
+            address["address"] = f"{number} Example Street"
+        uprn = address.get("slug")
+        if uprn:
+            address["slug"] = pseudonymous_uprn(uprn, salt)
+        if address.get("url"):
+            # e.g. ".../api/v1/address/<UPRN>/"
+            if uprn and f"/{uprn}/" in address["url"]:
+                address["url"] = address["url"].replace(
+                    f"/{uprn}/", f"/{address['slug']}/"
+                )
+            else:
+                del address["url"]
+    geometry = (response.get("postcode_location") or {}).get("geometry") or {}
+    if coordinates := geometry.get("coordinates"):
+        geometry["coordinates"] = [round(c, 2) for c in coordinates]
+    return response
+
+
+async def record(
+    postcodes: Iterable[str],
+    writer: SnapshotWriter,
+    api_key: str,
+    include_addresses: bool = True,
+    anonymise_salt: str = None,
+    concurrency: int = 8,
+):
+    """
+    Fetch responses for `postcodes` from the live API into `writer`, and
+    (if `include_addresses`) responses for every address in any address
+    pickers.
+
+    Invalid postcodes, and any that error, are skipped.
+
+    All the lookups, for addresses as well as postcodes, are made by a
+    fixed pool of `concurrency` workers. Workers take addresses waiting to
+    be recorded before reading the next postcode, and `postcodes` is read
+    as it's needed, so memory doesn't grow with the number of postcodes.
+    """
+    # Imported here as dc_api_client imports this module
+    from dc_api_client import (
+        ApiError,
+        InvalidPostcodeException,
+        InvalidUPRNException,
+        LiveAPIBackend,
+    )
+    from postcodes import postcode_validator
+
+    client = LiveAPIBackend(api_key=api_key, request=None)
+    skipped = 0
+    postcodes = iter(postcodes)
+    uprns = deque()
+    busy = 0
+    work_changed = asyncio.Condition()
+
+    def add(key, response):
+        if anonymise_salt is not None:
+            response = anonymise_response(response, anonymise_salt)
+        writer.add(key, response)
+
+    async def record_uprn(uprn):
+        nonlocal skipped
+        try:
+            response = await client.aget_uprn(uprn)
+        except (InvalidUPRNException, ApiError):
+            skipped += 1
+            return
+        if anonymise_salt is not None:
+            uprn = pseudonymous_uprn(uprn, anonymise_salt)
+        add(address_key(uprn), response)
+
+    async def record_postcode(postcode):
+        nonlocal skipped
+        parsed = postcode_validator.validate(postcode)
+        if not parsed:
+            skipped += 1
+            return
+        try:
+            response = await client.aget_postcode(parsed.compact)
+        except (InvalidPostcodeException, ApiError):
+            skipped += 1
+            return
+        add(postcode_key(parsed.compact), response)
+        if include_addresses and response.get("address_picker"):
+            uprns.extend(
+                address["slug"] for address in response.get("addresses") or []
+            )
+
+    async def worker():
+        nonlocal busy
+        while True:
+            if uprns:
+                work = record_uprn(uprns.popleft())
+            elif (postcode := next(postcodes, None)) is not None:
+                work = record_postcode(postcode)
+            elif busy:
+                # Another worker may yet find addresses to record
+                async with work_changed:
+                    await work_changed.wait()
+                continue
+            else:
+                return
+            busy += 1
+            try:
+                await work
+            finally:
+                busy -= 1
+                async with work_changed:
+                    work_changed.notify_all()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Record live API responses into a snapshot file"
+    )
+    parser.add_argument(
+        "postcodes", type=Path, help="A file with one postcode per line"
+    )
+    parser.add_argument("output", type=Path, help="The snapshot to write")
+    parser.add_argument(
+        "--no-addresses",
+        action="store_true",
+        help="Don't record the addresses in address pickers",
+    )
+    parser.add_argument(
+        "--anonymise",
+        metavar="SALT",
+        help="Replace addresses and UPRNs, using SALT to make pseudonyms",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    api_key = os.environ.get("API_KEY")
+    if not api_key:
+        parser.error("Set API_KEY to record from the live API")
+
+    with args.postcodes.open() as f, SnapshotWriter(args.output) as writer:
+        postcodes = (line.strip() for line in f if line.strip())
+        skipped = asyncio.run(
+            record(
+                postcodes,
+                writer,
+                api_key=api_key,
+                include_addresses=not args.no_addresses,
+                anonymise_salt=args.anonymise,
+                concurrency=args.concurrency,
+            )
+        )
+    print(f"Recorded {len(writer)} responses, skipped {skipped}")
+
+
+if __name__ == "__main__":
+    main()
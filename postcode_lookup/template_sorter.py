@@ -2,7 +2,7 @@ import abc
 import datetime
 from enum import Enum
 from functools import cached_property
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 
 from dateparser import parse
 from postal_votes import get_postal_vote_dispatch_dates
@@ -492,6 +492,36 @@ class ElectionDateTemplateSorter:
 
         self.sections = sorted(enabled_sections, key=lambda sec: sec.weight)
 
+    @property
+    def change_dates(self) -> Set[datetime.date]:
+        """
+        Days on which the current mode, or a section's weight or context,
+        may change.
+
+        Sections compare `current_date` to timetable events and to polling
+        day, so their output can only change on (or the day after) those
+        dates, or the days before polling day that they count back from.
+        """
+        poll_date = parse(self.date_data.date).date()
+        dates = {
+            # FlexVoting2026PilotSection, PollingStationSection's context
+            # and weight
+            poll_date - datetime.timedelta(days=9),
+            poll_date - datetime.timedelta(days=7),
+            poll_date - datetime.timedelta(days=1),
+            poll_date,
+            poll_date + datetime.timedelta(days=1),
+        }
+        timetables = {self.timetable} | {
+            section.timetable for section in self.sections
+        }
+        for timetable in timetables:
+            for event in timetable.timetable:
+                # `current_mode` changes on the day, `is_after` the day after
+                dates.add(event["date"])
+                dates.add(event["date"] + datetime.timedelta(days=1))
+        return dates
+
 
 class TemplateSorter:
     """
@@ -579,6 +609,32 @@ class TemplateSorter:
         for date in self.dates:
             self.all_cancelled_reasons.update(date.cancellation_reasons)
 
+    @cached_property
+    def next_change(self) -> Optional[datetime.datetime]:
+        """
+        When (as a UTC datetime) this page may next be sorted differently
+        for the same API response, or `None` if it won't be.
+
+        Everything here works a day at a time, so this is the start of the
+        first day after `current_date` on which a date is dropped, the
+        title changes, or a section's mode, weight or context flips.
+        """
+        change_dates = set()
+        for date in self.api_response.dates:
+            poll_date = parse(date.date).date()
+            # Dates are shown up to polling day, which has its own title
+            change_dates.add(poll_date)
+            change_dates.add(poll_date + datetime.timedelta(days=1))
+        for election_date in self.dates:
+            change_dates.update(election_date.change_dates)
+
+        upcoming = [date for date in change_dates if date > self.current_date]
+        if not upcoming:
+            return None
+        return datetime.datetime.combine(
+            min(upcoming), datetime.time.min, tzinfo=datetime.timezone.utc
+        )
+
     @property
     def response_type(self):
         if not self.api_response.dates:
@@ -1,6 +1,10 @@
 import datetime as dt
+import hashlib
+import os
+import threading
+from email.utils import formatdate
 from pathlib import Path
-from typing import Any, List
+from typing import Dict, Iterable, Optional
 
 import babel
 import dateparser
@@ -10,14 +14,15 @@ from dateutil.parser import parse
 from jinja2 import ChainableUndefined
 from jinja2.filters import do_mark_safe
 from markupsafe import Markup, escape
+from models import RootModelPilots, ValidatedResponse
 from response_builder.v1.models.base import (
     Ballot,
     CancellationReason,
-    Date,
-    RootModel,
 )
+from shells import ShellTemplates
 from starlette.datastructures import URL, Headers
 from starlette.requests import Request
+from starlette.responses import Response
 from starlette.templating import Jinja2Templates
 from starlette_babel import get_locale, get_translator
 from starlette_babel import gettext_lazy as _
@@ -25,19 +30,14 @@ from starlette_babel import gettext_lazy as _
 translator = get_translator()
 
 
-class DatePilots(Date):
-    alternative_voting_stations: Any
-
-
-class RootModelPilots(RootModel):
-    dates: List[DatePilots] = []
-
-
 def results_context(api_response, request, postcode, url_prefix):
     api_json = api_response
 
     context = {}
-    context["api_response"] = RootModelPilots.from_api_response(api_json)
+    if isinstance(api_response, ValidatedResponse):
+        context["api_response"] = api_response.model
+    else:
+        context["api_response"] = RootModelPilots.from_api_response(api_json)
     context["postcode"] = postcode
     context["uprn"] = request.path_params.get("uprn", None)
     context["url_prefix"] = url_prefix
@@ -47,7 +47,10 @@ def results_context(api_response, request, postcode, url_prefix):
         context["route_name"] = "postcode"
 
     if api_response.get("parl_recall_petition"):
-        context["parl_recall_petition"] = api_response["parl_recall_petition"]
+        # Copy, as the API response can be shared via the response cache
+        context["parl_recall_petition"] = dict(
+            api_response["parl_recall_petition"]
+        )
         if "signing_start" in context["parl_recall_petition"]:
             context["parl_recall_petition"]["signing_start"] = parse(
                 context["parl_recall_petition"]["signing_start"]
@@ -79,8 +82,72 @@ def is_welsh(path: str) -> bool:
 
 def get_loader(request: Request) -> Jinja2Templates:
     if is_welsh(request.url.path):
-        return cy_templates
-    return en_templates
+        return get_templates("cy")
+    return get_templates("en")
+
+
+# Send result pages as they render, rather than once they're complete. Only
+# worth turning on behind a server that streams responses, like uvicorn:
+# Mangum buffers them.
+STREAM_RESPONSES = bool(os.environ.get("STREAM_RESPONSES"))
+
+
+def page_response(
+    request: Request, name: str, context: dict, headers: dict = None
+) -> Response:
+    """
+    Render a result page, streaming it if `STREAM_RESPONSES` is set
+    """
+    templates = get_loader(request)
+    if STREAM_RESPONSES:
+        return templates.StreamingTemplateResponse(
+            request, name, context=context, headers=headers
+        )
+    return templates.TemplateResponse(
+        request, name, context=context, headers=headers
+    )
+
+
+# Result pages are cached until their content next changes (see
+# `TemplateSorter.next_change`), but for no longer than this many seconds
+# in browsers (max-age) and shared caches like CloudFront (s-maxage), as the
+# data behind them can change at any time
+RESULT_PAGE_MAX_AGE = int(os.environ.get("RESULT_PAGE_MAX_AGE", 10 * 60))
+RESULT_PAGE_S_MAXAGE = int(os.environ.get("RESULT_PAGE_S_MAXAGE", 4 * 60 * 60))
+
+
+def cache_headers(
+    changes_at: Optional[dt.datetime], now: dt.datetime = None
+) -> dict:
+    """
+    `Cache-Control` and `Expires` headers for a page that may next change
+    at `changes_at` (`None` meaning it won't, as far as we know)
+    """
+    if now is None:
+        now = dt.datetime.now(dt.timezone.utc)
+    max_age, s_maxage = RESULT_PAGE_MAX_AGE, RESULT_PAGE_S_MAXAGE
+    if changes_at is not None:
+        until_change = max(0, int((changes_at - now).total_seconds()))
+        max_age = min(max_age, until_change)
+        s_maxage = min(s_maxage, until_change)
+    expires = now + dt.timedelta(seconds=max_age)
+    return {
+        "Cache-Control": f"public, max-age={max_age}, s-maxage={s_maxage}",
+        "Expires": formatdate(expires.timestamp(), usegmt=True),
+    }
+
+
+def end_of_day(today: dt.date = None) -> dt.datetime:
+    """
+    The start of tomorrow, as a UTC datetime. Result pages are only ever
+    sorted differently from one day to the next, so won't change before
+    then.
+    """
+    if today is None:
+        today = dt.date.today()
+    return dt.datetime.combine(
+        today + dt.timedelta(days=1), dt.time.min, tzinfo=dt.timezone.utc
+    )
 
 
 def date_format(value):
@@ -271,6 +338,44 @@ def is_uncontested(cancellation_reason: CancellationReason) -> bool:
     return cancellation_reason == CancellationReason.EQUAL_CANDIDATES
 
 
+class TemplateBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    Compiled templates, kept in a directory that's filled at build time
+    (see `precompile_templates`) and shipped with the code, so cold starts
+    don't have to compile them.
+
+    Keys are made from the template name and Jinja version rather than the
+    template's path, so a cache built in one place can be used in another.
+    Jinja checks entries against a checksum of the template's source and
+    the Python version, and recompiles templates that don't match.
+
+    The deployed directory is read only, so failures to write to it (or to
+    read from it) are ignored.
+    """
+
+    def get_cache_key(self, name: str, filename: str = None) -> str:
+        return hashlib.sha1(f"{jinja2.__version__}:{name}".encode()).hexdigest()
+
+    def load_bytecode(self, bucket):
+        try:
+            super().load_bytecode(bucket)
+        except Exception:
+            bucket.reset()
+
+    def dump_bytecode(self, bucket):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+# Set to an empty string to turn off the bytecode cache
+TEMPLATE_CACHE_DIR = os.environ.get(
+    "JINJA_BYTECODE_CACHE_DIR", str(Path(__file__).parent / "template_cache")
+)
+
+
 def create_templates(locale: str) -> Jinja2Templates:
     root = Path(__file__).parent
 
@@ -278,6 +383,11 @@ def create_templates(locale: str) -> Jinja2Templates:
         loader=jinja2.FileSystemLoader(root / "templates"),
         extensions=["jinja2.ext.i18n"],
         undefined=ChainableUndefined,
+        bytecode_cache=(
+            TemplateBytecodeCache(TEMPLATE_CACHE_DIR)
+            if TEMPLATE_CACHE_DIR
+            else None
+        ),
     )
 
     env.filters["date_filter"] = date_format
@@ -298,11 +408,60 @@ def create_templates(locale: str) -> Jinja2Templates:
 
     env.install_gettext_translations(translations)
 
-    return Jinja2Templates(env=env)
+    return ShellTemplates(env=env)
+
+
+LOCALES = ("en", "cy")
+
+# Each locale's templates are created the first time they're needed, as
+# loading translations and setting up an environment adds to cold starts
+_templates: Dict[str, Jinja2Templates] = {}
+_templates_lock = threading.Lock()
 
 
-en_templates = create_templates("en")
-cy_templates = create_templates("cy")
+def get_templates(locale: str) -> Jinja2Templates:
+    templates = _templates.get(locale)
+    if templates is None:
+        with _templates_lock:
+            templates = _templates.get(locale)
+            if templates is None:
+                templates = _templates[locale] = create_templates(locale)
+    return templates
+
+
+def load_all_templates(locale: str) -> int:
+    """
+    Load (and so compile, or read from the bytecode cache) every template
+    for `locale`, returning how many there are
+    """
+    env = get_templates(locale).env
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def warm_templates(locales: Iterable[str] = LOCALES, load: bool = False):
+    """
+    Create the templates for `locales` now, rather than on first use.
+
+    For priming a container before it takes traffic. With `load`, every
+    template is loaded as well.
+    """
+    for locale in locales:
+        get_templates(locale)
+        if load:
+            load_all_templates(locale)
+
+
+def precompile_templates() -> int:
+    """
+    Compile every template into the bytecode cache, for both locales.
+
+    Run by the build (see the Makefile), returning the number of templates
+    compiled.
+    """
+    return sum(load_all_templates(locale) for locale in LOCALES)
 
 
 class i18nMiddleware:
@@ -4,6 +4,13 @@ from random import randrange
 import pytest
 import uvicorn
 from app import app
+from dc_api_client import (
+    circuit_breakers,
+    negative_cache,
+    prefetcher,
+    response_cache,
+)
+from page_cache import page_cache
 from starlette.testclient import TestClient
 from template_sorter import (
     ElectionDateTemplateSorter,
@@ -83,3 +90,12 @@ def election_date_template_sorter():
         return election_date_sorter
 
     return get_election_date_template_sorter
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    response_cache.clear()
+    negative_cache.clear()
+    circuit_breakers.clear()
+    prefetcher.clear()
+    page_cache.clear()
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+from assets import (
+    IMMUTABLE_CACHE_CONTROL,
+    StaticAssets,
+    hashed_files,
+    prune_stale_assets,
+    read_manifest,
+    write_manifest,
+)
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+OLD_CSS = "css/all.00000000000000000000000000000000.css"
+PREVIOUS_CSS = "css/all.11111111111111111111111111111111.css"
+CURRENT_CSS = "css/all.22222222222222222222222222222222.css"
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "css").mkdir()
+    for path in ("css/all.css", OLD_CSS, PREVIOUS_CSS, CURRENT_CSS):
+        (tmp_path / path).write_text("body {}\n")
+    (tmp_path / (OLD_CSS + ".gz")).write_bytes(b"")
+    return tmp_path
+
+
+def build(static_dir, css):
+    return write_manifest({"base.html": {"css/all.css": css}}, static_dir)
+
+
+def test_write_manifest_remembers_previous_build(static_dir):
+    build(static_dir, PREVIOUS_CSS)
+    manifest = build(static_dir, CURRENT_CSS)
+
+    assert manifest == read_manifest(static_dir)
+    assert hashed_files(manifest) == {CURRENT_CSS}
+    assert manifest["previous"] == [PREVIOUS_CSS]
+    assert json.loads((static_dir / "manifest.json").read_text()) == manifest
+
+
+def test_prune_stale_assets(static_dir):
+    build(static_dir, PREVIOUS_CSS)
+    build(static_dir, CURRENT_CSS)
+
+    pruned = prune_stale_assets(static_dir)
+
+    assert sorted(pruned) == [
+        static_dir / OLD_CSS,
+        static_dir / (OLD_CSS + ".gz"),
+    ]
+    assert (static_dir / PREVIOUS_CSS).exists()
+    assert (static_dir / CURRENT_CSS).exists()
+    assert (static_dir / "css/all.css").exists()
+
+
+def test_nothing_is_pruned_without_a_manifest(static_dir):
+    assert prune_stale_assets(static_dir) == []
+    assert (static_dir / OLD_CSS).exists()
+
+
+def test_static_cache_control(static_dir):
+    build(static_dir, PREVIOUS_CSS)
+    build(static_dir, CURRENT_CSS)
+    client = TestClient(
+        Starlette(
+            routes=[Mount("/static", app=StaticAssets(directory=static_dir))]
+        )
+    )
+
+    response = client.get(f"/static/{CURRENT_CSS}")
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+
+    response = client.get(
+        f"/static/{CURRENT_CSS}",
+        headers={"If-None-Match": response.headers["etag"]},
+    )
+    assert response.status_code == 304
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+
+    for path in ("css/all.css", PREVIOUS_CSS):
+        response = client.get(f"/static/{path}")
+        assert response.headers["cache-control"] == "public, max-age=300"
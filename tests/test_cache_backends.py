@@ -0,0 +1,299 @@
+import asyncio
+import sqlite3
+import time
+
+import cache_backends
+import pytest
+import pytest_asyncio
+from cache_backends import (
+    InMemoryCacheBackend,
+    MemcachedCacheBackend,
+    RedisCacheBackend,
+    SQLiteCacheBackend,
+    TieredCache,
+    cache_backend_from_url,
+    decode_entry,
+    encode_entry,
+)
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def entry():
+    return ResponseCache(ttl=60, stale_ttl=60).make_entry(
+        {"dates": [], "address_picker": False}, size=100
+    )
+
+
+@pytest_asyncio.fixture
+async def redis_server():
+    """
+    A stand-in Redis server, supporting just enough of the protocol for
+    `RedisCacheBackend`
+    """
+    store = {}
+
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int((await reader.readline())[1:-2])
+                args.append((await reader.readexactly(length + 2))[:-2])
+            command = args[0].upper()
+            if command == b"GET":
+                value = store.get(args[1])
+                if value is None:
+                    writer.write(b"$-1\r\n")
+                else:
+                    writer.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            elif command == b"SET":
+                store[args[1]] = args[2]
+                writer.write(b"+OK\r\n")
+            elif command == b"DEL":
+                writer.write(
+                    b":%d\r\n" % int(store.pop(args[1], None) is not None)
+                )
+            else:
+                writer.write(b"-ERR unknown command\r\n")
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    yield port, store
+    server.close()
+
+
+@pytest_asyncio.fixture
+async def memcached_server():
+    """
+    A stand-in Memcached server, supporting just enough of the text
+    protocol for `MemcachedCacheBackend`
+    """
+    store = {}
+
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            command, key, *rest = line.split()
+            if command == b"get":
+                value = store.get(key)
+                if value is not None:
+                    writer.write(
+                        b"VALUE %s 0 %d\r\n%s\r\n" % (key, len(value), value)
+                    )
+                writer.write(b"END\r\n")
+            elif command == b"set":
+                store[key] = (await reader.readexactly(int(rest[2]) + 2))[:-2]
+                writer.write(b"STORED\r\n")
+            elif command == b"delete":
+                writer.write(
+                    b"DELETED\r\n" if store.pop(key, None) else b"NOT_FOUND\r\n"
+                )
+            else:
+                writer.write(b"ERROR\r\n")
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    yield port, store
+    server.close()
+
+
+def test_encode_decode_round_trip(entry):
+    value = encode_entry(entry)
+    assert value.startswith(cache_backends.ENTRY_PREFIX)
+    decoded = decode_entry(value)
+    assert decoded.data == entry.data
+    assert decoded.is_fresh()
+
+
+def test_encode_decode_keeps_projection():
+    entry = ResponseCache().make_entry({}, size=1, projection=("a", "b"))
+    assert decode_entry(encode_entry(entry)).projection == ("a", "b")
+
+
+def test_decode_rejects_other_versions(entry, monkeypatch):
+    value = encode_entry(entry)
+    monkeypatch.setattr(cache_backends, "ENTRY_PREFIX", b"v1:9.9.9\n")
+    assert decode_entry(value) is None
+
+
+@pytest.mark.asyncio
+async def test_sqlite_backend(tmp_path, entry):
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.db"))
+    assert await backend.get(("live", "postcode/SW1A1AA/")) is None
+    await backend.set(("live", "postcode/SW1A1AA/"), entry)
+    assert (await backend.get(("live", "postcode/SW1A1AA/"))).data == entry.data
+    await backend.delete(("live", "postcode/SW1A1AA/"))
+    assert await backend.get(("live", "postcode/SW1A1AA/")) is None
+    await backend.close()
+
+
+def test_sqlite_backend_purges_expired_entries_on_open(tmp_path):
+    path = str(tmp_path / "cache.db")
+    SQLiteCacheBackend(path)
+    with sqlite3.connect(path) as connection:
+        connection.executemany(
+            "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            [("old", b"", time.time() - 1), ("new", b"", time.time() + 60)],
+        )
+    backend = SQLiteCacheBackend(path)
+    assert backend._execute("SELECT group_concat(key) FROM cache") == ("new",)
+
+
+@pytest.mark.asyncio
+async def test_sqlite_backend_purges_expired_entries_as_it_goes(
+    tmp_path, entry, monkeypatch
+):
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.db"))
+    backend._execute(
+        "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?)",
+        ("old", b"", time.time() - 1),
+    )
+    await backend.set("key", entry)
+    assert backend._execute("SELECT count(*) FROM cache") == (2,)
+
+    monkeypatch.setattr(backend, "purge_interval", 0)
+    await backend.set("key", entry)
+    assert backend._execute("SELECT count(*) FROM cache") == (1,)
+
+
+@pytest.mark.asyncio
+async def test_redis_backend(redis_server, entry):
+    port, store = redis_server
+    backend = RedisCacheBackend("127.0.0.1", port)
+    assert await backend.get(("live", "postcode/SW1A1AA/")) is None
+    await backend.set(("live", "postcode/SW1A1AA/"), entry)
+    assert list(store) == [b"ec-postcode-lookup:live|postcode/SW1A1AA/"]
+    assert (await backend.get(("live", "postcode/SW1A1AA/"))).data == entry.data
+    await backend.delete(("live", "postcode/SW1A1AA/"))
+    assert store == {}
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_timeout_includes_waiting_for_a_connection():
+    async def handle(reader, writer):
+        # Never reply
+        await reader.read()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    backend = RedisCacheBackend(
+        "127.0.0.1", port, timeout=0.2, max_connections=1
+    )
+    start = time.monotonic()
+    results = await asyncio.gather(
+        backend.get("a"), backend.get("b"), return_exceptions=True
+    )
+    assert [type(result) for result in results] == [TimeoutError] * 2
+    assert time.monotonic() - start < 0.35
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_pools_connections(redis_server, entry):
+    port, store = redis_server
+    backend = RedisCacheBackend("127.0.0.1", port, max_connections=2)
+    await asyncio.gather(*(backend.set(str(i), entry) for i in range(10)))
+    assert len(store) == 10
+    assert len(backend._idle) == 2
+    await backend.close()
+    assert backend._idle == []
+
+
+@pytest.mark.asyncio
+async def test_memcached_backend(memcached_server, entry):
+    port, store = memcached_server
+    backend = MemcachedCacheBackend("127.0.0.1", port)
+    assert await backend.get(("live", "postcode/SW1A 1AA/")) is None
+    await backend.set(("live", "postcode/SW1A 1AA/"), entry)
+    assert list(store) == [backend.key(("live", "postcode/SW1A 1AA/"))]
+    assert b" " not in list(store)[0]
+    assert (
+        await backend.get(("live", "postcode/SW1A 1AA/"))
+    ).data == entry.data
+    await backend.delete(("live", "postcode/SW1A 1AA/"))
+    assert store == {}
+    await backend.delete(("live", "postcode/SW1A 1AA/"))
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_promotes_shared_hits(entry):
+    l1 = InMemoryCacheBackend(ResponseCache())
+    l2 = InMemoryCacheBackend(ResponseCache())
+    await l2.set("key", entry)
+
+    cache = TieredCache(l1=l1, l2=l2)
+    assert (await cache.get("key")).data == entry.data
+    assert "key" in l1.cache
+    assert cache.stats["shared_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_ignores_shared_errors(entry):
+    # Nothing is listening on this port
+    cache = TieredCache(
+        l1=InMemoryCacheBackend(ResponseCache()),
+        l2=RedisCacheBackend("127.0.0.1", 1),
+    )
+    await cache.set("key", entry)
+    await cache.flush()
+    assert await cache.get("missing") is None
+    assert cache.stats["shared_errors"] == 2
+
+
+class SlowBackend(InMemoryCacheBackend):
+    def __init__(self):
+        super().__init__(ResponseCache())
+        self.release = asyncio.Event()
+
+    async def set(self, key, entry):
+        await self.release.wait()
+        await super().set(key, entry)
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_writes_to_shared_tier_in_background(entry):
+    l2 = SlowBackend()
+    cache = TieredCache(l1=InMemoryCacheBackend(ResponseCache()), l2=l2)
+    await asyncio.wait_for(cache.set("key", entry), 0.1)
+    assert "key" in cache.l1.cache
+    assert "key" not in l2.cache
+
+    l2.release.set()
+    await cache.flush()
+    assert "key" in l2.cache
+    assert cache._writes == {}
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_delete_waits_for_pending_write(entry):
+    l2 = SlowBackend()
+    cache = TieredCache(l1=InMemoryCacheBackend(ResponseCache()), l2=l2)
+    await cache.set("key", entry)
+    delete = asyncio.create_task(cache.delete("key"))
+    await asyncio.sleep(0)
+    l2.release.set()
+    await delete
+    assert "key" not in l2.cache
+
+
+def test_cache_backend_from_url(tmp_path):
+    assert cache_backend_from_url(None) is None
+    assert isinstance(
+        cache_backend_from_url(f"sqlite://{tmp_path}/cache.db"),
+        SQLiteCacheBackend,
+    )
+    redis = cache_backend_from_url("redis://:secret@cache.local:6380/2")
+    assert (redis.host, redis.port, redis.db, redis.password) == (
+        "cache.local",
+        6380,
+        2,
+        "secret",
+    )
+    memcached = cache_backend_from_url("memcached://cache.local")
+    assert isinstance(memcached, MemcachedCacheBackend)
+    assert (memcached.host, memcached.port) == ("cache.local", 11211)
@@ -0,0 +1,82 @@
+import circuit_breaker
+import pytest
+from circuit_breaker import BreakerState, CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_breaker(**kwargs):
+    return CircuitBreaker(
+        name="test",
+        min_calls=4,
+        error_rate_threshold=0.5,
+        slow_call_seconds=2,
+        slow_call_rate_threshold=0.75,
+        open_seconds=10,
+        half_open_calls=2,
+        **kwargs,
+    )
+
+
+def test_trips_on_error_rate(clock):
+    breaker = make_breaker()
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_success(0.1)
+    breaker.record_failure(0.1)
+    assert breaker.state == BreakerState.CLOSED
+    breaker.record_failure(0.1)
+    assert breaker.state == BreakerState.OPEN
+    assert not breaker.allow()
+    assert breaker.stats["trips"] == 1
+    assert breaker.stats["rejected"] == 1
+
+
+def test_trips_on_slow_calls(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_success(5)
+    breaker.record_success(0.1)
+    assert breaker.state == BreakerState.OPEN
+
+
+def test_half_open_recovers(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    assert breaker.state == BreakerState.OPEN
+
+    clock[0] += 10
+    assert breaker.allow()
+    assert breaker.state == BreakerState.HALF_OPEN
+    assert breaker.allow()
+    # Only `half_open_calls` probes at once
+    assert not breaker.allow()
+    breaker.record_success(0.1)
+    breaker.record_success(0.1)
+    assert breaker.state == BreakerState.CLOSED
+
+
+def test_half_open_failure_reopens(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.record_failure(0.1)
+    assert breaker.state == BreakerState.OPEN
+    assert breaker.stats["trips"] == 2
+
+
+def test_old_calls_leave_the_window(clock):
+    breaker = make_breaker(window=30)
+    for _ in range(3):
+        breaker.record_failure(0.1)
+    clock[0] += 31
+    breaker.record_failure(0.1)
+    assert breaker.state == BreakerState.CLOSED
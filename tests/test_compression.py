@@ -0,0 +1,203 @@
+import gzip
+import os
+import zlib
+
+import compression
+import pytest
+from compression import (
+    CompressionMiddleware,
+    PrecompressedStaticFiles,
+    precompress,
+    preferred_encoding,
+)
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.routing import Mount, Route
+from starlette.testclient import TestClient
+
+PAGE = "<html>" + "<p>Your polling station is</p>" * 100 + "</html>"
+
+
+async def page(request):
+    return HTMLResponse(PAGE, headers={"ETag": '"abc"'})
+
+
+async def small_page(request):
+    return HTMLResponse("<p>Hi</p>")
+
+
+async def data(request):
+    return JSONResponse({"polling_station": PAGE})
+
+
+async def text(request):
+    return PlainTextResponse(PAGE)
+
+
+async def encoded_page(request):
+    return Response(
+        gzip.compress(PAGE.encode()),
+        media_type="text/html",
+        headers={"Content-Encoding": "gzip"},
+    )
+
+
+async def streamed_page(request):
+    async def body():
+        for _ in range(3):
+            yield PAGE.encode()
+
+    return StreamingResponse(body(), media_type="text/html")
+
+
+def make_client(static_dir=None):
+    routes = [
+        Route("/page", page),
+        Route("/small-page", small_page),
+        Route("/data", data),
+        Route("/text", text),
+        Route("/encoded-page", encoded_page),
+        Route("/streamed-page", streamed_page),
+    ]
+    if static_dir:
+        routes.append(
+            Mount("/static", app=PrecompressedStaticFiles(directory=static_dir))
+        )
+    app = Starlette(
+        routes=routes, middleware=[Middleware(CompressionMiddleware)]
+    )
+    return TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding,encoding",
+    [
+        (None, None),
+        ("", None),
+        ("gzip, deflate", "gzip"),
+        ("gzip;q=0", None),
+        ("br", None),
+    ],
+)
+def test_preferred_encoding(monkeypatch, accept_encoding, encoding):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert preferred_encoding(accept_encoding) == encoding
+
+
+def test_html_is_compressed():
+    response = make_client().get("/page", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == '"abc-gzip"'
+    assert int(response.headers["content-length"]) < len(PAGE)
+    assert response.text == PAGE
+
+
+def test_json_is_compressed():
+    response = make_client().get("/data", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == {"polling_station": PAGE}
+
+
+@pytest.mark.parametrize(
+    "path,accept_encoding",
+    [
+        ("/page", "identity"),
+        ("/small-page", "gzip"),
+        ("/text", "gzip"),
+    ],
+)
+def test_not_compressed(path, accept_encoding):
+    response = make_client().get(
+        path, headers={"Accept-Encoding": accept_encoding}
+    )
+    assert "content-encoding" not in response.headers
+
+
+def test_page_is_not_compressed_twice():
+    response = make_client().get(
+        "/encoded-page", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == PAGE
+
+
+def test_streamed_page_is_compressed_as_it_is_sent():
+    response = make_client().get(
+        "/streamed-page", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.text == PAGE * 3
+
+
+def test_each_chunk_is_flushed():
+    compressor = compression.Compressor("gzip")
+    decompressor = zlib.decompressobj(31)
+    first = compressor.compress(PAGE.encode(), finish=False)
+    # Everything sent so far can be decompressed before the rest arrives
+    assert decompressor.decompress(first) == PAGE.encode()
+    last = compressor.compress(b"</html>", finish=True)
+    assert decompressor.decompress(last) == b"</html>"
+    assert decompressor.eof
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "css").mkdir()
+    (tmp_path / "css" / "all.css").write_text("body { color: red; }\n" * 200)
+    (tmp_path / "css" / "tiny.css").write_text("body {}\n")
+    return tmp_path
+
+
+def test_precompress(static_dir):
+    assert precompress(static_dir) == (2 if compression.brotli else 1)
+
+    compressed = static_dir / "css" / "all.css.gz"
+    assert (
+        gzip.decompress(compressed.read_bytes())
+        == (static_dir / "css" / "all.css").read_bytes()
+    )
+    assert not (static_dir / "css" / "tiny.css.gz").exists()
+
+
+def test_precompressed_static_files(static_dir):
+    precompress(static_dir)
+    client = make_client(static_dir)
+
+    response = client.get(
+        "/static/css/all.css", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"].startswith("text/css")
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) == (
+        (static_dir / "css" / "all.css.gz").stat().st_size
+    )
+    assert response.text == "body { color: red; }\n" * 200
+
+    response = client.get(
+        "/static/css/all.css", headers={"Accept-Encoding": "identity"}
+    )
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_stale_precompressed_copies_are_not_sent(static_dir):
+    precompress(static_dir)
+    source = static_dir / "css" / "all.css"
+    copy_mtime = (static_dir / "css" / "all.css.gz").stat().st_mtime
+    os.utime(source, (copy_mtime + 10, copy_mtime + 10))
+
+    response = make_client(static_dir).get(
+        "/static/css/all.css", headers={"Accept-Encoding": "gzip"}
+    )
+    assert "content-encoding" not in response.headers
@@ -1,14 +1,36 @@
+import asyncio
+from types import SimpleNamespace
+
+import dc_api_client
+import endpoints.utils
 import httpx
 import pytest
 from dc_api_client import (
     ApiError,
     InvalidPostcodeException,
+    InvalidUPRNException,
     LiveAPIBackend,
+    MockResponses,
+    SandboxAPIBackend,
+    SingleFlight,
+    SnapshotAPIBackend,
+    get_circuit_breaker,
+    get_http_client,
+    get_sync_http_client,
+    negative_cache,
+    prefetcher,
+    projected_key,
+    response_cache,
+    upstream_requests,
     valid_postcode,
 )
 from endpoints.election_information import base_postcode_endpoint
+from mock_responses import example_responses
+from models import ValidatedResponse
+from page_cache import page_cache
 from response_builder.v1.models.base import PostcodeLocation, RootModel
 from response_builder.v1.models.common import Point
+from snapshot import SnapshotWriter, address_key, postcode_key
 from utils import date_format
 
 
@@ -39,6 +61,357 @@ def test_get_url(respx_mock):
     client.get_postcode("SE22 8DJ")
 
 
+@pytest.mark.asyncio
+async def test_aget_url(respx_mock):
+    respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(return_value=httpx.Response(200, json={"foo": "bar"}))
+    client = LiveAPIBackend(api_key="test", request=None)
+    assert await client.aget_postcode("SE22 8DJ") == {"foo": "bar"}
+
+
+@pytest.mark.asyncio
+async def test_aget_postcode_uses_response_cache(respx_mock):
+    route = respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(return_value=httpx.Response(200, json={"foo": "bar"}))
+    client = LiveAPIBackend(api_key="test", request=None)
+    assert await client.aget_postcode("SE22 8DJ") == {"foo": "bar"}
+    assert await client.aget_postcode("se228dj") == {"foo": "bar"}
+    assert route.call_count == 1
+    assert response_cache.stats["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_are_coalesced(respx_mock):
+    route = respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(return_value=httpx.Response(200, json={"foo": "bar"}))
+    client = LiveAPIBackend(api_key="test", request=None)
+    collapsed = upstream_requests.collapsed
+
+    results = await asyncio.gather(
+        *[client.aget_postcode("SE228DJ") for _ in range(5)]
+    )
+
+    assert results == [{"foo": "bar"}] * 5
+    assert route.call_count == 1
+    assert upstream_requests.collapsed - collapsed == 4
+
+
+@pytest.mark.asyncio
+async def test_coalesced_requests_share_errors(respx_mock):
+    respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(return_value=httpx.Response(500))
+    client = LiveAPIBackend(api_key="test", request=None)
+
+    results = await asyncio.gather(
+        *[client.aget_postcode("SE228DJ") for _ in range(3)],
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, ApiError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_invalid_postcode_is_negatively_cached(respx_mock):
+    route = respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(return_value=httpx.Response(400))
+    client = LiveAPIBackend(api_key="test", request=None)
+    for _ in range(2):
+        with pytest.raises(InvalidPostcodeException):
+            await client.aget_postcode("SE228DJ")
+    assert route.call_count == 1
+    assert negative_cache.stats["hits"] == 1
+    assert len(response_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_unknown_uprn_is_negatively_cached(respx_mock):
+    route = respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/address/123/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(return_value=httpx.Response(404))
+    client = LiveAPIBackend(api_key="test", request=None)
+    for _ in range(2):
+        with pytest.raises(InvalidUPRNException):
+            await client.aget_uprn("123")
+    assert route.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_breaker_fails_fast(respx_mock):
+    route = respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(return_value=httpx.Response(503))
+    client = LiveAPIBackend(api_key="test", request=None)
+    breaker = get_circuit_breaker(LiveAPIBackend.BASE_URL)
+    for _ in range(breaker.min_calls):
+        with pytest.raises(ApiError):
+            await client.aget_postcode("SE228DJ")
+    assert breaker.stats["state"] == "open"
+
+    with pytest.raises(ApiError) as error:
+        await client.aget_postcode("SE228DJ")
+    assert error.value.status_code == 503
+    assert route.call_count == breaker.min_calls
+
+
+def test_time_budget_uses_lambda_remaining_time():
+    class LambdaContext:
+        def get_remaining_time_in_millis(self):
+            return 5000
+
+    request = SimpleNamespace(scope={"aws.context": LambdaContext()})
+    client = LiveAPIBackend(api_key="test", request=request)
+    assert client.time_budget == 3
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_is_revalidated_with_etag(respx_mock):
+    route = respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1",
+        headers={"If-None-Match": '"v1"'},
+    ).mock(
+        return_value=httpx.Response(
+            304, headers={"Cache-Control": "max-age=600"}
+        )
+    )
+    key = ("live", "postcode/SE228DJ/")
+    stale = response_cache.make_entry(
+        {"foo": "bar"}, size=10, ttl=-1, etag='"v1"'
+    )
+    response_cache.put(key, stale)
+    client = LiveAPIBackend(api_key="test", request=None)
+
+    data = await client._fetch_into_cache(
+        key, "postcode/SE228DJ/", stale_entry=stale
+    )
+
+    assert route.call_count == 1
+    assert data is stale.data
+    entry = response_cache.get(key)
+    assert entry.is_fresh()
+    assert entry.fresh_until - stale.fresh_until > 590
+
+
+@pytest.mark.asyncio
+async def test_projected_entries_dont_serve_full_requests(
+    respx_mock, monkeypatch
+):
+    monkeypatch.setattr(LiveAPIBackend, "PROJECTION_PARAM", "fields")
+    url = "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    projected_route = respx_mock.get(
+        f"{url}&fields=addresses%2Celectoral_services"
+    ).mock(return_value=httpx.Response(200, json={"addresses": []}))
+    full_route = respx_mock.get(url).mock(
+        return_value=httpx.Response(200, json={"addresses": [], "dates": []})
+    )
+    client = LiveAPIBackend(api_key="test", request=None)
+    fields = ("electoral_services", "addresses")
+
+    assert await client.aget_postcode("SE228DJ", fields=fields) == {
+        "addresses": []
+    }
+    assert await client.aget_postcode("SE228DJ", fields=fields) == {
+        "addresses": []
+    }
+    assert projected_route.call_count == 1
+
+    # The projected entry can't serve a full request...
+    assert "dates" in await client.aget_postcode("SE228DJ")
+    assert full_route.call_count == 1
+
+    # ...and the full entry can serve projected requests
+    assert "dates" in await client.aget_postcode("SE228DJ", fields=fields)
+    assert projected_route.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_projected_fetches_dont_replace_full_entries(
+    respx_mock, monkeypatch
+):
+    monkeypatch.setattr(LiveAPIBackend, "PROJECTION_PARAM", "fields")
+    key = ("live", "postcode/SE228DJ/")
+    full = response_cache.make_entry({"addresses": [], "dates": []}, size=1)
+
+    def full_fetch_finishes_first(request):
+        # A full fetch of the same postcode finished while this was in
+        # flight
+        response_cache.put(key, full)
+        return httpx.Response(200, json={"addresses": []})
+
+    respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1&fields=addresses"
+    ).mock(side_effect=full_fetch_finishes_first)
+    client = LiveAPIBackend(api_key="test", request=None)
+
+    assert await client.aget_postcode("SE228DJ", fields=["addresses"]) == {
+        "addresses": []
+    }
+    assert response_cache.get(key) is full
+    assert response_cache.get(
+        projected_key(key, ("addresses",))
+    ).projection == ("addresses",)
+
+
+@pytest.mark.asyncio
+async def test_prefetched_uprns_are_served_from_cache(respx_mock, monkeypatch):
+    monkeypatch.setattr(dc_api_client, "API_PREFETCH", True)
+    route = respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/address/1234/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(return_value=httpx.Response(200, json={"foo": "bar"}))
+    client = LiveAPIBackend(api_key="test", request=None)
+
+    client.prefetch_uprns(["1234"])
+    while prefetcher.stats["in_flight"]:
+        await asyncio.sleep(0.01)
+    assert await client.aget_uprn("1234") == {"foo": "bar"}
+
+    assert route.call_count == 1
+    assert prefetcher.stats["used"] == 1
+
+
+def test_prefetch_is_skipped_on_lambda(monkeypatch):
+    monkeypatch.setattr(dc_api_client, "API_PREFETCH", True)
+    monkeypatch.setattr(dc_api_client, "ON_LAMBDA", True)
+    client = LiveAPIBackend(api_key="test", request=None)
+    scheduled = prefetcher.stats["scheduled"]
+
+    client.prefetch_uprns(["1234"])
+    assert prefetcher.stats["scheduled"] == scheduled
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("foreground_waiting", [False, True])
+async def test_cancelled_prefetch_cancels_shared_work(foreground_waiting):
+    single_flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def fetch():
+        started.set()
+        await asyncio.sleep(1)
+        return "response"
+
+    prefetch = asyncio.create_task(
+        single_flight.do("key", fetch, foreground=False)
+    )
+    await started.wait()
+    if foreground_waiting:
+        foreground = asyncio.create_task(single_flight.do("key", fetch))
+        await asyncio.sleep(0)
+    prefetch.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await prefetch
+
+    if foreground_waiting:
+        # The user still gets the response
+        assert await foreground == "response"
+        assert single_flight.stats["cancelled"] == 0
+    else:
+        assert single_flight.stats["cancelled"] == 1
+        await asyncio.sleep(0)
+        assert single_flight.stats["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cache_ttl_from_upstream_headers(respx_mock):
+    respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(
+        return_value=httpx.Response(
+            200, json={}, headers={"Cache-Control": "no-store"}
+        )
+    )
+    client = LiveAPIBackend(api_key="test", request=None)
+    await client.aget_postcode("SE228DJ")
+    assert len(response_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_http_client_is_shared():
+    assert get_http_client() is get_http_client()
+
+
+def test_sync_http_client_is_shared():
+    client = get_sync_http_client()
+    assert client is get_sync_http_client()
+    assert client.timeout == dc_api_client.HTTP_CLIENT_TIMEOUT
+
+
+@pytest.mark.asyncio
+async def test_aget_api_error(respx_mock):
+    client = LiveAPIBackend(api_key="test", request=None)
+    respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=test&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(return_value=httpx.Response(500))
+    with pytest.raises(ApiError):
+        await client.aget_postcode("SE228DJ")
+
+
+@pytest.mark.asyncio
+async def test_sandbox_response_is_validated_once(respx_mock):
+    response = RootModel(
+        postcode_location=PostcodeLocation(
+            geometry=Point(coordinates=[], type="Point"), type="Feature"
+        )
+    ).dict()
+    respx_mock.get(url__startswith=SandboxAPIBackend.BASE_URL).mock(
+        return_value=httpx.Response(200, json=response)
+    )
+    client = SandboxAPIBackend(api_key="test", request=None)
+    result = await client.aget_postcode("AA11AA")
+    assert isinstance(result, ValidatedResponse)
+    assert result == response
+    assert result.model.postcode_location.type == "Feature"
+
+
+def test_mock_responses_are_built_once():
+    responses = MockResponses(example_responses)
+    first = responses.get("AA1 1AA")
+    assert first == example_responses["AA1 1AA"]["response"].build().dict()
+    assert responses.get("AA1 1AA") is first
+
+
+def test_mock_responses_can_be_built_up_front(monkeypatch):
+    responses = MockResponses(example_responses)
+    responses.build()
+    assert responses.stats["built"]
+    monkeypatch.setattr(responses, "_build_all", None)
+    assert responses.get("AA1 1AA") is responses.get("AA1 1AA")
+
+
+def test_rebased_mock_responses_are_memoised():
+    responses = MockResponses(example_responses, max_rebased=1)
+    rebased = responses.get("AA1 1AC", "2025-05-01")
+    assert responses.get("AA1 1AC", "2025-05-01") is rebased
+    responses.get("AA1 1AD", "2025-05-01")
+    assert responses.stats["rebased_entries"] == 1
+    assert responses.get("AA1 1AC", "2025-05-01") is not rebased
+    # The shared example builder isn't rebased
+    assert responses.get("AA1 1AC") == (
+        example_responses["AA1 1AC"]["response"].build().dict()
+    )
+
+
+@pytest.mark.asyncio
+async def test_snapshot_backend(tmp_path, monkeypatch):
+    path = tmp_path / "snapshot.bin"
+    with SnapshotWriter(path) as writer:
+        writer.add(postcode_key("SE228DJ"), {"foo": "bar"})
+        writer.add(address_key("1234"), {"baz": "qux"})
+    monkeypatch.setenv("SNAPSHOT_PATH", str(path))
+
+    client = SnapshotAPIBackend(api_key="test", request=None)
+    assert await client.aget_postcode("se22 8dj") == {"foo": "bar"}
+    assert await client.aget_uprn("1234") == {"baz": "qux"}
+    with pytest.raises(InvalidPostcodeException):
+        await client.aget_postcode("SW1A 1AA")
+    with pytest.raises(InvalidUPRNException):
+        await client.aget_uprn("5678")
+
+
 def test_get_postcode_endpoint(respx_mock, app_client):
     respx_mock.get(
         "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=ec-postcode-testing&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
@@ -60,6 +433,15 @@ def test_get_postcode_endpoint(respx_mock, app_client):
     assert resp.status_code == 200
     assert "There are no upcoming elections in your area" in resp.text
 
+    resp = app_client.get(
+        app_client.app.url_path_for("live_postcode_en"),
+        params={"postcode-search": "SE228DJ"},
+        headers={"If-None-Match": resp.headers["etag"]},
+        follow_redirects=False,
+    )
+    assert resp.status_code == 304
+    assert resp.content == b""
+
 
 def test_get_invalid_postcode_api_client(respx_mock):
     client = LiveAPIBackend(api_key="test", request=None)
@@ -86,6 +468,69 @@ def test_get_invalid_postcode_frontend(respx_mock, app_client):
     assert resp.next_request.url.query.decode() == "invalid-postcode=1"
 
 
+@pytest.mark.parametrize(
+    "query",
+    [
+        "postcode-search=se228dj",
+        "postcode-search=SE22+8DJ",
+        "postcode-search=SE22%208DJ",
+        "postcode-search=SE228DJ&Submit+Postcode=",
+        "utm_source=newsletter&postcode-search=SE228DJ",
+    ],
+)
+def test_postcode_redirects_to_canonical_url(app_client, query):
+    resp = app_client.get(
+        f"/polling-stations?{query}",
+        follow_redirects=False,
+    )
+    assert resp.status_code == 301
+    assert resp.headers["location"] == (
+        "http://testserver/polling-stations?postcode-search=SE228DJ"
+    )
+    assert "s-maxage" in resp.headers["cache-control"]
+
+
+def test_mock_canonical_url_keeps_baseline_date(app_client):
+    resp = app_client.get(
+        "/cy/mock/polling-stations",
+        params={
+            "baseline_date": "2025-05-01",
+            "postcode-search": "aa11aa",
+            "Submit Postcode": "",
+        },
+        follow_redirects=False,
+    )
+    assert resp.status_code == 301
+    assert resp.headers["location"] == (
+        "http://testserver/cy/mock/polling-stations"
+        "?postcode-search=AA1+1AA&baseline_date=2025-05-01"
+    )
+
+
+def test_canonical_url_gets_one_page_cache_entry(respx_mock, app_client):
+    respx_mock.get(
+        "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=ec-postcode-testing&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
+    ).mock(
+        return_value=httpx.Response(
+            200,
+            json=RootModel(
+                postcode_location=PostcodeLocation(
+                    geometry=Point(coordinates=[], type="Point"), type="Feature"
+                )
+            ).dict(),
+        )
+    )
+    for query in (
+        "postcode-search=se22+8dj",
+        "utm_source=newsletter&postcode-search=SE228DJ",
+    ):
+        resp = app_client.get(f"/polling-stations?{query}")
+        assert resp.status_code == 200
+        assert resp.url.query == b"postcode-search=SE228DJ"
+    assert len(page_cache.pages) == 1
+    assert page_cache.stats["hits"] == 1
+
+
 def test_api_error_frontend(respx_mock, app_client):
     respx_mock.get(
         "https://developers.democracyclub.org.uk/api/v1/postcode/SE228DJ/?auth_token=ec-postcode-testing&utm_source=ec_postcode_lookup&recall_petition=1&include_2026_pilots=1"
@@ -128,3 +573,32 @@ def test_x_forward_headers(app_client):
         headers={"X-FORWARDED-HOST": "example.com"},
     )
     assert "example.com" in resp.text
+
+
+def test_api_client_stats_need_a_token_in_production(app_client, monkeypatch):
+    response = app_client.get("/api-client-stats")
+    assert response.status_code == 200
+    assert "coalescing" in response.json()
+
+    # Production runs without debug
+    monkeypatch.setattr(app_client.app, "debug", False)
+    assert app_client.get("/api-client-stats").status_code == 404
+    assert (
+        app_client.get(
+            "/api-client-stats", headers={"X-Stats-Token": ""}
+        ).status_code
+        == 404
+    )
+
+    monkeypatch.setattr(endpoints.utils, "API_CLIENT_STATS_TOKEN", "secret")
+    assert (
+        app_client.get(
+            "/api-client-stats", headers={"X-Stats-Token": "wrong"}
+        ).status_code
+        == 404
+    )
+    response = app_client.get(
+        "/api-client-stats", headers={"X-Stats-Token": "secret"}
+    )
+    assert response.status_code == 200
+    assert "circuit_breakers" in response.json()
@@ -1,4 +1,20 @@
+import asyncio
+import csv
+import io
+import json
+
+import endpoints.electoral_services_team
+import httpx
+import pytest
 from app import app
+from dc_api_client import response_cache
+from endpoints.electoral_services_team import (
+    InvalidBulkInput,
+    bulk_lookup,
+    csv_postcodes,
+    json_postcodes,
+)
+from page_cache import page_cache
 from starlette.testclient import TestClient
 
 
@@ -13,6 +29,40 @@ def test_council_html():
     assert "Stroud Council" in response.text
 
 
+def test_council_html_page_cache():
+    client = TestClient(app)
+    url = "/mock/voting-and-elections/get-help-with-my-vote/postcode/AA1%201AA"
+    first = client.get(url)
+    second = client.get(url)
+
+    assert second.status_code == 200
+    assert second.text == first.text
+    assert page_cache.stats["hits"] == 1
+
+
+def test_council_html_not_modified():
+    client = TestClient(app)
+    url = "/mock/voting-and-elections/get-help-with-my-vote/postcode/AA1%201AA"
+    etag = client.get(url).headers["etag"]
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert "s-maxage" in response.headers["cache-control"]
+
+
+def test_council_json_not_modified():
+    client = TestClient(app)
+    url = "/mock/voting-and-elections/get-help-with-my-vote/postcode/AA1%201AA?format=json"
+    first = client.get(url)
+    html_etag = client.get(url.split("?")[0]).headers["etag"]
+    assert first.headers["etag"] != html_etag
+
+    response = client.get(url, headers={"If-None-Match": first.headers["etag"]})
+    assert response.status_code == 304
+
+
 def test_council_json():
     client = TestClient(app)
     response = client.get(
@@ -55,3 +105,217 @@ def test_vjb_json():
     assert data["registration"]["email"] == "enquiries@lothian-vjb.gov.uk"
     # council
     assert data["electoral_services"]["email"] == "elections@edinburgh.gov.uk"
+
+
+def test_bulk_json_to_ndjson():
+    client = TestClient(app)
+    response = client.post(
+        "/mock/voting-and-elections/get-help-with-my-vote/bulk",
+        json={"postcodes": ["AA1 1AA", "AA1 1AP"]},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    results = {
+        row["postcode"]: row
+        for row in map(json.loads, response.text.splitlines())
+    }
+    assert results["AA1 1AA"]["electoral_services"]["council_id"] == "STO"
+    assert (
+        results["AA1 1AP"]["registration"]["email"]
+        == "enquiries@lothian-vjb.gov.uk"
+    )
+
+
+def test_bulk_csv_to_csv():
+    client = TestClient(app)
+    response = client.post(
+        "/mock/voting-and-elections/get-help-with-my-vote/bulk?format=csv",
+        content=b"postcode\r\nAA1 1AA\r\nAA1 1AP\r\n",
+        headers={"content-type": "text/csv"},
+    )
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert sorted(row["postcode"] for row in rows) == ["AA1 1AA", "AA1 1AP"]
+    emails = {row["postcode"]: row["registration_email"] for row in rows}
+    assert emails["AA1 1AP"] == "enquiries@lothian-vjb.gov.uk"
+
+
+def test_bulk_unknown_postcode_is_an_error_row():
+    client = TestClient(app)
+    response = client.post(
+        "/mock/voting-and-elections/get-help-with-my-vote/bulk",
+        json=["AA1 1AA", "ZZ9 9ZZ"],
+    )
+
+    assert response.status_code == 200
+    results = {
+        result["postcode"]: result
+        for result in map(json.loads, response.text.splitlines())
+    }
+    assert results["AA1 1AA"]["status_code"] == 200
+    assert results["ZZ9 9ZZ"]["status_code"] == 500
+    assert results["ZZ9 9ZZ"]["error"] == "lookup failed"
+
+
+def test_bulk_csv_upload():
+    client = TestClient(app)
+    response = client.post(
+        "/mock/voting-and-elections/get-help-with-my-vote/bulk?format=csv",
+        files={"file": ("postcodes.csv", b"postcode\nAA1 1AA\n", "text/csv")},
+    )
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["postcode"] for row in rows] == ["AA1 1AA"]
+
+
+def test_bulk_upload_needs_a_file():
+    client = TestClient(app)
+    response = client.post(
+        "/mock/voting-and-elections/get-help-with-my-vote/bulk",
+        data={"postcodes": "AA1 1AA"},
+        files={"other": ("", b"", "")},
+        headers={"content-type": "multipart/form-data; boundary=x"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "body", [b"{", b'{"postcodes": "AA1 1AA"}', b'"AA1 1AA"', b"[oops]"]
+)
+def test_bulk_invalid_json_is_a_400(body):
+    client = TestClient(app)
+    response = client.post(
+        "/mock/voting-and-elections/get-help-with-my-vote/bulk",
+        content=body,
+        headers={"content-type": "application/json"},
+    )
+    assert response.status_code == 400
+
+
+def test_bulk_lookups_are_not_cached(respx_mock):
+    respx_mock.get(
+        url__startswith="https://developers.democracyclub.org.uk/api/v1/postcode/"
+    ).mock(
+        return_value=httpx.Response(
+            200,
+            json={"electoral_services": {"name": "Stroud"}, "addresses": []},
+            headers={"Cache-Control": "max-age=600"},
+        )
+    )
+    client = TestClient(app)
+    response = client.post(
+        "/voting-and-elections/get-help-with-my-vote/bulk",
+        json=["SE22 8DJ", "SW1A 1AA"],
+    )
+
+    assert [
+        json.loads(line)["status_code"] for line in response.iter_lines()
+    ] == [
+        200,
+        200,
+    ]
+    assert len(response_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_bulk_lookup_reads_postcodes_as_it_goes(monkeypatch):
+    monkeypatch.setattr(
+        endpoints.electoral_services_team, "BULK_CONCURRENCY", 2
+    )
+    read = 0
+    done = 0
+
+    class FakeBackend:
+        def __init__(self, **kwargs):
+            pass
+
+        async def aget_postcode(self, postcode, fields=None):
+            nonlocal done
+            await asyncio.sleep(0.001)
+            done += 1
+            return {"electoral_services": {"name": "Stroud"}, "addresses": []}
+
+    async def postcodes():
+        nonlocal read
+        for number in range(20):
+            # Two lookups in flight, and one postcode read ahead
+            assert read - done <= 3
+            read += 1
+            yield f"AA{number} 1AA"
+        raise InvalidBulkInput("invalid JSON")
+
+    results = [
+        result
+        async for result in bulk_lookup(postcodes(), None, FakeBackend, "")
+    ]
+    assert len(results) == 21
+    assert sum(result["status_code"] == 200 for result in results) == 20
+    assert {"postcode": "", "status_code": 400, "error": "invalid JSON"} in (
+        results
+    )
+
+
+async def chunked(body: bytes, size: int = 1):
+    for start in range(0, len(body), size):
+        yield body[start : start + size]
+
+
+async def collect(postcodes):
+    return [postcode async for postcode in postcodes]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'["AA1 1AA", "AA1 1AP", 123]',
+        b' { "postcodes" : [ "AA1 1AA" ,"AA1 1AP",123 ] } ',
+    ],
+)
+async def test_json_postcodes_are_parsed_as_they_arrive(body):
+    assert await collect(json_postcodes(chunked(body))) == [
+        "AA1 1AA",
+        "AA1 1AP",
+        "123",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_json_postcodes_empty_list():
+    assert await collect(json_postcodes(chunked(b"[ ]"))) == []
+
+
+@pytest.mark.asyncio
+async def test_json_postcodes_stop_at_invalid_json():
+    postcodes = json_postcodes(chunked(b'["AA1 1AA", oops]', size=4))
+    assert await anext(postcodes) == "AA1 1AA"
+    with pytest.raises(InvalidBulkInput):
+        await anext(postcodes)
+
+
+@pytest.mark.asyncio
+async def test_csv_postcodes_are_parsed_as_they_arrive():
+    body = '\ufeffpostcode,name\r\nAA1 1AA,Ą\r\n\r\n"AA1 1AP",x'.encode()
+    assert await collect(csv_postcodes(chunked(body))) == [
+        "AA1 1AA",
+        "AA1 1AP",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_csv_postcodes_line_length_is_limited():
+    with pytest.raises(InvalidBulkInput):
+        await collect(csv_postcodes(chunked(b"A" * 5000, size=100)))
+
+
+def test_bulk_rejects_other_content_types():
+    client = TestClient(app)
+    response = client.post(
+        "/mock/voting-and-elections/get-help-with-my-vote/bulk",
+        content=b"AA1 1AA",
+        headers={"content-type": "application/octet-stream"},
+    )
+    assert response.status_code == 415
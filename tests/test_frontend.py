@@ -3,6 +3,7 @@ import json
 import os
 import re
 import subprocess
+from urllib.parse import quote_plus
 
 import pytest
 from mock_responses import example_responses
@@ -18,6 +19,8 @@ URLS_TO_CHECK = [
     "/cy/sandbox/pleidleisio-ac-etholiadau/cael-help-gyda-fy-mhleidlais/postcode/AA11AA",
 ]
 for postcode, details in example_responses.items():
+    # Results are only rendered at canonical URLs, so go straight there
+    postcode = quote_plus(postcode)
     if details["response"].build().dates:
         for date in get_ballot_stages(datetime.date.today()).values():
             URLS_TO_CHECK.append(
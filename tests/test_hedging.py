@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+from hedging import LatencyTracker, RequestHedger
+
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(size=10)
+    for latency in range(1, 21):
+        tracker.record(latency)
+    # Only the last 10 are kept
+    assert len(tracker) == 10
+    assert tracker.percentile(0) == 11
+    assert tracker.percentile(100) == 20
+    assert tracker.percentile(50) == 15
+
+
+async def respond_after(seconds, value):
+    await asyncio.sleep(seconds)
+    return value
+
+
+def primed_hedger(**kwargs):
+    hedger = RequestHedger(
+        min_samples=5, min_delay=0.01, max_extra_load=1, **kwargs
+    )
+    for _ in range(50):
+        hedger.latencies.record(0.01)
+    return hedger
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins_when_first_request_is_slow():
+    hedger = primed_hedger()
+    responses = iter([(1, "slow"), (0.01, "hedge")])
+
+    result = await hedger.run(lambda: respond_after(*next(responses)))
+
+    assert result == "hedge"
+    assert hedger.stats["fired"] == 1
+    assert hedger.stats["won"] == 1
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_when_first_request_is_fast():
+    hedger = primed_hedger()
+    assert await hedger.run(lambda: respond_after(0, "first")) == "first"
+    assert hedger.stats["fired"] == 0
+
+
+@pytest.mark.asyncio
+async def test_hedging_is_capped_by_budget():
+    hedger = primed_hedger(burst=1)
+    hedger.max_extra_load = 0.5
+    for _ in range(2):
+        responses = iter([(0.2, "slow"), (0.01, "hedge")])
+        await hedger.run(lambda: respond_after(*next(responses)))
+    # 2 requests * 0.5 tokens = 1 hedge
+    assert hedger.stats["fired"] == 1
+    assert hedger.stats["skipped_for_budget"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_first_request_waits_for_hedge():
+    hedger = primed_hedger()
+    calls = []
+
+    async def request():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(0.05)
+            raise ValueError("upstream error")
+        await asyncio.sleep(0.1)
+        return "hedge"
+
+    assert await hedger.run(request) == "hedge"
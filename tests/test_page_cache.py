@@ -0,0 +1,192 @@
+import gzip
+
+import pytest
+from page_cache import (
+    PageCache,
+    accepted_encodings,
+    matching_etag,
+    not_modified,
+)
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, StreamingResponse
+
+BODY = b"<html>" + b"<p>Your polling station</p>" * 100 + b"</html>"
+
+
+def make_request(
+    url="/polling-stations", accept_encoding=None, if_none_match=None
+):
+    path, _, query_string = url.partition("?")
+    headers = [(b"host", b"example.com")]
+    if accept_encoding:
+        headers.append((b"accept-encoding", accept_encoding.encode()))
+    if if_none_match:
+        headers.append((b"if-none-match", if_none_match.encode()))
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "scheme": "https",
+            "server": ("example.com", 443),
+            "path": path,
+            "query_string": query_string.encode(),
+            "headers": headers,
+            "current_language": "en",
+        }
+    )
+
+
+def test_key_depends_on_response_and_url():
+    cache = PageCache()
+    request = make_request("/polling-stations?postcode-search=AA11AA")
+    key = cache.key(request, {"dates": []}, "live")
+
+    assert key == cache.key(request, {"dates": []}, "live")
+    assert key != cache.key(request, {"dates": [1]}, "live")
+    assert key != cache.key(request, {"dates": []}, "sandbox")
+    other_request = make_request("/polling-stations?postcode-search=AA12AA")
+    assert key != cache.key(other_request, {"dates": []}, "live")
+
+
+def test_fingerprint_is_remembered_for_shared_responses():
+    cache = PageCache(max_fingerprints=1)
+    response = {"dates": []}
+    fingerprint = cache.fingerprint(response)
+    assert cache._fingerprints[id(response)] == (response, fingerprint)
+
+    cache.fingerprint({"other": True})
+    assert id(response) not in cache._fingerprints
+    assert cache.fingerprint(response) == fingerprint
+
+
+def test_store_and_get():
+    cache = PageCache()
+    response = cache.store("key", HTMLResponse(BODY), "results.html", ["123"])
+    assert response.body == BODY
+
+    page = cache.get("key")
+    assert page.template_name == "results.html"
+    assert page.prefetch_uprns == ("123",)
+    assert page.bodies["identity"] == BODY
+    assert gzip.decompress(page.bodies["gzip"]) == BODY
+    assert cache.stats["hits"] == 1
+
+
+def test_errors_are_not_stored():
+    cache = PageCache()
+    cache.store("key", HTMLResponse(BODY, status_code=500), "results.html")
+    assert cache.get("key") is None
+
+
+def test_disabled():
+    cache = PageCache(max_bytes=0)
+    cache.store("key", HTMLResponse(BODY), "results.html")
+    assert cache.get("key") is None
+
+
+def test_evicts_by_size():
+    page_size = PageCache().put("key", BODY, "results.html").size
+    cache = PageCache(max_bytes=page_size * 2)
+    for key in range(5):
+        cache.store(key, HTMLResponse(BODY), "results.html")
+    assert cache.get(0) is None
+    assert cache.get(4) is not None
+    assert cache.stats["evictions"] > 0
+
+
+@pytest.mark.asyncio
+async def test_streamed_pages_are_stored_once_sent():
+    cache = PageCache()
+
+    async def body():
+        yield BODY[:10]
+        yield BODY[10:]
+
+    response = cache.store("key", StreamingResponse(body()), "results.html")
+    assert cache.get("key") is None
+    assert b"".join([chunk async for chunk in response.body_iterator]) == BODY
+    assert cache.get("key").bodies["identity"] == BODY
+
+
+@pytest.mark.parametrize(
+    "accept_encoding,content_encoding",
+    [
+        (None, None),
+        ("gzip, deflate", "gzip"),
+        ("gzip;q=0, deflate", None),
+    ],
+)
+def test_page_response_encoding(accept_encoding, content_encoding):
+    page = PageCache().put("key", BODY, "results.html")
+    response = page.response(make_request(accept_encoding=accept_encoding))
+
+    assert response.headers.get("content-encoding") == content_encoding
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["content-type"] == "text/html; charset=utf-8"
+    body = gzip.decompress(response.body) if content_encoding else response.body
+    assert body == BODY
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip, br;q=0.5, deflate;q=0") == {"gzip", "br"}
+    assert accepted_encodings("") == set()
+    assert accepted_encodings(None) == set()
+
+
+def test_page_response_headers():
+    page = PageCache().put("key", BODY, "results.html")
+    response = page.response(
+        make_request(), {"Cache-Control": "public, max-age=60"}
+    )
+    assert response.headers["cache-control"] == "public, max-age=60"
+    assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_etag_depends_on_key():
+    cache = PageCache()
+    request = make_request("/polling-stations?postcode-search=AA11AA")
+    key = cache.key(request, {"dates": []}, "live")
+
+    etag = cache.etag(key)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == PageCache().etag(key)
+    assert etag != cache.etag(cache.key(request, {"dates": [1]}, "live"))
+
+
+def test_page_response_etag_per_encoding():
+    cache = PageCache()
+    page = cache.put("key", BODY, "results.html")
+    etag = cache.etag("key")
+
+    assert page.response(make_request()).headers["etag"] == etag
+    gzipped = page.response(make_request(accept_encoding="gzip"))
+    assert gzipped.headers["etag"] == etag[:-1] + '-gzip"'
+
+
+@pytest.mark.parametrize(
+    "if_none_match,matches",
+    [
+        (None, None),
+        ('"abc"', '"abc"'),
+        ('W/"abc"', '"abc"'),
+        ('"other", "abc-gzip"', '"abc-gzip"'),
+        ("*", '"abc"'),
+        ('"abcd"', None),
+    ],
+)
+def test_matching_etag(if_none_match, matches):
+    request = make_request(if_none_match=if_none_match)
+    assert matching_etag(request, '"abc"') == matches
+
+
+def test_not_modified():
+    headers = {"Cache-Control": "public, max-age=60"}
+    assert not_modified(make_request(), '"abc"', headers) is None
+
+    response = not_modified(
+        make_request(if_none_match='"abc-gzip"'), '"abc"', headers
+    )
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == '"abc-gzip"'
+    assert response.headers["cache-control"] == "public, max-age=60"
@@ -0,0 +1,26 @@
+import pytest
+from postcodes import Postcode, postcode_validator
+
+
+@pytest.mark.parametrize(
+    "postcode,expected",
+    [
+        ("SW1A1AA", Postcode("SW1A 1AA", "SW1A1AA")),
+        ("sw1a 1aa", Postcode("SW1A 1AA", "SW1A1AA")),
+        (" SW1A  1AA", Postcode("SW1A 1AA", "SW1A1AA")),
+        ("GIR 0AA", Postcode("GIR 0AA", "GIR0AA")),
+        ("GIR 1AB", None),
+        ("FooBar", None),
+        (None, None),
+        ("", None),
+    ],
+)
+def test_validate(postcode, expected):
+    assert postcode_validator.validate(postcode) == expected
+
+
+def test_validate_many():
+    assert list(postcode_validator.validate_many(["e16an", "FAIL"])) == [
+        Postcode("E1 6AN", "E16AN"),
+        None,
+    ]
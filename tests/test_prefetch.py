@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+from prefetch import Prefetcher, prefetching
+
+
+async def wait_for_prefetches():
+    # Let scheduled prefetches run to completion
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_prefetch_runs_in_prefetching_context():
+    seen = []
+
+    async def fetch():
+        seen.append(prefetching.get())
+
+    prefetcher = Prefetcher()
+    assert prefetcher.schedule([fetch, fetch]) == 2
+    await wait_for_prefetches()
+    assert seen == [True, True]
+    assert prefetcher.stats["completed"] == 2
+    assert not prefetching.get()
+
+
+@pytest.mark.asyncio
+async def test_prefetch_fan_out_limit():
+    prefetcher = Prefetcher(max_per_request=3)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+
+    assert prefetcher.schedule([fetch] * 5) == 3
+    await wait_for_prefetches()
+    assert len(calls) == 3
+    assert prefetcher.stats["skipped_limit"] == 2
+
+
+@pytest.mark.asyncio
+async def test_prefetch_concurrency_limit():
+    prefetcher = Prefetcher(max_concurrent=2)
+    running = 0
+    most_running = 0
+
+    async def fetch():
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    prefetcher.schedule([fetch] * 6)
+    await asyncio.sleep(0.1)
+    assert most_running == 2
+    assert prefetcher.stats["completed"] == 6
+
+
+@pytest.mark.asyncio
+async def test_prefetch_is_skipped_and_cancelled_when_busy():
+    prefetcher = Prefetcher(busy_threshold=2)
+    started = asyncio.Event()
+
+    async def slow_fetch():
+        started.set()
+        await asyncio.sleep(10)
+
+    prefetcher.schedule([slow_fetch])
+    await started.wait()
+
+    with prefetcher.foreground(), prefetcher.foreground():
+        assert prefetcher.busy
+        assert prefetcher.schedule([slow_fetch]) == 0
+        await wait_for_prefetches()
+
+    assert prefetcher.stats["cancelled"] == 1
+    assert prefetcher.stats["skipped_busy"] == 1
+    assert not prefetcher.busy
+
+
+@pytest.mark.asyncio
+async def test_failed_prefetches_are_counted():
+    async def fetch():
+        raise ValueError
+
+    prefetcher = Prefetcher()
+    prefetcher.schedule([fetch])
+    await wait_for_prefetches()
+    assert prefetcher.stats["failed"] == 1
+
+
+def test_used_prefetches_are_counted():
+    prefetcher = Prefetcher(max_tracked=2)
+    for key in ("a", "b", "c"):
+        prefetcher.track(key)
+    prefetcher.mark_used("c")
+    prefetcher.mark_used("c")
+    prefetcher.mark_used("a")
+
+    assert prefetcher.stats["used"] == 1
+    assert prefetcher.stats["unused"] == 1
+    assert prefetcher.stats["awaiting_use"] == 1
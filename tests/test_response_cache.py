@@ -0,0 +1,103 @@
+import pytest
+import response_cache
+from response_cache import ResponseCache, freshness_lifetime
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_hit_and_miss(clock):
+    cache = ResponseCache()
+    assert cache.get("a") is None
+    cache.set("a", {"foo": "bar"}, size=10)
+    assert cache.get("a").data == {"foo": "bar"}
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+
+
+def test_stale_while_revalidate(clock):
+    cache = ResponseCache(ttl=60, stale_ttl=300)
+    cache.set("a", {}, size=10)
+
+    clock[0] += 61
+    entry = cache.get("a")
+    assert entry is not None
+    assert not entry.is_fresh()
+    assert cache.stats["stale_hits"] == 1
+
+    clock[0] += 300
+    assert cache.get("a") is None
+    assert "a" not in cache
+
+
+def test_evicts_least_recently_used_by_count(clock):
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", {}, size=1)
+    cache.set("b", {}, size=1)
+    cache.get("a")
+    cache.set("c", {}, size=1)
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.stats["evictions"] == 1
+
+
+def test_evicts_by_bytes(clock):
+    cache = ResponseCache(max_bytes=100)
+    cache.set("a", {}, size=60)
+    cache.set("b", {}, size=60)
+    assert "a" not in cache
+    assert cache.current_bytes == 60
+
+    # Entries bigger than the whole cache aren't stored
+    cache.set("c", {}, size=101)
+    assert "c" not in cache
+    assert "b" in cache
+
+
+@pytest.mark.parametrize(
+    "headers,expected",
+    [
+        ({}, None),
+        ({"cache-control": "public, max-age=300"}, 300),
+        ({"cache-control": "max-age=300, s-maxage=600"}, 600),
+        ({"cache-control": "max-age=300", "age": "100"}, 200),
+        ({"cache-control": "no-store"}, 0),
+        (
+            {
+                "date": "Thu, 07 May 2026 10:00:00 GMT",
+                "expires": "Thu, 07 May 2026 10:02:00 GMT",
+            },
+            120,
+        ),
+        ({"expires": "0"}, 0),
+    ],
+)
+def test_freshness_lifetime(headers, expected):
+    assert freshness_lifetime(headers) == expected
+
+
+def test_conditional_headers():
+    entry = ResponseCache().make_entry(
+        {}, size=1, etag='"abc"', last_modified="Thu, 07 May 2026 10:00:00 GMT"
+    )
+    assert entry.conditional_headers == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Thu, 07 May 2026 10:00:00 GMT",
+    }
+
+
+def test_projected_entries_only_cover_their_fields():
+    cache = ResponseCache()
+    full = cache.make_entry({}, size=1)
+    projected = cache.make_entry({}, size=1, projection=("a", "b"))
+
+    assert full.covers(None)
+    assert full.covers(("a",))
+    assert projected.covers(("a",))
+    assert projected.covers(("a", "b"))
+    assert not projected.covers(("a", "c"))
+    assert not projected.covers(None)
@@ -1,6 +1,8 @@
 import datetime
+from types import SimpleNamespace
 
 from freezegun import freeze_time
+from template_sorter import TemplateSorter
 from uk_election_timetables.election_ids import from_election_id
 
 
@@ -70,3 +72,50 @@ def test_uk_election_timetable():
 #     """this tests is after election day. test that the page shows
 #     no upcoming elections. test that the page only shows registration
 #     information"""
+
+
+def make_api_response(poll_date: str, election_id: str):
+    ballot = SimpleNamespace(
+        election_id=election_id,
+        ballot_paper_id=election_id.replace(".", ".stroud.", 1),
+        cancelled=False,
+        cancellation_reason=None,
+    )
+    date = SimpleNamespace(
+        date=poll_date,
+        ballots=[ballot],
+        alternative_voting_stations=None,
+        polling_station=SimpleNamespace(polling_station_known=True),
+    )
+    return SimpleNamespace(
+        dates=[date], electoral_services=None, registration=None
+    )
+
+
+@freeze_time("2024-04-12")
+def test_next_change_is_next_timetable_event():
+    sorter = TemplateSorter(
+        make_api_response("2024-05-02", "local.2024-05-02"),
+        current_date=datetime.date(2024, 4, 12),
+    )
+    # The registration deadline
+    assert sorter.next_change == datetime.datetime(
+        2024, 4, 16, tzinfo=datetime.timezone.utc
+    )
+
+
+@freeze_time("2024-05-01")
+def test_next_change_counts_back_from_polling_day():
+    sorter = TemplateSorter(
+        make_api_response("2024-05-02", "local.2024-05-02"),
+        current_date=datetime.date(2024, 5, 1),
+    )
+    # Polling day has its own title
+    assert sorter.next_change == datetime.datetime(
+        2024, 5, 2, tzinfo=datetime.timezone.utc
+    )
+
+
+def test_next_change_no_upcoming_elections():
+    sorter = TemplateSorter(SimpleNamespace(dates=[]))
+    assert sorter.next_change is None
@@ -0,0 +1,177 @@
+from pathlib import Path
+
+import jinja2
+import pytest
+from shells import (
+    NotShellable,
+    ShellTemplates,
+    generate_bytes,
+    get_shell,
+    read_shell,
+    render_bytes,
+    split_template,
+    write_shell,
+)
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+TEMPLATES_DIR = Path(__file__).parent.parent / "postcode_lookup" / "templates"
+
+BASE = """<html><title>{% block title %}Default{% endblock title %}</title>
+<body>{% block content %}{% endblock content %}</body></html>
+"""
+
+PAGE = """{% extends request.base_template %}
+{% block title %}{{ super() }} | {{ name }}{% endblock title %}
+{% block content %}<p>Hello {{ name }}</p>{% endblock content %}
+"""
+
+
+@pytest.fixture
+def env():
+    return jinja2.Environment(
+        loader=jinja2.DictLoader({"base.html": BASE, "page.html": PAGE})
+    )
+
+
+def make_request(base_template="base.html"):
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [],
+            "base_template": base_template,
+        }
+    )
+
+
+def test_split_template():
+    assert split_template(BASE) == [
+        b"<html><title>",
+        "title",
+        b"</title>\n<body>",
+        "content",
+        b"</body></html>",
+    ]
+
+
+def test_split_template_dynamic_content_outside_blocks():
+    with pytest.raises(NotShellable):
+        split_template("<p>{{ name }}</p>{% block content %}{% endblock %}")
+
+
+@pytest.mark.parametrize("name", ["base.html", "base_cy.html"])
+def test_committed_shells_are_current(name):
+    source = (TEMPLATES_DIR / name).read_text()
+    assert read_shell(name, source) == split_template(source)
+
+
+def test_read_shell_stale(tmp_path):
+    write_shell("base.html", BASE, directory=tmp_path)
+    assert read_shell("base.html", BASE, directory=tmp_path)
+    assert read_shell("base.html", BASE + "changed", directory=tmp_path) is None
+    assert read_shell("other.html", BASE, directory=tmp_path) is None
+
+
+def test_render_through_shell(env):
+    page = env.get_template("page.html")
+    context = {"name": "Wales ❤", "request": {"base_template": "base.html"}}
+    expected = page.render(context).encode()
+
+    context["request"] = {"base_template": get_shell(env, "base.html")}
+    assert render_bytes(page, context) == expected
+
+
+def test_no_shell_for_dynamic_base():
+    env = jinja2.Environment(
+        loader=jinja2.DictLoader(
+            {"base.html": "{{ name }}{% block a %}{% endblock %}"}
+        )
+    )
+    assert get_shell(env, "base.html") is None
+
+
+def test_shell_template_response(env):
+    templates = ShellTemplates(env=env)
+    request = make_request()
+    response = templates.TemplateResponse(
+        request, "page.html", context={"name": "Bob"}
+    )
+    assert response.body == (
+        b"<html><title>Default | Bob</title>\n"
+        b"<body><p>Hello Bob</p></body></html>"
+    )
+    assert response.headers["content-type"] == "text/html; charset=utf-8"
+    assert request.scope["base_template"] == "base.html"
+
+
+def test_shell_template_response_without_shell():
+    env = jinja2.Environment(
+        loader=jinja2.DictLoader(
+            {
+                "base.html": "{{ name }}{% block a %}{% endblock %}",
+                "page.html": PAGE,
+            }
+        )
+    )
+    response = ShellTemplates(env=env).TemplateResponse(
+        make_request(), "page.html", context={"name": "Bob"}
+    )
+    assert response.body == b"Bob"
+
+
+def test_generate_bytes_chunks(env):
+    page = env.get_template("page.html")
+    context = {"name": "Bob", "request": {"base_template": "base.html"}}
+    expected = render_bytes(page, context)
+
+    chunks = list(generate_bytes(page, context, chunk_size=10))
+    assert b"".join(chunks) == expected
+    assert len(chunks) > 1
+    assert all(len(chunk) >= 10 for chunk in chunks[:-1])
+
+
+def test_streaming_template_response(env):
+    templates = ShellTemplates(env=env)
+
+    async def page(request):
+        request.scope["base_template"] = "base.html"
+        return templates.StreamingTemplateResponse(
+            request, "page.html", context={"name": "Bob"}
+        )
+
+    client = TestClient(Starlette(routes=[Route("/", page)]))
+    response = client.get("/")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/html; charset=utf-8"
+    assert response.content == (
+        b"<html><title>Default | Bob</title>\n"
+        b"<body><p>Hello Bob</p></body></html>"
+    )
+
+
+def test_streaming_template_error_in_first_chunk_is_a_500():
+    env = jinja2.Environment(
+        loader=jinja2.DictLoader(
+            {
+                "base.html": BASE,
+                "broken.html": "{% extends request.base_template %}"
+                "{% block title %}{{ name.missing() }}{% endblock title %}",
+            }
+        )
+    )
+    templates = ShellTemplates(env=env)
+
+    async def page(request):
+        request.scope["base_template"] = "base.html"
+        return templates.StreamingTemplateResponse(
+            request, "broken.html", context={"name": "Bob"}
+        )
+
+    client = TestClient(
+        Starlette(routes=[Route("/", page)]), raise_server_exceptions=False
+    )
+    assert client.get("/").status_code == 500
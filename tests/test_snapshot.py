@@ -0,0 +1,209 @@
+import asyncio
+
+import dc_api_client
+import pytest
+from snapshot import (
+    SnapshotFormatError,
+    SnapshotReader,
+    SnapshotWriter,
+    address_key,
+    anonymise_response,
+    postcode_key,
+    pseudonymous_uprn,
+    record,
+)
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = tmp_path / "snapshot.bin"
+    with SnapshotWriter(path) as writer:
+        for number in range(100):
+            writer.add(postcode_key(f"AA{number}1AA"), {"number": number})
+        writer.add(address_key("1234"), {"addresses": []})
+        writer.add(postcode_key("AA01AA"), {"number": "replaced"})
+    return path
+
+
+def test_snapshot_round_trip(snapshot_path):
+    reader = SnapshotReader(snapshot_path)
+    assert len(reader) == 101
+    assert reader.get(postcode_key("AA421AA")) == {"number": 42}
+    assert reader.get(address_key("1234")) == {"addresses": []}
+    assert postcode_key("AA991AA") in reader
+    reader.close()
+
+
+def test_snapshot_missing_key(snapshot_path):
+    reader = SnapshotReader(snapshot_path)
+    assert reader.get(postcode_key("ZZ11ZZ")) is None
+    assert address_key("AA11AA") not in reader
+    reader.close()
+
+
+def test_snapshot_last_write_wins(snapshot_path):
+    reader = SnapshotReader(snapshot_path)
+    assert reader.get(postcode_key("AA01AA")) == {"number": "replaced"}
+    reader.close()
+
+
+def test_empty_snapshot(tmp_path):
+    path = tmp_path / "empty.bin"
+    with SnapshotWriter(path):
+        pass
+    reader = SnapshotReader(path)
+    assert len(reader) == 0
+    assert reader.get(postcode_key("AA11AA")) is None
+    reader.close()
+
+
+def test_empty_file_is_not_a_snapshot(tmp_path):
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+    with pytest.raises(SnapshotFormatError):
+        SnapshotReader(path)
+
+
+def test_not_a_snapshot(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a snapshot, but long enough to have a header")
+    with pytest.raises(SnapshotFormatError):
+        SnapshotReader(path)
+
+
+def test_anonymise_response():
+    response = {
+        "address_picker": True,
+        "addresses": [
+            {
+                "address": "1 High Street",
+                "postcode": "AA1 1AA",
+                "slug": "123",
+                "url": "https://example.com/api/v1/address/123/",
+            },
+            {
+                "address": "2 High Street",
+                "postcode": "AA1 1AA",
+                "slug": "456",
+                "url": "https://example.com/api/v1/uprn?id=456",
+            },
+        ],
+        "postcode_location": {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [-0.123456, 51.5]},
+        },
+    }
+    anonymised = anonymise_response(response, salt="salt")
+
+    assert [a["address"] for a in anonymised["addresses"]] == [
+        "1 Example Street",
+        "2 Example Street",
+    ]
+    assert anonymised["addresses"][0]["slug"] == pseudonymous_uprn(
+        "123", "salt"
+    )
+    assert anonymised["addresses"][0]["slug"] != "123"
+    assert anonymised["addresses"][0]["url"] == (
+        "https://example.com/api/v1/address/"
+        f"{pseudonymous_uprn('123', 'salt')}/"
+    )
+    # URLs the UPRN can't be swapped out of are dropped
+    assert "url" not in anonymised["addresses"][1]
+    assert anonymised["postcode_location"]["geometry"]["coordinates"] == [
+        -0.12,
+        51.5,
+    ]
+    # The original isn't changed
+    assert response["addresses"][0]["address"] == "1 High Street"
+
+
+def test_pseudonymous_uprn_is_stable():
+    assert pseudonymous_uprn("123", "a") == pseudonymous_uprn("123", "a")
+    assert pseudonymous_uprn("123", "a") != pseudonymous_uprn("123", "b")
+
+
+def test_record_reads_postcodes_as_it_goes(monkeypatch, tmp_path):
+    in_flight = 0
+    most_in_flight = 0
+    read = 0
+    done = 0
+
+    class FakeBackend:
+        def __init__(self, **kwargs):
+            pass
+
+        async def aget_postcode(self, postcode):
+            nonlocal in_flight, most_in_flight, done
+            in_flight += 1
+            most_in_flight = max(most_in_flight, in_flight)
+            await asyncio.sleep(0)
+            in_flight -= 1
+            done += 1
+            return {"address_picker": False, "postcode": postcode}
+
+    monkeypatch.setattr(dc_api_client, "LiveAPIBackend", FakeBackend)
+
+    def postcodes():
+        nonlocal read
+        for number in range(20):
+            # Only read when a worker is free
+            assert read - done < 2
+            read += 1
+            yield f"AA{number} 1AA"
+        yield "not a postcode"
+
+    with SnapshotWriter(tmp_path / "snapshot.bin") as writer:
+        skipped = asyncio.run(
+            record(postcodes(), writer, api_key="key", concurrency=2)
+        )
+        assert len(writer) == 20
+    assert skipped == 1
+    assert most_in_flight == 2
+
+
+def test_record_looks_up_addresses_in_the_worker_pool(monkeypatch, tmp_path):
+    in_flight = 0
+    most_in_flight = 0
+
+    async def lookup(response):
+        nonlocal in_flight, most_in_flight
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return response
+
+    class FakeBackend:
+        def __init__(self, **kwargs):
+            pass
+
+        async def aget_postcode(self, postcode):
+            return await lookup(
+                {
+                    "address_picker": True,
+                    "addresses": [
+                        {"slug": f"{postcode}-{number}"} for number in range(5)
+                    ],
+                }
+            )
+
+        async def aget_uprn(self, uprn):
+            return await lookup({"uprn": uprn})
+
+    monkeypatch.setattr(dc_api_client, "LiveAPIBackend", FakeBackend)
+
+    with SnapshotWriter(tmp_path / "snapshot.bin") as writer:
+        skipped = asyncio.run(
+            record(
+                ["AA1 1AA", "AA2 1AA", "AA3 1AA"],
+                writer,
+                api_key="key",
+                concurrency=4,
+            )
+        )
+        assert len(writer) == 3 + 3 * 5
+    assert skipped == 0
+    assert most_in_flight == 4
+    reader = SnapshotReader(tmp_path / "snapshot.bin")
+    assert reader.get(address_key("AA31AA-4")) == {"uprn": "AA31AA-4"}
+    reader.close()
@@ -1,7 +1,19 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 from types import SimpleNamespace
 
+import jinja2
 import pytest
-from utils import candidates_groupby_party_list, nl2br
+import utils
+from utils import (
+    TemplateBytecodeCache,
+    cache_headers,
+    candidates_groupby_party_list,
+    end_of_day,
+    get_templates,
+    nl2br,
+    warm_templates,
+)
 
 nl2br_testcases = [
     ["abc", "abc"],
@@ -65,3 +77,101 @@ def test_candidates_groupby_party_list_xss():
     )
 
     assert str(result) == expected
+
+
+def template_env(tmp_path, cache_dir):
+    templates = tmp_path / "templates"
+    templates.mkdir(exist_ok=True)
+    (templates / "page.html").write_text("Hello {{ name }}")
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(templates),
+        bytecode_cache=TemplateBytecodeCache(str(cache_dir)),
+    )
+
+
+def test_bytecode_cache_is_used(tmp_path):
+    cache_dir = tmp_path / "cache"
+    template_env(tmp_path, cache_dir).get_template("page.html")
+    assert len(list(cache_dir.iterdir())) == 1
+
+    env = template_env(tmp_path, cache_dir)
+
+    def compile(*args, **kwargs):
+        raise AssertionError("template was compiled again")
+
+    env.compile = compile
+    assert env.get_template("page.html").render(name="x") == "Hello x"
+
+
+def test_bytecode_cache_key_ignores_path():
+    cache = TemplateBytecodeCache("/tmp")
+    assert cache.get_cache_key("page.html", "/a/page.html") == (
+        cache.get_cache_key("page.html", "/var/task/page.html")
+    )
+
+
+def test_bytecode_cache_ignores_bad_entries(tmp_path):
+    cache_dir = tmp_path / "cache"
+    template_env(tmp_path, cache_dir).get_template("page.html")
+    for entry in cache_dir.iterdir():
+        entry.write_bytes(b"not bytecode")
+
+    env = template_env(tmp_path, cache_dir)
+    assert env.get_template("page.html").render(name="x") == "Hello x"
+
+
+def test_bytecode_cache_ignores_write_errors(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.write_text("a file where the directory should be")
+    env = template_env(tmp_path, cache_dir)
+    assert env.get_template("page.html").render(name="x") == "Hello x"
+
+
+def test_templates_are_created_once_on_first_use(monkeypatch):
+    monkeypatch.setattr(utils, "_templates", {})
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(get_templates, ["cy"] * 4))
+    assert all(templates is results[0] for templates in results)
+    assert list(utils._templates) == ["cy"]
+
+
+def test_warm_templates(monkeypatch):
+    monkeypatch.setattr(utils, "_templates", {})
+    warm_templates(["en"])
+    assert list(utils._templates) == ["en"]
+
+
+NOW = datetime.datetime(2024, 4, 12, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_cache_headers_capped_by_ceiling(monkeypatch):
+    monkeypatch.setattr(utils, "RESULT_PAGE_MAX_AGE", 600)
+    monkeypatch.setattr(utils, "RESULT_PAGE_S_MAXAGE", 14400)
+    headers = cache_headers(None, now=NOW)
+    assert headers["Cache-Control"] == "public, max-age=600, s-maxage=14400"
+    assert headers["Expires"] == "Fri, 12 Apr 2024 12:10:00 GMT"
+
+
+def test_cache_headers_until_next_change(monkeypatch):
+    monkeypatch.setattr(utils, "RESULT_PAGE_MAX_AGE", 600)
+    monkeypatch.setattr(utils, "RESULT_PAGE_S_MAXAGE", 14400)
+    changes_at = datetime.datetime(2024, 4, 13, tzinfo=datetime.timezone.utc)
+
+    headers = cache_headers(changes_at, now=NOW)
+    assert headers["Cache-Control"] == "public, max-age=600, s-maxage=14400"
+
+    headers = cache_headers(
+        changes_at, now=changes_at - datetime.timedelta(minutes=5)
+    )
+    assert headers["Cache-Control"] == "public, max-age=300, s-maxage=300"
+
+    headers = cache_headers(
+        changes_at, now=changes_at + datetime.timedelta(minutes=5)
+    )
+    assert headers["Cache-Control"] == "public, max-age=0, s-maxage=0"
+
+
+def test_end_of_day():
+    assert end_of_day(datetime.date(2024, 4, 30)) == datetime.datetime(
+        2024, 5, 1, tzinfo=datetime.timezone.utc
+    )